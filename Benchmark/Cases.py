@@ -0,0 +1,125 @@
+import itertools
+import os
+import struct
+import uuid
+
+from Server.OpCodes import RequestCodes, ResponseCodes, MessageTypes
+from Server.ProtocolDefenitions import S_CLIENT_ID, S_PUBLIC_KEY, SERVER_VERSION, S_MESSAGE_ID
+from Server.Request import unpack_request_header
+from Server.Response import BaseResponse, MessageResponse, ResponsePayload_PullMessage
+from Benchmark.Microbench import BenchCase
+
+TEXT_MESSAGE_SIZE = 64
+FILE_MESSAGE_SIZE = 64 * 1024
+
+
+def codec_cases() -> list[BenchCase]:
+    header = struct.pack(f"<{S_CLIENT_ID}sBHI", os.urandom(S_CLIENT_ID), SERVER_VERSION,
+                         RequestCodes.REQC_SEND_MESSAGE.value, 100)
+    client_id = os.urandom(S_CLIENT_ID)
+    message_response = BaseResponse(SERVER_VERSION, ResponseCodes.RESC_SEND_MESSAGE, S_CLIENT_ID + S_MESSAGE_ID,
+                                    MessageResponse(client_id, 1))
+    bytes_response = BaseResponse(SERVER_VERSION, ResponseCodes.RESC_PUBLIC_KEY, S_CLIENT_ID + S_PUBLIC_KEY,
+                                  os.urandom(S_CLIENT_ID + S_PUBLIC_KEY))
+    empty_pull_message = ResponsePayload_PullMessage(client_id, 1, MessageTypes.REQ_SYMMETRIC_KEY, 0, None)
+    text_pull_message = ResponsePayload_PullMessage(client_id, 1, MessageTypes.SEND_TEXT_MESSAGE, TEXT_MESSAGE_SIZE,
+                                                    os.urandom(TEXT_MESSAGE_SIZE))
+    file_pull_message = ResponsePayload_PullMessage(client_id, 1, MessageTypes.SEND_FILE, FILE_MESSAGE_SIZE,
+                                                    os.urandom(FILE_MESSAGE_SIZE))
+
+    return [
+        BenchCase("unpack_request_header", lambda _: lambda: unpack_request_header(header)),
+        BenchCase("BaseResponse.pack[MessageResponse]", lambda _: message_response.pack),
+        BenchCase("BaseResponse.pack[bytes]", lambda _: bytes_response.pack),
+        BenchCase("ResponsePayload_PullMessage.pack[empty]", lambda _: empty_pull_message.pack),
+        BenchCase("ResponsePayload_PullMessage.pack[text]", lambda _: text_pull_message.pack),
+        BenchCase("ResponsePayload_PullMessage.pack[file]", lambda _: file_pull_message.pack, number=1000),
+    ]
+
+
+def sanitizer_cases() -> list[BenchCase]:
+    from Database.Sanitizer import UsersSanitizer
+
+    short_username = "shlomi"
+    long_username = "a" * 255
+    client_id = uuid.uuid4().hex
+
+    return [
+        BenchCase("UsersSanitizer.username[short]", lambda _: lambda: UsersSanitizer.username(short_username)),
+        BenchCase("UsersSanitizer.username[long]", lambda _: lambda: UsersSanitizer.username(long_username), number=1000),
+        BenchCase("UsersSanitizer.client_id", lambda _: lambda: UsersSanitizer.client_id(client_id)),
+    ]
+
+
+def seed_database(db, users: int, messages_per_user: int) -> list[str]:
+    """
+    Register users and insert messages through the Database API, so the mailbox counters and cache are as they
+    would be on a running server.
+    :return: Client ids (hex) of the seeded users
+    """
+    pub_key = os.urandom(S_PUBLIC_KEY)
+    client_ids = [db.register_user(f"user{i}", pub_key)[1].hex() for i in range(users)]
+    content = os.urandom(TEXT_MESSAGE_SIZE)
+    for to_client in client_ids:
+        for _ in range(messages_per_user):
+            db.insert_message(to_client, client_ids[0], MessageTypes.SEND_TEXT_MESSAGE.value, content)
+    return client_ids
+
+
+def database_cases(db, client_ids: list[str]) -> list[BenchCase]:
+    """
+    :param db: Seeded Database
+    :param client_ids: Seeded client ids. The first one is the sender of all seeded messages.
+    """
+    sender = client_ids[0]
+    recipient = client_ids[len(client_ids) // 2]
+    username = f"user{len(client_ids) // 2}"
+    pub_key = os.urandom(S_PUBLIC_KEY)
+    content = os.urandom(TEXT_MESSAGE_SIZE)
+    names = (f"bench{i}" for i in itertools.count())
+
+    # Empty mailbox, so reading it doesn't get slower while other cases insert messages.
+    inbox = db.register_user("inbox", pub_key)[1].hex()
+
+    def insert_messages(calls: int) -> list[int]:
+        return [db.insert_message(inbox, sender, MessageTypes.SEND_TEXT_MESSAGE.value, content)[1] for _ in range(calls)]
+
+    def setup_delete_message(calls: int):
+        ids = iter(insert_messages(calls))
+        return lambda: db.delete_message(next(ids))
+
+    def setup_set_message_content(calls: int):
+        message_id = insert_messages(1)[0]
+        return lambda: db.set_message_content(message_id, content)
+
+    def setup_delete_messages_up_to(calls: int):
+        ids = iter(insert_messages(calls))
+        return lambda: db.delete_messages_up_to(inbox, next(ids))
+
+    def get_messages_miss():
+        db.mailbox_cache.drop(recipient)
+        return db.get_messages(recipient)
+
+    def get_messages_page_miss():
+        db.mailbox_cache.drop(recipient)
+        return db.get_messages_page(recipient, 0, 4096, 10)
+
+    return [
+        BenchCase("Database.register_user", lambda _: lambda: db.register_user(next(names), pub_key), number=200, repeat=3),
+        BenchCase("Database.get_user", lambda _: lambda: db.get_user(username), number=1000),
+        BenchCase("Database.get_all_users", lambda _: db.get_all_users, number=20, repeat=3),
+        BenchCase("Database.is_client_exists", lambda _: lambda: db.is_client_exists(recipient), number=1000),
+        BenchCase("Database.get_user_by_client_id", lambda _: lambda: db.get_user_by_client_id(recipient), number=1000),
+        BenchCase("Database.update_last_seen", lambda _: lambda: db.update_last_seen(recipient), number=200, repeat=3),
+        BenchCase("Database.insert_message",
+                  lambda _: lambda: db.insert_message(inbox, sender, MessageTypes.SEND_TEXT_MESSAGE.value, content),
+                  number=200, repeat=3),
+        BenchCase("Database.set_message_content", setup_set_message_content, number=200, repeat=3),
+        BenchCase("Database.delete_message", setup_delete_message, number=200, repeat=3),
+        BenchCase("Database.delete_messages_up_to", setup_delete_messages_up_to, number=200, repeat=3),
+        BenchCase("Database.get_messages", lambda _: lambda: db.get_messages(recipient), number=1000),
+        BenchCase("Database.get_messages_page", lambda _: lambda: db.get_messages_page(recipient, 0, 4096, 10), number=1000),
+        # Mailbox not resident in the cache, read from the DB on every call
+        BenchCase("Database.get_messages[miss]", lambda _: get_messages_miss, number=1000),
+        BenchCase("Database.get_messages_page[miss]", lambda _: get_messages_page_miss, number=1000),
+    ]
@@ -0,0 +1,99 @@
+import gc
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Callable, Optional
+
+# Setup function gets the total amount of calls that will be made, and returns the function to benchmark.
+# Stateful benchmarks (for example deleting messages) prepare enough state for all the calls.
+BenchSetup = Callable[[int], Callable[[], object]]
+
+
+@dataclass
+class BenchCase:
+    name: str
+    setup: BenchSetup
+    number: int = 10000  # Calls per repeat
+    repeat: int = 5
+
+
+@dataclass
+class BenchResult:
+    name: str
+    ops_per_sec: float  # Best of the repeats
+    peak_alloc_bytes: float  # Average peak of traced memory allocated during a single call
+    calls: int
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+ALLOCATION_CALLS = 20  # Calls measured with tracemalloc, separately from the timed calls.
+
+
+def run_case(case: BenchCase, number: Optional[int] = None) -> BenchResult:
+    """
+    Time the case function, then measure its allocations. Timing and allocation tracing are done separately,
+    because tracemalloc slows down every allocation.
+    :param case: Benchmark case
+    :param number: Override calls per repeat
+    :return: BenchResult
+    """
+    number = number if number is not None else case.number
+    func = case.setup(number * case.repeat + ALLOCATION_CALLS)
+
+    best = float("inf")
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(case.repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            best = min(best, time.perf_counter() - start)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    tracemalloc.start()
+    try:
+        total_peak = 0
+        for _ in range(ALLOCATION_CALLS):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+            total_peak += peak - before
+    finally:
+        tracemalloc.stop()
+
+    return BenchResult(case.name, number / best if best > 0 else float("inf"), total_peak / ALLOCATION_CALLS,
+                       number * case.repeat)
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], tolerance: float,
+            alloc_slack_bytes: int = 256) -> list[str]:
+    """
+    Compare results with a saved baseline.
+    :param results: Name to result dict
+    :param baseline: Name to result dict
+    :param tolerance: Allowed relative slowdown (and allocations growth), for example 0.2 is 20%
+    :param alloc_slack_bytes: Allowed absolute allocations growth, so tiny numbers don't fail on noise
+    :return: List of regression descriptions. Empty if no regressions.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+
+        min_ops = base["ops_per_sec"] * (1 - tolerance)
+        if result["ops_per_sec"] < min_ops:
+            regressions.append(f"{name}: {result['ops_per_sec']:.0f} ops/sec is slower than baseline "
+                               f"{base['ops_per_sec']:.0f} ops/sec (tolerance {tolerance:.0%})")
+
+        max_alloc = base["peak_alloc_bytes"] * (1 + tolerance) + alloc_slack_bytes
+        if result["peak_alloc_bytes"] > max_alloc:
+            regressions.append(f"{name}: {result['peak_alloc_bytes']:.0f} bytes allocated per call is more than "
+                               f"baseline {base['peak_alloc_bytes']:.0f} bytes (tolerance {tolerance:.0%})")
+    return regressions
@@ -0,0 +1,110 @@
+"""
+Sweep the receive chunk size of the server, and measure large file upload throughput for each size.
+
+Usage:
+    python -m Benchmark.UploadSweep [--chunk-sizes 1024,4096,16384,65536,262144] [--file-size-mb 64] [--repeat 3]
+"""
+import argparse
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+RESPONSE_HEADER_FMT = "<BHI"  # Version, code, payload size
+S_RESPONSE_HEADER = struct.calcsize(RESPONSE_HEADER_FMT)
+
+
+def _request(port: int, client_id: bytes, code: int, payload: bytes) -> tuple[int, bytes]:
+    from Server.ProtocolDefenitions import SERVER_VERSION
+
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall(struct.pack("<16sBHI", client_id, SERVER_VERSION, code, len(payload)))
+        sock.sendall(payload)
+
+        response = b''
+        while True:
+            buff = sock.recv(64 * 1024)
+            if len(buff) == 0:
+                break
+            response += buff
+            if len(response) >= S_RESPONSE_HEADER:
+                _, _, payload_size = struct.unpack(RESPONSE_HEADER_FMT, response[:S_RESPONSE_HEADER])
+                if len(response) >= S_RESPONSE_HEADER + payload_size:
+                    break
+
+    _, response_code, payload_size = struct.unpack(RESPONSE_HEADER_FMT, response[:S_RESPONSE_HEADER])
+    return response_code, response[S_RESPONSE_HEADER:S_RESPONSE_HEADER + payload_size]
+
+
+def _register(port: int, username: str) -> bytes:
+    from Server.OpCodes import RequestCodes, ResponseCodes
+    from Server.ProtocolDefenitions import S_USERNAME, S_PUBLIC_KEY
+
+    payload = username.encode().ljust(S_USERNAME, b'\0') + os.urandom(S_PUBLIC_KEY)
+    code, client_id = _request(port, b'\0' * 16, RequestCodes.REQC_REGISTER_USER.value, payload)
+    if code != ResponseCodes.RESC_REGISTER_SUCCESS.value:
+        raise RuntimeError(f"Register failed with response code: {code}")
+    return client_id
+
+
+def measure_upload(database, chunk_size: int, port: int, file_size: int, repeat: int) -> float:
+    """
+    Start a server with the given receive chunk size, and upload the file 'repeat' times.
+    :param database: Database of the server
+    :return: Best throughput in MiB/sec
+    """
+    from Server.Config import SocketOptions
+    from Server.OpCodes import RequestCodes, ResponseCodes, MessageTypes
+    from Server.RateLimiter import RateLimiter, RateLimiterConfig
+    from Server.Server import Server
+
+    # No upload budget, we measure the server, not the limiter.
+    server = Server(port, socket_options=SocketOptions(recv_chunk_size=chunk_size),
+                    rate_limiter=RateLimiter(RateLimiterConfig(upload_budget=None)), database=database)
+    threading.Thread(target=server.start, daemon=True).start()
+    time.sleep(0.2)
+
+    sender = _register(port, f"sender{chunk_size}")
+    recipient = _register(port, f"recipient{chunk_size}")
+    content = os.urandom(file_size)
+    payload = recipient + struct.pack("<BI", MessageTypes.SEND_FILE.value, len(content)) + content
+
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        code, _ = _request(port, sender, RequestCodes.REQC_SEND_MESSAGE.value, payload)
+        elapsed = time.perf_counter() - start
+        if code != ResponseCodes.RESC_SEND_MESSAGE.value:
+            raise RuntimeError(f"Upload failed with response code: {code}")
+        best = max(best, file_size / elapsed / (1024 * 1024))
+
+    server.shutdown()
+    return best
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m Benchmark.UploadSweep")
+    parser.add_argument("--chunk-sizes", default="1024,4096,16384,65536,262144")
+    parser.add_argument("--file-size-mb", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--port", type=int, default=18080, help="First port, each chunk size uses the next one")
+    args = parser.parse_args(argv)
+
+    from Database.Database import Database
+    from Server.LogPipeline import apply_log_config
+    apply_log_config({"levels": {"root": "WARNING"}})
+    database = Database(os.path.join(tempfile.mkdtemp(), "upload_sweep.db"))
+
+    print(f"{'chunk size':>12} {'MiB/sec':>10}")
+    for i, chunk_size in enumerate(int(size) for size in args.chunk_sizes.split(",")):
+        throughput = measure_upload(database, chunk_size, args.port + i, args.file_size_mb * 1024 * 1024, args.repeat)
+        print(f"{chunk_size:>12} {throughput:>10.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
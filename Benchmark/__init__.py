@@ -0,0 +1,4 @@
+"""
+Component level microbenchmarks of protocol codec, sanitizer and database primitives.
+Run with: python -m Benchmark --help
+"""
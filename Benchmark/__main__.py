@@ -0,0 +1,94 @@
+"""
+Usage:
+    python -m Benchmark [--users 10000] [--messages-per-user 2] [--filter username] [--output results.json]
+    python -m Benchmark --save-baseline
+    python -m Benchmark --baseline Benchmark/baseline.json --tolerance 0.2
+
+Exit code is 1 if any result is slower (or allocates more) than the baseline, beyond the tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m Benchmark", description="Microbenchmarks of hot functions.")
+    parser.add_argument("--users", type=int, default=10000, help="Users in the seeded database")
+    parser.add_argument("--messages-per-user", type=int, default=2, help="Waiting messages of each seeded user")
+    parser.add_argument("--filter", help="Run only cases with this substring in the name")
+    parser.add_argument("--number", type=int, help="Override calls per repeat of every case")
+    parser.add_argument("--output", help="Write results JSON to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline results JSON")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression, 0.2 is 20%%")
+    args = parser.parse_args(argv)
+
+    # Measure the primitives, not the logging.
+    from Server.LogPipeline import apply_log_config
+    apply_log_config({"levels": {"root": "WARNING"}})
+
+    from Database.Database import Database as DB
+    from Benchmark.Cases import codec_cases, sanitizer_cases, database_cases, seed_database
+    from Benchmark.Microbench import run_case, compare
+
+    db = DB(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    start = time.perf_counter()
+    client_ids = seed_database(db, args.users, args.messages_per_user)
+    print(f"Seeded {args.users} users and {args.users * args.messages_per_user} messages in "
+          f"{time.perf_counter() - start:.2f} seconds")
+
+    cases = codec_cases() + sanitizer_cases() + database_cases(db, client_ids)
+    if args.filter:
+        cases = [case for case in cases if args.filter in case.name]
+
+    results = {}
+    print(f"{'case':<45} {'ops/sec':>14} {'alloc bytes/call':>18}")
+    for case in cases:
+        result = run_case(case, args.number)
+        results[result.name] = result.to_dict()
+        print(f"{result.name:<45} {result.ops_per_sec:>14,.0f} {result.peak_alloc_bytes:>18,.0f}")
+
+    document = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "users": args.users,
+            "messages_per_user": args.messages_per_user,
+            "time": int(time.time()),
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(document, file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(document, file, indent=2)
+        print(f"Saved baseline: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at: {args.baseline}, run with --save-baseline to create one")
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(results, baseline["results"], args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if len(regressions) > 0:
+        return 1
+    print(f"No regressions against baseline: {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
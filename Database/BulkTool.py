@@ -0,0 +1,286 @@
+"""
+Offline bulk import / export of Users and Messages, for seeding benchmarks and migrating hosts.
+The server must not be running on the same database file. Messages work on a database that is not sharded
+(see Database.Reshard), import then re-shard.
+
+Usage:
+    python -m Database.BulkTool export --db server.db --users users.jsonl --messages messages.jsonl
+    python -m Database.BulkTool import --db server.db --users users.jsonl --messages messages.jsonl
+    python -m Database.BulkTool generate --users users.jsonl --messages messages.jsonl --count 1000000 --messages-per-user 2
+    python -m Database.BulkTool generate --db server.db --count 1000000 --messages-per-user 2
+
+File format is JSON lines, one object per line:
+    Users:    {"client_id": hex, "name": str, "public_key": hex, "last_seen": int}
+    Messages: {"to_client": hex, "from_client": hex, "type": int, "content": base64 or null}
+"""
+import argparse
+import base64
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from typing import Iterable, Iterator, Optional
+
+from Database import MODULE_LOGGER_NAME
+from Database.Database import Database
+from Database.MessageShards import MESSAGES_INDEX, read_layout
+from Database.Sanitizer import UsersSanitizer, MessagesSanitizer
+from Server.OpCodes import MessageTypes
+from Server.ProtocolDefenitions import S_PUBLIC_KEY, S_CLIENT_ID
+
+logger = logging.getLogger(MODULE_LOGGER_NAME)
+
+DEFAULT_BATCH_SIZE = 50000
+
+# DER header of 1024 bit RSA public key (SubjectPublicKeyInfo), as the client sends it. Followed by the modulus.
+PUBLIC_KEY_DER_PREFIX = bytes.fromhex("30819d300d06092a864886f70d010101050003818b0030818702818100")
+PUBLIC_KEY_DER_SUFFIX = bytes.fromhex("020111")  # Public exponent 17
+S_PUBLIC_KEY_MODULUS = S_PUBLIC_KEY - len(PUBLIC_KEY_DER_PREFIX) - len(PUBLIC_KEY_DER_SUFFIX)
+
+
+def _batches(rows: Iterable, batch_size: int) -> Iterator[list]:
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def _read_jsonl(path: str) -> Iterator[dict]:
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _write_jsonl(path: str, objects: Iterable[dict]) -> int:
+    count = 0
+    with open(path, "w") as file:
+        for obj in objects:
+            file.write(json.dumps(obj, separators=(",", ":")))
+            file.write("\n")
+            count += 1
+    return count
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    # Make sure the schema exists
+    Database(db_path).close()
+    return sqlite3.connect(db_path)
+
+
+def _check_not_sharded(conn: sqlite3.Connection):
+    if len(read_layout(conn)) > 0:
+        conn.close()
+        raise ValueError("Messages are sharded. Move them back first: python -m Database.Reshard --shards 0")
+
+
+def user_rows(users: Iterable[dict], validate: bool) -> Iterator[tuple]:
+    for user in users:
+        if validate:
+            UsersSanitizer.username(user["name"])
+            UsersSanitizer.client_id(user["client_id"])
+            UsersSanitizer.pub_key(user["public_key"])
+            UsersSanitizer.last_seen(user["last_seen"])
+        yield user["client_id"], user["name"], user["public_key"], user["last_seen"]
+
+
+def message_rows(messages: Iterable[dict], validate: bool) -> Iterator[tuple]:
+    for message in messages:
+        content = base64.b64decode(message["content"]) if message.get("content") else None
+        if validate:
+            UsersSanitizer.client_id(message["to_client"])
+            UsersSanitizer.client_id(message["from_client"])
+            MessagesSanitizer.message_type(message["type"])
+        yield message["to_client"], message["from_client"], message["type"], \
+            len(content) if content is not None else 0, content
+
+
+def import_data(db_path: str, users: Optional[Iterable[tuple]], messages: Optional[Iterable[tuple]],
+                batch_size: int = DEFAULT_BATCH_SIZE) -> tuple[int, int]:
+    """
+    Load users and messages with batched executemany inside a single transaction.
+    The messages index is dropped during the load and created once at the end.
+    A new database file is loaded without a durable journal - a crash in the middle leaves a broken file, but it has
+    nothing else in it, so it can just be removed. An existing database is loaded with the default journal.
+    :param users: (client_id, name, public_key, last_seen) rows, see user_rows
+    :param messages: (to_client, from_client, type, content_size, content) rows, see message_rows
+    :return: Amount of imported users and messages
+    """
+    fresh = not os.path.exists(db_path)
+    conn = _connect(db_path)
+    if messages is not None:
+        _check_not_sharded(conn)
+    if fresh:
+        logger.info("New database file, loading without a durable journal")
+        conn.execute("PRAGMA synchronous = OFF;")
+        conn.execute("PRAGMA journal_mode = MEMORY;")
+    conn.execute("PRAGMA cache_size = -262144;")  # 256 MiB
+
+    users_count = 0
+    messages_count = 0
+    try:
+        conn.execute(f"DROP INDEX IF EXISTS {MESSAGES_INDEX};")
+
+        if users is not None:
+            for batch in _batches(users, batch_size):
+                conn.executemany("INSERT INTO Users (client_id, name, public_key, last_seen) VALUES (?, ?, ?, ?);", batch)
+                users_count += len(batch)
+                logger.info("Imported %d users", users_count)
+
+        if messages is not None:
+            for batch in _batches(messages, batch_size):
+                conn.executemany("""
+                    INSERT INTO Messages (to_client, from_client, type, content_size, content) VALUES (?, ?, ?, ?, ?);
+                """, batch)
+                messages_count += len(batch)
+                logger.info("Imported %d messages", messages_count)
+
+        logger.info("Creating messages index...")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {MESSAGES_INDEX} ON Messages (to_client, id);")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return users_count, messages_count
+
+
+def export_users(db_path: str) -> Iterator[tuple]:
+    conn = _connect(db_path)
+    try:
+        yield from conn.execute("SELECT client_id, name, public_key, last_seen FROM Users ORDER BY id;")
+    finally:
+        conn.close()
+
+
+def export_messages(db_path: str) -> Iterator[tuple]:
+    conn = _connect(db_path)
+    _check_not_sharded(conn)
+    try:
+        yield from conn.execute("SELECT to_client, from_client, type, content_size, content FROM Messages ORDER BY id;")
+    finally:
+        conn.close()
+
+
+def synthetic_public_key() -> bytes:
+    """
+    160 bytes DER encoded RSA public key, with random 1024 bit modulus. It has the right structure, but it is not
+    a real key (nobody has the private key).
+    """
+    modulus = bytearray(os.urandom(S_PUBLIC_KEY_MODULUS))
+    modulus[0] |= 0x80
+    return PUBLIC_KEY_DER_PREFIX + bytes(modulus) + PUBLIC_KEY_DER_SUFFIX
+
+
+def synthetic_client_id() -> str:
+    """
+    Random version 4 UUID (hex str), like the server generates on register.
+    """
+    client_id = bytearray(os.urandom(S_CLIENT_ID))
+    client_id[6] = (client_id[6] & 0x0F) | 0x40  # Version 4
+    client_id[8] = (client_id[8] & 0x3F) | 0x80  # RFC 4122 variant
+    return client_id.hex()
+
+
+def generate_user_rows(client_ids: Iterable[str]) -> Iterator[tuple]:
+    """
+    :param client_ids: Client id of each user, see synthetic_client_id
+    :return: (client_id, name, public_key, last_seen) rows
+    """
+    now = int(time.time())
+    for i, client_id in enumerate(client_ids):
+        yield client_id, f"user{i}", synthetic_public_key().hex(), now
+
+
+def generate_message_rows(client_ids: list[str], messages_per_user: int, content_size: int = 64) -> Iterator[tuple]:
+    """
+    Each user gets messages from the next users, cycling through the message types.
+    :return: (to_client, from_client, type, content_size, content) rows
+    """
+    types = [t.value for t in MessageTypes]
+    for i, to_client in enumerate(client_ids):
+        for j in range(messages_per_user):
+            _type = types[(i + j) % len(types)]
+            content = None if _type == MessageTypes.REQ_SYMMETRIC_KEY.value else os.urandom(content_size)
+            yield to_client, client_ids[(i + j + 1) % len(client_ids)], _type, \
+                len(content) if content is not None else 0, content
+
+
+def user_objects(rows: Iterable[tuple]) -> Iterator[dict]:
+    for client_id, name, public_key, last_seen in rows:
+        yield {"client_id": client_id, "name": name, "public_key": public_key, "last_seen": last_seen}
+
+
+def message_objects(rows: Iterable[tuple]) -> Iterator[dict]:
+    for to_client, from_client, _type, _content_size, content in rows:
+        yield {"to_client": to_client, "from_client": from_client, "type": _type,
+               "content": base64.b64encode(content).decode() if content else None}
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m Database.BulkTool", description="Bulk users and messages tool.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument("--db", required=True)
+    export_parser.add_argument("--users")
+    export_parser.add_argument("--messages")
+
+    import_parser = subparsers.add_parser("import")
+    import_parser.add_argument("--db", required=True)
+    import_parser.add_argument("--users")
+    import_parser.add_argument("--messages")
+    import_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    import_parser.add_argument("--no-validate", action="store_true", help="Skip the sanitizer checks of each row")
+
+    generate_parser = subparsers.add_parser("generate")
+    generate_parser.add_argument("--count", type=int, required=True, help="Amount of users")
+    generate_parser.add_argument("--messages-per-user", type=int, default=0)
+    generate_parser.add_argument("--content-size", type=int, default=64)
+    generate_parser.add_argument("--db", help="Load straight into this database, instead of writing files")
+    generate_parser.add_argument("--users")
+    generate_parser.add_argument("--messages")
+    generate_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+
+    if args.command == "export":
+        if args.users:
+            logger.info("Exported %d users", _write_jsonl(args.users, user_objects(export_users(args.db))))
+        if args.messages:
+            logger.info("Exported %d messages", _write_jsonl(args.messages, message_objects(export_messages(args.db))))
+
+    elif args.command == "import":
+        validate = not args.no_validate
+        users = user_rows(_read_jsonl(args.users), validate) if args.users else None
+        messages = message_rows(_read_jsonl(args.messages), validate) if args.messages else None
+        import_data(args.db, users, messages, args.batch_size)
+
+    elif args.command == "generate":
+        # Only the client ids are kept in memory (the messages refer to them), the user rows are streamed.
+        client_ids = [synthetic_client_id() for _ in range(args.count)]
+        users = generate_user_rows(client_ids)
+        messages = generate_message_rows(client_ids, args.messages_per_user, args.content_size)
+        if args.db:
+            # Generated rows are valid by construction, no need to validate nor to go through the file format.
+            import_data(args.db, users, messages, args.batch_size)
+        else:
+            if args.users:
+                _write_jsonl(args.users, user_objects(users))
+            if args.messages:
+                _write_jsonl(args.messages, message_objects(messages))
+
+    logger.info("Done in %.2f seconds", time.perf_counter() - start)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,25 +1,52 @@
+import os
 import sqlite3
 import logging
+import threading
 import time
 import uuid
 from typing import Optional
 
 from Database import MODULE_LOGGER_NAME, DB_LOCATION
+from Database.MailboxCache import MailboxCache
+from Database.MailboxCounters import MailboxCounters, MailboxStatus
+from Database.MessageShards import MessageShard, MessageIdsExhausted, create_messages_table, \
+    create_layout_table, read_layout, shard_of
+from Database.PendingControlIndex import PendingControlIndex, CONTROL_MESSAGE_TYPES
 from Database.Sanitizer import UsersSanitizer, MessagesSanitizer
-from Server.ProtocolDefenitions import S_USERNAME, S_CLIENT_ID, S_PUBLIC_KEY
+from Server.OpCodes import MessageTypes
+from Server.ProtocolDefenitions import S_USERNAME, S_CLIENT_ID, S_PUBLIC_KEY, S_PULL_MESSAGE_HEADER
 
 logger = logging.getLogger(MODULE_LOGGER_NAME)
 
 
 class Database():
-    def __init__(self):
+    def __init__(self, db_location: Optional[str] = None):
+        """
+        :param db_location: Database file. Default is DB_LOCATION.
+        """
         super().__init__()
         logger.debug("Connecting...")
-        self._conn = sqlite3.connect(DB_LOCATION, check_same_thread=False)  # Multiple threads can use same cursor
+        db_location = db_location if db_location is not None else DB_LOCATION
+        self._conn = sqlite3.connect(db_location, check_same_thread=False)  # Multiple threads can use same cursor
         logger.debug("Connected!")
 
         self.create_db()
 
+        # Messages are partitioned by recipient, see Database.Reshard
+        self._shards = self.__open_shards(db_location)
+
+        # Waiting messages of each recipient
+        self.mailbox_counters = MailboxCounters()
+        self.__load_mailbox_counters()
+
+        # Small waiting messages of recently active recipients. Filled as messages arrive and on pulls.
+        self.mailbox_cache = MailboxCache()
+
+        # Pending symmetric key messages, used to coalesce duplicates
+        self._control_lock = threading.Lock()
+        self.pending_control = PendingControlIndex()
+        self.__load_pending_control()
+
     def create_db(self):
         """
         If exception occurs, we can't continue with the server, so we don't handle exceptions at this time
@@ -43,25 +70,76 @@ class Database():
         logger.debug("OK")
 
         logger.debug("Creating Messages table...")
-        cur.execute(
-            f"""
-            CREATE TABLE IF NOT EXISTS Messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                to_client varchar({S_CLIENT_ID}) NOT NULL,
-                from_client varchar({S_CLIENT_ID}) NOT NULL,
-                type INTEGER NOT NULL,
-                content_size INTEGER NOT NULL,
-                content blob
-            );
-            """
-        )
-        self._conn.commit()
-
+        create_messages_table(self._conn)
+        create_layout_table(self._conn)
         logger.debug("OK")
         cur.close()
 
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+        self._conn.close()
+
+    def __open_shards(self, db_location: str) -> list[MessageShard]:
+        locations = read_layout(self._conn)
+        if len(locations) == 0:
+            logger.debug("Messages are not sharded")
+            return [MessageShard(0, 1, self._conn)]
+
+        logger.info("Opening %d message shards...", len(locations))
+        directory = os.path.dirname(db_location)
+        return [MessageShard.open(index, len(locations), os.path.join(directory, location))
+                for index, location in enumerate(locations)]
+
+    @property
+    def shard_count(self) -> int:
+        return len(self._shards)
+
+    def __shard_of_client(self, to_client: str) -> MessageShard:
+        return self._shards[shard_of(to_client, len(self._shards))]
+
+    def __shard_of_message(self, message_id: int) -> MessageShard:
+        return self._shards[message_id % len(self._shards)]
+
+    def __load_mailbox_counters(self):
+        logger.debug("Loading mailbox counters...")
+        rows = []
+        for shard in self._shards:
+            cur = shard.conn.cursor()
+            cur.execute("SELECT to_client, type, COUNT(*), SUM(content_size) FROM Messages GROUP BY to_client, type;")
+            rows += cur.fetchall()
+            cur.close()
+        self.mailbox_counters.load(rows)
+        logger.debug("OK")
+
+    def __load_pending_control(self):
+        logger.debug("Loading pending control messages...")
+        placeholders = ", ".join("?" * len(CONTROL_MESSAGE_TYPES))
+        rows = []
+        for shard in self._shards:
+            cur = shard.conn.cursor()
+            cur.execute(f"""
+                SELECT to_client, from_client, type, MAX(id) FROM Messages
+                WHERE type IN ({placeholders}) GROUP BY to_client, from_client, type;
+            """, CONTROL_MESSAGE_TYPES)
+            rows += [(to_client, from_client, _type, shard.global_id(_id)) for to_client, from_client, _type, _id in cur]
+            cur.close()
+        with self._control_lock:
+            self.pending_control.load(rows)
+        logger.debug("OK")
+
+    def __discard_pending_control(self, rows):
+        """
+        Delivered or deleted messages are not pending anymore.
+        :param rows: (id, to_client, from_client, type) tuples
+        """
+        with self._control_lock:
+            for _id, to_client, from_client, _type in rows:
+                if _type in CONTROL_MESSAGE_TYPES:
+                    self.pending_control.discard(to_client, from_client, _type, _id)
+
     def register_user(self, username: str, pub_key: bytes) -> tuple[bool, bytes]:
-        logger.info("Registering user: " + str(username))
+        logger.info("Registering user: %s", username)
 
         row = self.get_user(username)
 
@@ -90,6 +168,60 @@ class Database():
         else:
             raise UserAlreadyExists(username)
 
+    def add_user(self, client_id: str, username: str, pub_key: str, last_seen: int) -> bool:
+        """
+        Add a user registered on another node (cluster directory replication). Existing client id is kept as is.
+        :param client_id: Client id (hex str)
+        :param pub_key: Public key (hex str)
+        :return: True if the user was added
+        """
+        UsersSanitizer.username(username)
+        UsersSanitizer.client_id(client_id)
+        UsersSanitizer.pub_key(pub_key)
+        UsersSanitizer.last_seen(last_seen)
+
+        cur = self._conn.cursor()
+        cur.execute("""
+            INSERT OR IGNORE INTO Users (name, client_id, public_key, last_seen)
+            VALUES (?, ?, ?, ?);
+        """, [username, client_id, pub_key, last_seen])
+        self._conn.commit()
+        cur.close()
+        return cur.rowcount == 1
+
+    def add_users(self, users: list[tuple[str, str, str, int]]) -> int:
+        """
+        Batch of add_user, in a single transaction.
+        :param users: Client id (hex str), Username, Public key (hex str), Last seen rows
+        :return: Amount of added users
+        """
+        for client_id, username, pub_key, last_seen in users:
+            UsersSanitizer.username(username)
+            UsersSanitizer.client_id(client_id)
+            UsersSanitizer.pub_key(pub_key)
+            UsersSanitizer.last_seen(last_seen)
+
+        changes = self._conn.total_changes
+        self._conn.executemany("""
+            INSERT OR IGNORE INTO Users (client_id, name, public_key, last_seen)
+            VALUES (?, ?, ?, ?);
+        """, users)
+        self._conn.commit()
+        return self._conn.total_changes - changes
+
+    def get_users_page(self, after_id: int, limit: int) -> list[tuple[int, str, str, str, int]]:
+        """
+        :param after_id: Return only users with row id bigger than this (cursor)
+        :param limit: Max amount of users
+        :return: Id, Client id (hex str), Username, Public key (hex str), Last seen, by registration order
+        """
+        cur = self._conn.cursor()
+        cur.execute("SELECT id, client_id, name, public_key, last_seen FROM Users WHERE id>? ORDER BY id LIMIT ?;",
+                    [after_id, limit])
+        res = cur.fetchall()
+        cur.close()
+        return res
+
     def get_user(self, username: str):
         UsersSanitizer.username(username)
         cur = self._conn.cursor()
@@ -105,6 +237,9 @@ class Database():
 
     def is_client_exists(self, client_id: str) -> bool:
         UsersSanitizer.client_id(client_id)
+        # Only existing clients have a resident mailbox
+        if self.mailbox_cache.is_resident(client_id):
+            return True
         cur = self._conn.cursor()
         cur.execute("SELECT * FROM Users WHERE client_id=?;", [client_id])
         res = cur.fetchone()
@@ -142,7 +277,7 @@ class Database():
         :param content:
         :return: Returns tuple. Tuple contains 'success' and 'message_id'.
         """
-        logger.debug(f"Inserting message from: {from_client} to: {to_client}")
+        logger.debug("Inserting message from: %s to: %s", from_client, to_client)
 
         UsersSanitizer.client_id(to_client)
         UsersSanitizer.client_id(from_client)
@@ -153,78 +288,316 @@ class Database():
         if not self.is_client_exists(from_client):
             raise UserNotExistDBException(from_client)
 
-        cur = self._conn.cursor()
+        # Coalesce symmetric key requests - if the same request is already pending, reuse its message.
+        if message_type == MessageTypes.REQ_SYMMETRIC_KEY.value:
+            with self._control_lock:
+                message_id = self.pending_control.get(to_client, from_client, message_type)
+                if message_id is None:
+                    success, message_id = self.__insert_message_row(to_client, from_client, message_type, content)
+                    if not success:
+                        return False
+                    self.pending_control.put(to_client, from_client, message_type, message_id)
+                else:
+                    logger.debug("Coalesced symmetric key request into pending message: %d", message_id)
+            return True, message_id
 
-        if content is not None and len(content) > 0:
-            MessagesSanitizer.content(len(content), content)
-            cur.execute(
-                """
-                    INSERT INTO Messages (to_client, from_client, type, content_size, content) 
-                    VALUES (?, ?, ?, ?, ?);
-                """, [to_client, from_client, message_type, len(content), sqlite3.Binary(content)])
-        else:
-            cur.execute(
-                """
-                    INSERT INTO Messages (to_client, from_client, type, content_size) 
-                    VALUES (?, ?, ?, 0);
-                """, [to_client, from_client, message_type])
-        self._conn.commit()
-        message_id = cur.lastrowid
-        cur.close()
+        success, message_id = self.__insert_message_row(to_client, from_client, message_type, content)
+        if not success:
+            return False
+        if message_type == MessageTypes.SEND_SYMMETRIC_KEY.value and content is not None and len(content) > 0:
+            self.__supersede_symmetric_key(to_client, from_client, message_id)
+        return True, message_id
+
+    def __insert_message_row(self, to_client: str, from_client: str, message_type: int, content: Optional[bytes]) -> tuple[bool, Optional[int]]:
+        shard = self.__shard_of_client(to_client)
+
+        with shard.write_lock:
+            cur = shard.conn.cursor()
+
+            if content is not None and len(content) > 0:
+                MessagesSanitizer.content(len(content), content)
+                cur.execute(
+                    """
+                        INSERT INTO Messages (to_client, from_client, type, content_size, content) 
+                        VALUES (?, ?, ?, ?, ?);
+                    """, [to_client, from_client, message_type, len(content), sqlite3.Binary(content)])
+            else:
+                cur.execute(
+                    """
+                        INSERT INTO Messages (to_client, from_client, type, content_size) 
+                        VALUES (?, ?, ?, 0);
+                    """, [to_client, from_client, message_type])
+            try:
+                message_id = shard.check_id(cur.lastrowid)
+            except MessageIdsExhausted:
+                shard.conn.rollback()
+                cur.close()
+                raise
+            shard.conn.commit()
+            cur.close()
+
+            if cur.rowcount == 1:
+                # Counters and cache change under the shard lock, with the rows they describe.
+                content_size = len(content) if content is not None else 0
+                was_empty = self.mailbox_counters.count(to_client) == 0
+                self.mailbox_counters.add(to_client, message_type, 1, content_size)
+                row = (message_id, to_client, from_client, message_type, content_size, content if content_size > 0 else None)
+                self.mailbox_cache.add(to_client, row, was_empty)
 
         if cur.rowcount != 1:
             logger.error("Failed to insert a row!")
-            return False
+            return False, None
         else:
             return True, message_id
 
+    def __supersede_symmetric_key(self, to_client: str, from_client: str, message_id: int):
+        """
+        Only the latest symmetric key of each pair is kept. The previous pending one (if not yet delivered) is deleted.
+        """
+        _type = MessageTypes.SEND_SYMMETRIC_KEY.value
+        with self._control_lock:
+            previous_id = self.pending_control.put(to_client, from_client, _type, message_id)
+        if previous_id is not None and previous_id != message_id:
+            logger.debug("Symmetric key message: %d supersedes pending message: %d", message_id, previous_id)
+            self.delete_message(previous_id)
+
     def get_messages(self, to_client: str):
         UsersSanitizer.client_id(to_client)
 
-        if not self.is_client_exists(to_client):
-            raise UserNotExistDBException(to_client)
+        # Only existing clients have a resident mailbox, no need to check.
+        res = self.mailbox_cache.get(to_client)
+        if res is None:
+            if not self.is_client_exists(to_client):
+                raise UserNotExistDBException(to_client)
+
+            shard = self.__shard_of_client(to_client)
+            # Not under the write lock, writes to the shard don't wait for the read. The cache takes the rows only if
+            # the mailbox didn't change meanwhile.
+            ticket = self.mailbox_cache.begin_load(to_client)
+            res = None
+            try:
+                cur = shard.conn.cursor()
+                cur.execute(f"""
+                    SELECT {shard.select_id()}, to_client, from_client, type, content_size, content FROM Messages
+                    WHERE to_client=? ORDER BY id;
+                """, [to_client])
+                res = cur.fetchall()
+                cur.close()
+            finally:
+                self.mailbox_cache.load(to_client, res, ticket)
+
+        self.__discard_pending_control((row[0], row[1], row[2], row[3]) for row in res)
+        return res
 
-        cur = self._conn.cursor()
-        cur.execute("SELECT * FROM Messages WHERE to_client=?;", [to_client])
-        res = cur.fetchall()
+    def get_messages_page(self, to_client: str, after_id: int, max_bytes: int, max_count: int) -> tuple[list, bool]:
+        """
+        Get the next page of messages, ordered by message id. Only messages that fit the budget are loaded to memory.
+        The first message is always returned, even if it alone is bigger than the budget, so the mailbox can't get stuck.
+        Its content is not loaded then (None, with the real content size) - read it in parts with read_message_content.
+        The same goes for a first message whose chunked content was set while the page was read.
+        :param to_client: Recipient client id (hex str)
+        :param after_id: Return only messages with id bigger than this (cursor)
+        :param max_bytes: Budget of packed pull message bytes (message header + content)
+        :param max_count: Budget of messages
+        :return: Tuple of the rows (same columns as get_messages) and 'more pending' flag.
+        """
+        UsersSanitizer.client_id(to_client)
+        MessagesSanitizer.id(after_id)
 
-        return res
+        cached_rows = self.mailbox_cache.get(to_client)
+        if cached_rows is not None:
+            res, more_pending = self.__fit_page(((row, row[4]) for row in cached_rows if row[0] > after_id),
+                                                max_bytes, max_count)
+        else:
+            if not self.is_client_exists(to_client):
+                raise UserNotExistDBException(to_client)
+
+            shard = self.__shard_of_client(to_client)
+
+            # First pass only on the small columns, to decide which messages fit in the page. Local ids of the shard.
+            cur = shard.conn.cursor()
+            cur.execute("SELECT id, content_size FROM Messages WHERE to_client=? AND id>? ORDER BY id;",
+                        [to_client, shard.local_id(after_id)])
+            page, more_pending = self.__fit_page(((row, row[1]) for row in cur), max_bytes, max_count)
+            cur.close()
+
+            if len(page) == 0:
+                return [], False
+
+            # Second pass - load the content of the messages in the page only, and only up to the size the page was
+            # fitted with. The passes are not a single read, so a chunked content may have been set in between.
+            # A first message bigger than the whole budget is not loaded at all.
+            oversized = len(page) == 1 and S_PULL_MESSAGE_HEADER + page[0][1] > max_bytes
+            fitted = [(_id, -1 if oversized else content_size) for _id, content_size in page]
+            placeholders = ", ".join("(?, ?)" for _ in fitted)
+            cur = shard.conn.cursor()
+            cur.execute(f"""
+                WITH Page(id, fitted_size) AS (VALUES {placeholders})
+                SELECT {shard.select_id()}, to_client, from_client, type, content_size,
+                    CASE WHEN content_size <= fitted_size THEN content END
+                FROM Messages JOIN Page USING (id) ORDER BY id;
+            """, [value for message in fitted for value in message])
+            res = cur.fetchall()
+            cur.close()
+
+            # A message that grew ends the page. If it is the first one, it is sent alone, and its content is read in
+            # parts like the content of an oversized message.
+            fitted_sizes = {shard.global_id(_id): fitted_size for _id, fitted_size in fitted}
+            for i, row in enumerate(res):
+                if row[4] > fitted_sizes[row[0]] >= 0:
+                    more_pending = more_pending or len(res) > max(i, 1)
+                    res = res[:max(i, 1)]
+                    break
+
+        # Delivered messages are not pending anymore, even before they are acknowledged.
+        self.__discard_pending_control((row[0], row[1], row[2], row[3]) for row in res)
+        return res, more_pending
+
+    def read_message_content(self, message_id: int, offset: int, size: int) -> bytes:
+        """
+        Read part of the content of a message, through a blob handle - the rest of the content is not loaded.
+        :param offset: First byte to read
+        :param size: Max bytes to read
+        :return: The content bytes. Less than size at the end of the content.
+        """
+        MessagesSanitizer.id(message_id)
+        shard = self.__shard_of_message(message_id)
+        with shard.conn.blobopen("Messages", "content", shard.local_id(message_id), readonly=True) as blob:
+            blob.seek(offset)
+            return blob.read(size)
+
+    @staticmethod
+    def __fit_page(messages, max_bytes: int, max_count: int) -> tuple[list, bool]:
+        """
+        :param messages: (message, content size) pairs, ordered by message id
+        :return: The messages that fit the page budget, and 'more pending' flag
+        """
+        page = []
+        page_bytes = 0
+        for message, content_size in messages:
+            message_bytes = S_PULL_MESSAGE_HEADER + content_size
+            if len(page) > 0 and (len(page) >= max_count or page_bytes + message_bytes > max_bytes):
+                return page, True
+            page.append(message)
+            page_bytes += message_bytes
+        return page, False
+
+    def delete_messages_up_to(self, to_client: str, last_id: int) -> int:
+        """
+        Delete (acknowledge) all messages of a recipient up to (including) the given message id.
+        :param to_client: Recipient client id (hex str)
+        :param last_id: Last message id the recipient received
+        :return: Amount of deleted messages
+        """
+        UsersSanitizer.client_id(to_client)
+        MessagesSanitizer.id(last_id)
+
+        shard = self.__shard_of_client(to_client)
+        logger.debug("Deleting messages of: %s up to: %d", to_client, last_id)
+        with shard.write_lock:
+            cur = shard.conn.cursor()
+            cur.execute(f"""
+                DELETE FROM Messages WHERE to_client=? AND id<=?
+                RETURNING {shard.select_id()}, from_client, type, content_size;
+            """, [to_client, shard.local_id(last_id)])
+            deleted_rows = cur.fetchall()
+            shard.conn.commit()
+            cur.close()
+
+            for _id, from_client, _type, content_size in deleted_rows:
+                self.mailbox_counters.add(to_client, _type, -1, -content_size)
+            self.mailbox_cache.remove(to_client, [row[0] for row in deleted_rows])
+        self.__discard_pending_control((_id, to_client, from_client, _type) for _id, from_client, _type, _ in deleted_rows)
+        return len(deleted_rows)
 
     def delete_message(self, message_id: int):
         MessagesSanitizer.id(message_id)
-        cur = self._conn.cursor()
-        logger.debug(f"Deleting message: {message_id}")
-        cur.execute("DELETE FROM Messages WHERE id=?;", [message_id])
-        self._conn.commit()
-        cur.close()
+        shard = self.__shard_of_message(message_id)
+        logger.debug("Deleting message: %d", message_id)
+        with shard.write_lock:
+            cur = shard.conn.cursor()
+            cur.execute("DELETE FROM Messages WHERE id=? RETURNING to_client, from_client, type, content_size;",
+                        [shard.local_id(message_id)])
+            deleted_row = cur.fetchone()
+            shard.conn.commit()
+            cur.close()
+
+            if deleted_row is not None:
+                to_client, from_client, _type, content_size = deleted_row
+                self.mailbox_counters.add(to_client, _type, -1, -content_size)
+                self.mailbox_cache.remove(to_client, [message_id])
+
+        if deleted_row is not None:
+            self.__discard_pending_control([(message_id, to_client, from_client, _type)])
 
     def update_last_seen(self, client_id: str):
         UsersSanitizer.client_id(client_id)
 
-        if not self.is_client_exists(client_id):
-            raise UserNotExistDBException(client_id)
-
         unix_epoch = int(time.time())
         cur = self._conn.cursor()
-        cur.execute("UPDATE Users SET last_seen=?;", [unix_epoch])
+        cur.execute("UPDATE Users SET last_seen=? WHERE client_id=?;", [unix_epoch, client_id])
         self._conn.commit()
         cur.close()
 
+        if cur.rowcount < 1:
+            raise UserNotExistDBException(client_id)
+
+    def get_users_seen_since(self, unix_epoch: int) -> list[tuple[str, int]]:
+        """
+        :param unix_epoch:
+        :return: Client id (hex str) and last seen of users seen since the given time, least recent first
+        """
+        UsersSanitizer.last_seen(unix_epoch)
+        cur = self._conn.cursor()
+        cur.execute("SELECT client_id, last_seen FROM Users WHERE last_seen>=? ORDER BY last_seen;", [unix_epoch])
+        res = cur.fetchall()
+        cur.close()
+        return res
+
     def set_message_content(self, message_id: int, content: Optional[bytes]) -> bool:
         if len(content) > 0:
             MessagesSanitizer.id(message_id)
-            cur = self._conn.cursor()
+            shard = self.__shard_of_message(message_id)
+            local_id = shard.local_id(message_id)
 
-            cur.execute("UPDATE Messages SET content_size = ?, content = ? WHERE id = ?;", [len(content), content, message_id])
+            with shard.write_lock:
+                cur = shard.conn.cursor()
 
-            self._conn.commit()
-            cur.close()
+                # Previous size, for the mailbox counters
+                cur.execute("SELECT to_client, from_client, type, content_size FROM Messages WHERE id = ?;", [local_id])
+                row = cur.fetchone()
+                if row is None:
+                    cur.close()
+                    return False
+                to_client, from_client, _type, previous_content_size = row
+
+                cur.execute("UPDATE Messages SET content_size = ?, content = ? WHERE id = ?;", [len(content), content, local_id])
+
+                shard.conn.commit()
+                cur.close()
+
+                if cur.rowcount >= 1:
+                    self.mailbox_counters.add(to_client, _type, 0, len(content) - previous_content_size)
+                    self.mailbox_cache.set_content(to_client, message_id, content)
 
             if cur.rowcount < 1:
                 return False
 
+            # The symmetric key content is set after the message is inserted, this is when it supersedes the old one.
+            if _type == MessageTypes.SEND_SYMMETRIC_KEY.value:
+                self.__supersede_symmetric_key(to_client, from_client, message_id)
+
         return True
 
+    def get_mailbox_status(self, to_client: str) -> MailboxStatus:
+        """
+        Waiting messages count and bytes of the recipient, from the in memory counters. Doesn't query the DB.
+        :param to_client: Recipient client id (hex str)
+        :return: MailboxStatus
+        """
+        UsersSanitizer.client_id(to_client)
+        return self.mailbox_counters.get(to_client)
+
 
 class UserNotExistDBException(Exception):
     def __init__(self, client_id: str):
@@ -0,0 +1,179 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from Server.ProtocolDefenitions import S_PULL_MESSAGE_HEADER
+
+DEFAULT_MAX_MESSAGE_SIZE = 4096  # Bytes of content. Bigger messages are never cached.
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024  # Bytes
+S_ROW_OVERHEAD = 256  # Estimated bytes of a cached row (tuple, hex strings, dict slot) besides the content
+S_MAILBOX_OVERHEAD = 256
+
+
+class MailboxCache:
+    """
+    In memory copy of the waiting messages of recently active recipients, so their pulls don't read the DB.
+    Write-through - every message is written to the DB first, the cache only saves the reads. Eviction just drops
+    mailboxes, least recently used first.
+
+    A mailbox is either resident (an exact copy of all of the recipient rows in the DB) or not in the cache at all.
+    A message bigger than the max message size makes its mailbox non resident, until it is empty again.
+    The caller (Database) makes every change while holding the write lock of the recipient shard, after the change is
+    committed, so the copy can't miss a concurrent change.
+
+    A mailbox is loaded from rows read without the write lock: begin_load, read the rows, then load. Any change of the
+    mailbox in between voids the load (the rows may be older than the change), and the mailbox stays non resident.
+    """
+    def __init__(self, max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE, memory_budget: int = DEFAULT_MEMORY_BUDGET):
+        self.max_message_size = max_message_size
+        self.memory_budget = memory_budget
+
+        self._lock = threading.Lock()
+        # Recipient client id (hex str) to message id to row. Least recently used first.
+        self._mailboxes: OrderedDict[str, dict[int, tuple]] = OrderedDict()
+        self._memory: dict[str, int] = {}
+        self.memory = 0
+        # Recipient client id to [pending loads, generation], only while a load of the mailbox is pending.
+        self._loads: dict[str, list[int]] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._mailboxes)
+
+    @staticmethod
+    def __row_memory(row: tuple) -> int:
+        return S_ROW_OVERHEAD + S_PULL_MESSAGE_HEADER + row[4]
+
+    def __is_small(self, content_size: int) -> bool:
+        return content_size <= self.max_message_size
+
+    def get(self, to_client: str) -> Optional[list]:
+        """
+        :return: Rows of a resident mailbox ordered by message id (same columns as Database.get_messages), else None
+        """
+        with self._lock:
+            mailbox = self._mailboxes.get(to_client)
+            if mailbox is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._mailboxes.move_to_end(to_client)
+            return [mailbox[_id] for _id in sorted(mailbox)]
+
+    def begin_load(self, to_client: str) -> int:
+        """
+        Call before reading the rows of the mailbox.
+        :return: Ticket of the load
+        """
+        with self._lock:
+            load = self._loads.setdefault(to_client, [0, 0])
+            load[0] += 1
+            return load[1]
+
+    def load(self, to_client: str, rows: Optional[list], ticket: int):
+        """
+        Make the mailbox resident, if all of its messages are small and it didn't change since begin_load.
+        :param rows: All of the recipient rows in the DB. None if the read failed.
+        :param ticket: From begin_load
+        """
+        small = rows is not None and all(self.__is_small(row[4]) for row in rows)
+        with self._lock:
+            load = self._loads[to_client]
+            load[0] -= 1
+            if load[0] == 0:
+                del self._loads[to_client]
+            if not small or load[1] != ticket or to_client in self._mailboxes:
+                return
+            self._mailboxes[to_client] = {row[0]: row for row in rows}
+            self.__account(to_client, S_MAILBOX_OVERHEAD + sum(self.__row_memory(row) for row in rows))
+            self.__evict()
+
+    def is_resident(self, to_client: str) -> bool:
+        with self._lock:
+            return to_client in self._mailboxes
+
+    def add(self, to_client: str, row: tuple, was_empty: bool):
+        """
+        :param row: Inserted row
+        :param was_empty: The recipient had no messages before this one. The mailbox becomes resident.
+        """
+        with self._lock:
+            self.__changed(to_client)
+            mailbox = self._mailboxes.get(to_client)
+            if mailbox is None:
+                if not was_empty:
+                    return
+                mailbox = self._mailboxes[to_client] = {}
+                self.__account(to_client, S_MAILBOX_OVERHEAD)
+
+            if not self.__is_small(row[4]):
+                self.__drop(to_client)
+                return
+            mailbox[row[0]] = row
+            self._mailboxes.move_to_end(to_client)
+            self.__account(to_client, self.__row_memory(row))
+            self.__evict()
+
+    def set_content(self, to_client: str, message_id: int, content: bytes):
+        with self._lock:
+            self.__changed(to_client)
+            mailbox = self._mailboxes.get(to_client)
+            if mailbox is None or message_id not in mailbox:
+                return
+            if not self.__is_small(len(content)):
+                self.__drop(to_client)
+                return
+            row = mailbox[message_id]
+            new_row = row[:4] + (len(content), content)
+            mailbox[message_id] = new_row
+            self.__account(to_client, self.__row_memory(new_row) - self.__row_memory(row))
+            self.__evict()
+
+    def remove(self, to_client: str, message_ids: list[int]):
+        with self._lock:
+            self.__changed(to_client)
+            mailbox = self._mailboxes.get(to_client)
+            if mailbox is None:
+                return
+            for message_id in message_ids:
+                row = mailbox.pop(message_id, None)
+                if row is not None:
+                    self.__account(to_client, -self.__row_memory(row))
+
+    def drop(self, to_client: str):
+        with self._lock:
+            self.__changed(to_client)
+            self.__drop(to_client)
+
+    def __changed(self, to_client: str):
+        """
+        Void the pending loads of the mailbox.
+        Caller must hold the lock.
+        """
+        load = self._loads.get(to_client)
+        if load is not None:
+            load[1] += 1
+
+    def __account(self, to_client: str, memory: int):
+        """
+        Caller must hold the lock.
+        """
+        self._memory[to_client] = self._memory.get(to_client, 0) + memory
+        self.memory += memory
+
+    def __drop(self, to_client: str):
+        """
+        Caller must hold the lock.
+        """
+        if self._mailboxes.pop(to_client, None) is not None:
+            self.memory -= self._memory.pop(to_client)
+
+    def __evict(self):
+        """
+        Caller must hold the lock.
+        """
+        while self.memory > self.memory_budget and len(self._mailboxes) > 0:
+            to_client = next(iter(self._mailboxes))
+            self.__drop(to_client)
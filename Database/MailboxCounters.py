@@ -0,0 +1,66 @@
+import threading
+from dataclasses import dataclass, field
+
+
+@dataclass
+class MailboxStatus:
+    count: int = 0
+    total_bytes: int = 0
+    by_type: dict[int, list[int]] = field(default_factory=dict)  # Message type to [count, bytes]
+
+
+class MailboxCounters:
+    """
+    Waiting messages count and bytes of each recipient, kept up to date by the Database message methods,
+    so the mailbox status doesn't need to scan the Messages table. Empty mailboxes have no entry.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mailboxes: dict[str, MailboxStatus] = {}
+
+    def load(self, rows: list[tuple[str, int, int, int]]):
+        """
+        :param rows: (to_client, type, count, bytes) rows of the grouped Messages table
+        """
+        with self._lock:
+            self._mailboxes = {}
+            for to_client, _type, count, total_bytes in rows:
+                self.__add(to_client, _type, count, total_bytes or 0)
+
+    def add(self, to_client: str, _type: int, count: int, total_bytes: int):
+        """
+        Negative count and bytes for removed messages.
+        """
+        with self._lock:
+            self.__add(to_client, _type, count, total_bytes)
+
+    def count(self, to_client: str) -> int:
+        with self._lock:
+            status = self._mailboxes.get(to_client)
+            return status.count if status is not None else 0
+
+    def get(self, to_client: str) -> MailboxStatus:
+        """
+        :return: Copy of the mailbox status
+        """
+        with self._lock:
+            status = self._mailboxes.get(to_client)
+            if status is None:
+                return MailboxStatus()
+            return MailboxStatus(status.count, status.total_bytes, {t: list(v) for t, v in status.by_type.items()})
+
+    def __add(self, to_client: str, _type: int, count: int, total_bytes: int):
+        status = self._mailboxes.get(to_client)
+        if status is None:
+            status = self._mailboxes[to_client] = MailboxStatus()
+
+        status.count += count
+        status.total_bytes += total_bytes
+        by_type = status.by_type.setdefault(_type, [0, 0])
+        by_type[0] += count
+        by_type[1] += total_bytes
+
+        if by_type[0] <= 0:
+            del status.by_type[_type]
+        if status.count <= 0:
+            del self._mailboxes[to_client]
@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Optional
+
+from Server.ProtocolDefenitions import S_CLIENT_ID
+
+MESSAGES_INDEX = "idx_messages_to_client"
+
+# Message ids are sent as 4 bytes unsigned ints ('<I'). Sharded, every shard uses one of each 'shard count' ids, so
+# the local ids of a shard run out 'shard count' times faster. Database.Reshard gives the messages dense ids again.
+MAX_MESSAGE_ID = 0xFFFFFFFF
+
+
+def create_messages_table(conn: sqlite3.Connection):
+    cur = conn.cursor()
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS Messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_client varchar({S_CLIENT_ID}) NOT NULL,
+            from_client varchar({S_CLIENT_ID}) NOT NULL,
+            type INTEGER NOT NULL,
+            content_size INTEGER NOT NULL,
+            content blob
+        );
+        """
+    )
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {MESSAGES_INDEX} ON Messages (to_client, id);")
+    conn.commit()
+    cur.close()
+
+
+def create_layout_table(conn: sqlite3.Connection):
+    """
+    Shard layout of the messages, kept in the directory (Users) database. No rows means the messages are in the
+    Messages table of the directory database itself (not sharded).
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS MessageShards (
+            shard INTEGER PRIMARY KEY NOT NULL,
+            location TEXT NOT NULL
+        );
+    """)
+    conn.commit()
+
+
+def read_layout(conn: sqlite3.Connection) -> list[str]:
+    """
+    :return: Shard file names (relative to the directory database), by shard index. Empty if not sharded.
+    """
+    rows = conn.execute("SELECT shard, location FROM MessageShards ORDER BY shard;").fetchall()
+    if [shard for shard, _ in rows] != list(range(len(rows))):
+        raise ValueError(f"Message shard layout is broken: {rows}")
+    return [location for _, location in rows]
+
+
+def shard_of(client_id: str, shard_count: int) -> int:
+    """
+    :param client_id: Recipient client id (hex str)
+    :return: Index of the shard that holds the messages of the recipient
+    """
+    if shard_count == 1:
+        return 0
+    return zlib.crc32(bytes.fromhex(client_id)) % shard_count
+
+
+def last_message_id(conn: sqlite3.Connection) -> int:
+    """
+    :return: Last local message id ever given by the Messages table of the connection (0 if none)
+    """
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'Messages';").fetchone()
+    return row[0] if row is not None else 0
+
+
+def set_last_message_id(conn: sqlite3.Connection, local_id: int):
+    """
+    Next message inserted to the Messages table of the connection gets a bigger local id than this.
+    """
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'Messages';")
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('Messages', ?);", [local_id])
+
+
+class MessageShard:
+    """
+    One Messages table, with its own connection and write lock, so writes to different shards don't wait for
+    each other.
+
+    Message ids seen outside the Database are global: local id * shard count + shard index. The shard of any
+    message id is known without a lookup, and the ids of a single recipient (who lives in one shard) keep the
+    order of the local ids. Not sharded (single shard) global ids are the local ids.
+
+    Global ids must fit in MAX_MESSAGE_ID, so a shard has about MAX_MESSAGE_ID / count local ids.
+    """
+    def __init__(self, index: int, count: int, conn: sqlite3.Connection, location: Optional[str] = None):
+        """
+        :param location: Shard file, None if the shard is the directory database itself
+        """
+        self.index = index
+        self.count = count
+        self.conn = conn
+        self.location = location
+        self.write_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, index: int, count: int, location: str) -> "MessageShard":
+        conn = sqlite3.connect(location, check_same_thread=False)  # Multiple threads can use same cursor
+        create_messages_table(conn)
+        return cls(index, count, conn, location)
+
+    def close(self):
+        if self.location is not None:
+            self.conn.close()
+
+    def global_id(self, local_id: int) -> int:
+        return local_id * self.count + self.index
+
+    def check_id(self, local_id: int) -> int:
+        """
+        :return: Global id of the local id
+        :raises MessageIdsExhausted: If the global id doesn't fit in the protocol
+        """
+        message_id = self.global_id(local_id)
+        if message_id > MAX_MESSAGE_ID:
+            raise MessageIdsExhausted(self.index, message_id)
+        return message_id
+
+    def local_id(self, message_id: int) -> int:
+        """
+        Largest local id whose global id is not bigger than the given one. Exact for the ids of this shard,
+        and keeps 'id > cursor' and 'id <= cursor' filters right for any other id.
+        """
+        return (message_id - self.index) // self.count
+
+    def select_id(self) -> str:
+        """
+        :return: SQL expression of the global id, for the select column lists
+        """
+        return f"id * {self.count} + {self.index}"
+
+
+def shard_locations(db_location: str, shard_count: int) -> list[str]:
+    """
+    File names of new shards next to the directory database. The shard count is part of the name, so the files of
+    a re-sharded layout never collide with the files of the current one.
+    """
+    stem = os.path.splitext(os.path.basename(db_location))[0]
+    return [f"{stem}.messages.{index}-of-{shard_count}.db" for index in range(shard_count)]
+
+
+class MessageIdsExhausted(Exception):
+    def __init__(self, shard: int, message_id: int):
+        super().__init__(f"Message id: {message_id} of shard: {shard} is bigger than the protocol max: "
+                         f"{MAX_MESSAGE_ID}. Compact the ids with: python -m Database.Reshard")
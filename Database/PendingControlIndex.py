@@ -0,0 +1,44 @@
+from typing import Optional
+
+from Server.OpCodes import MessageTypes
+
+# Zero (or tiny) size control messages that are coalesced per (to_client, from_client, type).
+CONTROL_MESSAGE_TYPES = (MessageTypes.REQ_SYMMETRIC_KEY.value, MessageTypes.SEND_SYMMETRIC_KEY.value)
+
+
+class PendingControlIndex:
+    """
+    Message id of the pending (not yet delivered) control message of each (to_client, from_client, type).
+    Not thread safe, the caller holds a lock.
+    """
+    def __init__(self):
+        self._index: dict[tuple[str, str, int], int] = {}
+
+    def __len__(self):
+        return len(self._index)
+
+    def load(self, rows: list[tuple[str, str, int, int]]):
+        """
+        :param rows: (to_client, from_client, type, message id) rows
+        """
+        self._index = {(to_client, from_client, _type): _id for to_client, from_client, _type, _id in rows}
+
+    def get(self, to_client: str, from_client: str, _type: int) -> Optional[int]:
+        return self._index.get((to_client, from_client, _type))
+
+    def put(self, to_client: str, from_client: str, _type: int, message_id: int) -> Optional[int]:
+        """
+        :return: The previous pending message id, if any
+        """
+        key = (to_client, from_client, _type)
+        previous = self._index.get(key)
+        self._index[key] = message_id
+        return previous
+
+    def discard(self, to_client: str, from_client: str, _type: int, message_id: int):
+        """
+        Remove the entry only if it still points to the given message (it may have been superseded).
+        """
+        key = (to_client, from_client, _type)
+        if self._index.get(key) == message_id:
+            del self._index[key]
@@ -0,0 +1,156 @@
+"""
+Offline re-sharding of the messages. Copies the messages to a new shard layout, then switches the directory database
+to it. The server must not be running on the same database file.
+
+Usage:
+    python -m Database.Reshard --db server.db --shards 4
+    python -m Database.Reshard --db server.db --shards 0    # Back to the Messages table of the directory database
+
+New shard files are written and committed first. The switch is a single transaction of the directory database,
+so a crash before it leaves the current layout as it was (only new files to remove). The files of the previous
+layout are removed after the switch.
+
+Message ids are compacted: the messages of each new shard are numbered again from 1, in the order they had, so the
+global ids are back to the start of the 4 bytes id space (see MessageShards.MAX_MESSAGE_ID). A page cursor of the
+previous layout means nothing after the re-shard, and could acknowledge messages the client didn't get. Clients
+must start paging again from cursor 0 once the server is back up.
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+from Database import MODULE_LOGGER_NAME, DB_LOCATION
+from Database.Database import Database
+from Database.MessageShards import MessageShard, MESSAGES_INDEX, read_layout, shard_of, shard_locations, \
+    last_message_id, set_last_message_id
+
+logger = logging.getLogger(MODULE_LOGGER_NAME)
+
+DEFAULT_BATCH_SIZE = 50000
+
+
+def _open_layout(directory: MessageShard, db_path: str, locations: list[str]) -> list[MessageShard]:
+    if len(locations) == 0:
+        return [directory]
+    return [MessageShard.open(index, len(locations), os.path.join(os.path.dirname(db_path), location))
+            for index, location in enumerate(locations)]
+
+
+def _flush(shard: MessageShard, rows: list):
+    shard.conn.executemany("""
+        INSERT INTO Messages (to_client, from_client, type, content_size, content) VALUES (?, ?, ?, ?, ?);
+    """, rows)
+    rows.clear()
+
+
+def reshard(db_path: str, shard_count: int, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    :param db_path: Directory (Users) database
+    :param shard_count: New amount of shards. 0 moves the messages back to the directory database.
+    :return: Amount of moved messages
+    """
+    # Make sure the schema exists
+    Database(db_path).close()
+
+    directory = MessageShard(0, 1, sqlite3.connect(db_path))
+    old_locations = read_layout(directory.conn)
+    if len(old_locations) == shard_count:
+        logger.info("Messages are already in %d shards, nothing to do", shard_count)
+        directory.conn.close()
+        return 0
+
+    new_locations = shard_locations(db_path, shard_count)
+    for location in new_locations:
+        path = os.path.join(os.path.dirname(db_path), location)
+        if os.path.exists(path):
+            raise FileExistsError(f"Shard file: {path} already exists (left from a failed re-shard?)")
+
+    old_shards = _open_layout(directory, db_path, old_locations)
+    new_shards = _open_layout(directory, db_path, new_locations)
+    new_count = len(new_shards)
+
+    moved = 0
+    try:
+        for shard in new_shards:
+            if shard is directory:
+                # Leftovers of the time before the messages were sharded are not part of any mailbox.
+                directory.conn.execute("DELETE FROM Messages;")
+            else:
+                shard.conn.execute(f"DROP INDEX IF EXISTS {MESSAGES_INDEX};")
+            # Dense ids from 1
+            set_last_message_id(shard.conn, 0)
+
+        # A recipient lives in a single old shard, so reading each old shard in id order keeps the order of
+        # every mailbox.
+        pending = [[] for _ in new_shards]
+        for old_shard in old_shards:
+            cur = old_shard.conn.execute("""
+                SELECT to_client, from_client, type, content_size, content FROM Messages ORDER BY id;
+            """)
+            for row in cur:
+                index = shard_of(row[0], new_count)
+                pending[index].append(row)
+                if len(pending[index]) >= batch_size:
+                    _flush(new_shards[index], pending[index])
+                moved += 1
+                if moved % batch_size == 0:
+                    logger.info("Moved %d messages", moved)
+            cur.close()
+
+        for shard, rows in zip(new_shards, pending):
+            _flush(shard, rows)
+            # A shard much bigger than the others can still run out of ids.
+            shard.check_id(last_message_id(shard.conn))
+            if shard is not directory:
+                logger.info("Creating messages index of shard: %d...", shard.index)
+                shard.conn.execute(f"CREATE INDEX IF NOT EXISTS {MESSAGES_INDEX} ON Messages (to_client, id);")
+                shard.conn.commit()
+
+        # Switch to the new layout
+        directory.conn.execute("DELETE FROM MessageShards;")
+        directory.conn.executemany("INSERT INTO MessageShards (shard, location) VALUES (?, ?);",
+                                   list(enumerate(new_locations)))
+        if len(old_locations) == 0:
+            directory.conn.execute("DELETE FROM Messages;")
+        directory.conn.commit()
+    except Exception:
+        directory.conn.rollback()
+        for shard in new_shards:
+            if shard is not directory:
+                shard.conn.close()
+                os.remove(shard.location)
+        raise
+
+    for shard in new_shards:
+        shard.close()
+    for shard in old_shards:
+        shard.close()
+        if shard is not directory:
+            os.remove(shard.location)
+    directory.conn.close()
+
+    logger.info("Moved %d messages from %d to %d shards", moved, len(old_locations), shard_count)
+    return moved
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m Database.Reshard", description="Offline messages re-sharding.")
+    parser.add_argument("--db", default=DB_LOCATION, help="Directory (Users) database")
+    parser.add_argument("--shards", type=int, required=True, help="New amount of shards, 0 for not sharded")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    if args.shards < 0:
+        parser.error("--shards can't be negative")
+
+    start = time.perf_counter()
+    reshard(args.db, args.shards, args.batch_size)
+    logger.info("Done in %.2f seconds", time.perf_counter() - start)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,11 +1,8 @@
-import logging
 import os
 from defenitions import ROOT_DIR
+from Server.LogPipeline import setup_logging
 
 DB_LOCATION = os.path.join(ROOT_DIR, "server.db")
 MODULE_LOGGER_NAME = "Database"
 
-format = '[ %(levelname)s ] %(asctime)s.%(msecs)03d - %(filename)s:%(lineno)s - %(funcName)s - %(message)s'
-level = logging.DEBUG
-
-logging.basicConfig(format=format, level=level, datefmt='%H:%M:%S')
+setup_logging()
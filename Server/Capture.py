@@ -0,0 +1,155 @@
+import itertools
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Iterator
+
+logger = logging.getLogger(__name__)
+
+TRACE_MAGIC = b"MUTRACE1"
+TRACE_FILE_HEADER_FMT = f"<{len(TRACE_MAGIC)}sd"  # Magic, wall clock time (unix epoch) of the trace start
+TRACE_RECORD_FMT = "<BIdII"  # Record type, connection id, seconds since trace start, original length, stored length
+S_TRACE_FILE_HEADER = struct.calcsize(TRACE_FILE_HEADER_FMT)
+S_TRACE_RECORD = struct.calcsize(TRACE_RECORD_FMT)
+
+RECORD_OPEN = 1
+RECORD_DATA = 2
+RECORD_CLOSE = 3
+
+
+@dataclass
+class TraceRecord:
+    type: int
+    connection_id: int
+    timestamp: float  # Seconds since trace start
+    length: int  # Original length of the data
+    data: bytes  # May be shorter than 'length' if the payload was truncated
+
+
+class TraceWriter:
+    """
+    Writes the inbound bytes of each connection, with timings, to rotating binary trace files.
+    Shared between worker threads.
+    """
+    def __init__(self, directory: str, max_file_bytes: int = 64 * 1024 * 1024, max_files: int = 10,
+                 max_payload_bytes: Optional[int] = None):
+        """
+        :param directory: Where to write trace files
+        :param max_file_bytes: Rotate when the current file is bigger than this
+        :param max_files: Oldest trace files are deleted when there are more than this
+        :param max_payload_bytes: If set, only the first bytes of each connection are stored, the rest are recorded
+        by length only.
+        """
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.max_payload_bytes = max_payload_bytes
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection_ids = itertools.count(1)
+        self._start = time.monotonic()
+        self._start_epoch = time.time()
+        self._file_index = 0
+        self._file = None
+        self.__rotate()
+
+    def wrap(self, client_socket: socket.socket) -> "CaptureSocket":
+        return CaptureSocket(client_socket, self, next(self._connection_ids))
+
+    def record(self, record_type: int, connection_id: int, data: bytes = b'', length: Optional[int] = None):
+        if length is None:
+            length = len(data)
+        timestamp = time.monotonic() - self._start
+        header = struct.pack(TRACE_RECORD_FMT, record_type, connection_id, timestamp, length, len(data))
+
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(header)
+            self._file.write(data)
+            if self._file.tell() > self.max_file_bytes:
+                self.__rotate()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __rotate(self):
+        """
+        Open next trace file and delete the oldest ones. Caller must hold the lock (or be the constructor).
+        """
+        if self._file is not None:
+            self._file.close()
+
+        self._file_index += 1
+        path = os.path.join(self.directory, f"trace-{int(self._start_epoch)}-{self._file_index:05d}.bin")
+        logger.info("Writing wire trace to: %s", path)
+        self._file = open(path, "wb")
+        self._file.write(struct.pack(TRACE_FILE_HEADER_FMT, TRACE_MAGIC, self._start_epoch))
+
+        trace_files = list_trace_files(self.directory)
+        for old_path in trace_files[:max(0, len(trace_files) - self.max_files)]:
+            os.remove(old_path)
+
+
+class CaptureSocket:
+    """
+    Wraps accepted client socket. Every received chunk is written to the trace. Everything else goes to the socket.
+    """
+    def __init__(self, client_socket: socket.socket, writer: TraceWriter, connection_id: int):
+        self._socket = client_socket
+        self._writer = writer
+        self._connection_id = connection_id
+        self._stored_bytes = 0
+        self._closed = False
+
+        self._writer.record(RECORD_OPEN, self._connection_id)
+
+    def recv(self, size: int, *args) -> bytes:
+        data = self._socket.recv(size, *args)
+
+        stored = data
+        if self._writer.max_payload_bytes is not None:
+            stored = data[:max(0, self._writer.max_payload_bytes - self._stored_bytes)]
+        self._stored_bytes += len(stored)
+
+        self._writer.record(RECORD_DATA, self._connection_id, stored, len(data))
+        return data
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._writer.record(RECORD_CLOSE, self._connection_id)
+        self._socket.close()
+
+    def __getattr__(self, item):
+        return getattr(self._socket, item)
+
+
+def list_trace_files(directory: str) -> list[str]:
+    names = sorted(name for name in os.listdir(directory) if name.startswith("trace-") and name.endswith(".bin"))
+    return [os.path.join(directory, name) for name in names]
+
+
+def read_trace(path: str) -> Iterator[TraceRecord]:
+    with open(path, "rb") as file:
+        magic, _start_epoch = struct.unpack(TRACE_FILE_HEADER_FMT, file.read(S_TRACE_FILE_HEADER))
+        if magic != TRACE_MAGIC:
+            raise ValueError(f"File: {path} is not a wire trace")
+
+        while True:
+            header = file.read(S_TRACE_RECORD)
+            if len(header) < S_TRACE_RECORD:
+                # End of file, or a record cut in the middle (server was killed while writing)
+                return
+            record_type, connection_id, timestamp, length, stored_length = struct.unpack(TRACE_RECORD_FMT, header)
+            data = file.read(stored_length)
+            yield TraceRecord(record_type, connection_id, timestamp, length, data)
@@ -2,134 +2,176 @@ import logging
 import socket
 import threading
 import time
+from contextlib import nullcontext
+from typing import Optional
 
 from Database.Database import Database, UserNotExistDBException, UserAlreadyExists
-from Server import LOGGER_FORMAT_THREAD, LOGGER_DATE_FORMAT
+from Server import LogPipeline
+from Server.Cluster import Cluster
 from Server.ProtocolDefenitions import S_USERNAME, S_CLIENT_ID, S_REQUEST_HEADER, S_PUBLIC_KEY, S_MESSAGE_TYPE, \
-    S_CONTENT_SIZE, S_MESSAGE_ID, SERVER_VERSION, S_RECV_BUFF, S_RECV_CIPHER_BUFF
-from Server.Request import RequestHeader, unpack_request_header
+    S_CONTENT_SIZE, S_MESSAGE_ID, SERVER_VERSION, S_RECV_BUFF, S_PAGE_CURSOR, S_PAGE_MAX_BYTES, \
+    S_PAGE_MAX_COUNT, S_RETRY_AFTER, S_ONLINE_WINDOW, S_ONLINE_LIMIT, LAST_SEEN_WRITE_INTERVAL, PAGE_STREAM_CHUNK, \
+    cipher_buff_size
+from Server.Deadlines import ConnectionDeadlines, DeadlineExceeded, ContentTooLarge, counters as deadline_counters
+from Server.Diagnostics import Diagnostics
+from Server.RateLimiter import RateLimiter
+from Server.Presence import PresenceIndex
+from Server.Request import RequestHeader, unpack_request_header, unpack_pull_page_request, unpack_online_users_request
 from Server.OpCodes import ResponseCodes, RequestCodes, MessageTypes
-from Server.Response import BaseResponse, MessageResponse, ResponsePayload_PullMessage
+from Server.Response import BaseResponse, MessageResponse, ResponsePayload_PullMessage, ResponsePayload_PullPage, \
+    ResponsePayload_MailboxStatus, ResponsePayload_OnlineUser
 
 
+# Records are formatted with the thread id by the log pipeline (see LogPipeline.THREAD_FORMAT_LOGGERS).
+# Hot path lines use lazy % formatting, so nothing is formatted when the level is disabled.
 logger = logging.getLogger(__name__)
-logger.propagate = False  # We add custom format, so we don't want to propagate the message to the root logger (duplicate messages)
-
-logger_handler = logging.StreamHandler()  # Handler for the logger
-logger_handler.setFormatter(logging.Formatter(LOGGER_FORMAT_THREAD, datefmt=LOGGER_DATE_FORMAT))
-logger.addHandler(logger_handler)
-
-# Shared mutex object between worker threads
-database = Database()
 
 
 class ProtocolError(Exception):
     def __init__(self, message: str):
-        super.__init__(message)
+        super().__init__(message)
 
 
 class ClientWorker(threading.Thread):
-    def __init__(self, client_socket: socket, on_close):
+    def __init__(self, client_socket: socket, on_close, database: Database, presence: PresenceIndex,
+                 deadlines: Optional[ConnectionDeadlines] = None, rate_limiter: Optional[RateLimiter] = None,
+                 diagnostics: Optional[Diagnostics] = None, recv_chunk_size: int = S_RECV_BUFF,
+                 cluster: Optional[Cluster] = None):
+        """
+        :param database: Shared between worker threads
+        :param presence: Last activity of each client, shared between worker threads
+        """
         super(ClientWorker, self).__init__()
         self.version = SERVER_VERSION
 
         self.client_socket = client_socket
         self.on_close = on_close
+        self.database = database
+        self.presence = presence
+        self.deadlines = deadlines if deadlines is not None else ConnectionDeadlines()
+        self.rate_limiter = rate_limiter
+        self.diagnostics = diagnostics
+        self.recv_cipher_buff = cipher_buff_size(recv_chunk_size)
+        self.cluster = cluster
+
+        # Response transfer, for the minimum transfer rate. A connection sends a single response.
+        self.send_started: Optional[float] = None
+        self.bytes_sent = 0
+
+        # Used by diagnostics stack dump.
+        self.current_opcode: Optional[RequestCodes] = None
+        self.request_started: Optional[float] = None
 
     def run(self) -> None:
+        LogPipeline.begin_request()
         logger.info("Running worker...")
 
         try:
+            self.request_started = time.monotonic()
             header = self.__receive_request_header()
-            logger.debug(f"Header: {header}")
+            logger.debug("Header: %s", header)
 
             logger.info("Handling request")
 
-            # Unregistered API
-            if header.code == RequestCodes.REQC_REGISTER_USER:
-                self.__handle_register_request()
-
-            # Registered API - do not allow unregistered users to call these API calls.
-            else:
-                # Check if registered user
-                if not database.is_client_exists(header.clientId.hex()):
-                    self.__send_error()
-                else:
-                    # Update user last seen
-                    database.update_last_seen(header.clientId.hex())
-
-                    if header.code == RequestCodes.REQC_CLIENT_LIST:
-                        self.__handle_client_list_request(header)
-
-                    elif header.code == RequestCodes.REQC_PUB_KEY:
-                        self.__handle_pub_key_request()
-
-                    elif header.code == RequestCodes.REQC_SEND_MESSAGE:
-                        self.__handle_send_message_request(header)
-
-                    elif header.code == RequestCodes.REQC_WAITING_MSGS:
-                        self.__handle_pull_waiting_messages(header)
-
-                    else:
-                        raise ValueError("Request code: " + str(header.code) + " is not recognized.")
-
-            # Call callback
-            self.on_close(self)
+            self.current_opcode = header.code
+            with self.__profile(header.code.name):
+                self.__dispatch_request(header)
         except (ConnectionResetError, ConnectionAbortedError):
             logger.info("A client has disconnected")
 
             self.client_socket.close()
+        except DeadlineExceeded as e:
+            # Don't send anything to a stalled client, just drop it.
+            logger.warning("Dropping connection: %s (Deadline counters: %s)", e, deadline_counters.snapshot())
+            self.client_socket.close()
+        except ContentTooLarge as e:
+            # Policy rejection, not a server error. The content was not read, drain it so the client gets the error.
+            logger.warning("Rejecting request: %s", e)
+            self.__send_error()
+            self.__drain_request()
         except Exception as e:
             logger.exception(e)
 
             logger.info("Sending error message to client...")
             self.__send_error()
 
-            logger.error(f"Forcing connection close with client: {self.client_socket.getpeername()}")
+            logger.error("Forcing connection close with client: %s", self.client_socket.getpeername())
+            self.client_socket.close()
+        finally:
             self.client_socket.close()
 
-    def __handle_request(self):
-        header = self.__receive_request_header()
-        logger.debug(f"Header: {header}")
-
-        logger.info("Handling request")
+            # Call callback
+            self.on_close(self)
 
+    def __dispatch_request(self, header: RequestHeader):
+        # Unregistered API
         if header.code == RequestCodes.REQC_REGISTER_USER:
-            self.__handle_register_request()
+            # Unregistered clients don't have client id yet, so we limit by ip.
+            peer_ip = self.client_socket.getpeername()[0].encode()
+            if not self.__is_throttled(header.code, peer_ip):
+                self.__handle_register_request()
+
+        # Registered API - do not allow unregistered users to call these API calls.
+        else:
+            # Check if registered user. Clients in the presence index were registered, no need to query the DB.
+            if self.presence.last_seen(header.clientId) is None and not self.database.is_client_exists(header.clientId.hex()):
+                logger.warning("Rejecting request of unregistered client: %s", header.clientId.hex())
+                self.__send_error()
+                self.__drain_request()
+            elif self.__is_throttled(header.code, header.clientId):
+                pass
+            else:
+                # Update user last seen. The DB copy (read only on start) is written once per interval.
+                now = time.time()
+                previous = self.presence.touch(header.clientId, now)
+                if previous is None or now // LAST_SEEN_WRITE_INTERVAL != previous // LAST_SEEN_WRITE_INTERVAL:
+                    self.database.update_last_seen(header.clientId.hex())
 
-        # Update user last seen
-        # We do this after registering, because user doesn't exist on DB if not registered.
-        database.update_last_seen(header.clientId.hex())
+                if header.code == RequestCodes.REQC_CLIENT_LIST:
+                    self.__handle_client_list_request(header)
 
-        if header.code == RequestCodes.REQC_CLIENT_LIST:
-            self.__handle_client_list_request(header)
+                elif header.code == RequestCodes.REQC_PUB_KEY:
+                    self.__handle_pub_key_request()
 
-        elif header.code == RequestCodes.REQC_PUB_KEY:
-            self.__handle_pub_key_request()
+                elif header.code == RequestCodes.REQC_SEND_MESSAGE:
+                    self.__handle_send_message_request(header)
 
-        elif header.code == RequestCodes.REQC_SEND_MESSAGE:
-            self.__handle_send_message_request(header)
+                elif header.code == RequestCodes.REQC_WAITING_MSGS:
+                    self.__handle_pull_waiting_messages(header)
 
-        elif header.code == RequestCodes.REQC_WAITING_MSGS:
-            self.__handle_pull_waiting_messages(header)
+                elif header.code == RequestCodes.REQC_WAITING_MSGS_PAGE:
+                    self.__handle_pull_messages_page(header)
 
-        else:
-            raise ValueError("Request code: " + str(header.code) + " is not recognized.")
+                elif header.code == RequestCodes.REQC_MAILBOX_STATUS:
+                    self.__handle_mailbox_status_request(header)
+
+                elif header.code == RequestCodes.REQC_ONLINE_USERS:
+                    self.__handle_online_users_request(header)
+
+                else:
+                    raise ValueError("Request code: " + str(header.code) + " is not recognized.")
+
+    def __profile(self, handler: str):
+        if self.diagnostics is None:
+            return nullcontext()
+        return self.diagnostics.profile(handler)
 
     def __handle_register_request(self):
         logger.info("Handling register request...")
 
-        username = self.client_socket.recv(S_USERNAME).decode().rstrip('\x00')
-        pub_key = self.client_socket.recv(S_PUBLIC_KEY)
+        username = self.__recv_exact(S_USERNAME).decode().rstrip('\x00')
+        pub_key = self.__recv_exact(S_PUBLIC_KEY)
 
         # First check is name in database
         try:
-            register_success, client_id = database.register_user(username, pub_key)
+            register_success, client_id = self.database.register_user(username, pub_key)
+            if self.cluster is not None:
+                self.cluster.replicate_user(client_id.hex())
 
             response = BaseResponse(self.version, ResponseCodes.RESC_REGISTER_SUCCESS, S_CLIENT_ID, client_id)
             self.__send_response(response)
         except UserAlreadyExists:
-            logger.error(f"User {username} already exists in database!")
+            logger.error("User %s already exists in database!", username)
             self.__send_error()
 
         logger.info("Finished handling register request.")
@@ -138,14 +180,14 @@ class ClientWorker(threading.Thread):
         logger.info("Handling client list request...")
 
         # Get users to send
-        users = database.get_all_users()
+        users = self.database.get_all_users()
         # Minus 1 because registered user will not get his own data.
         payload_size = (S_CLIENT_ID + S_USERNAME) * (len(users) - 1)
 
         # Send first packet which contains headers and payload size.
         response = BaseResponse(self.version, ResponseCodes.RESC_LIST_USERS, payload_size, None)
         packet = response.pack()
-        self.client_socket.send(packet)
+        self.__sendall(packet)
 
         # Send the rest of the payload in chunks
         for client_id, username in users:
@@ -160,15 +202,15 @@ class ClientWorker(threading.Thread):
             client_id_payload = bytes.fromhex(client_id)
             username_null_padded_payload = username.ljust(S_USERNAME, '\0')
             payload = client_id_payload + username_null_padded_payload.encode()
-            self.client_socket.send(payload)
+            self.__sendall(payload)
 
         logger.info("Finished handling users list request.")
 
     def __handle_pub_key_request(self):
         logger.info("Handling public key request...")
-        client_id = self.client_socket.recv(S_CLIENT_ID)
+        client_id = self.__recv_exact(S_CLIENT_ID)
 
-        pub_key = database.get_user_by_client_id(client_id.hex())[3]
+        pub_key = self.database.get_user_by_client_id(client_id.hex())[3]
 
         pub_key_bytes = bytes.fromhex(pub_key)
         payload = client_id + pub_key_bytes
@@ -181,7 +223,8 @@ class ClientWorker(threading.Thread):
 
         # The one who send this request, we take all of the messages that have 'to_client' equal to him.
         requestee = header.clientId.hex()
-        db_messages = database.get_messages(requestee)
+        mailbox = self.__mailbox(requestee)
+        db_messages = mailbox.get_messages(requestee)
 
         payload = b''
 
@@ -199,13 +242,103 @@ class ClientWorker(threading.Thread):
                 packet = _payload.pack()
                 payload += packet
 
-                # Delete from database
-                database.delete_message(_id)
-
         response = BaseResponse(self.version, ResponseCodes.RESC_WAITING_MSGS, len(payload), payload)
         self.__send_response(response)
 
-    def __handle_encrypted_chunks(self, content_size: int, message_id: int) -> bool:
+        if db_messages is not None and len(db_messages) != 0:
+            # Delete from database only after the messages were sent. Messages are ordered by id, and newer messages
+            # get bigger ids.
+            mailbox.delete_messages_up_to(requestee, db_messages[-1][0])
+
+    def __handle_pull_messages_page(self, header: RequestHeader):
+        """
+        Paginated pull. The request cursor acknowledges (deletes) every message the client already received, and the
+        response contains the next batch that fits the client budget, with 'more pending' flag.
+        Messages are deleted only on the next page request, so delivery is at-least-once.
+        :param header:
+        :return:
+        """
+        logger.info("Handling pull messages page request...")
+
+        buff = self.__recv_exact(S_PAGE_CURSOR + S_PAGE_MAX_BYTES + S_PAGE_MAX_COUNT)
+        page_request = unpack_pull_page_request(buff)
+        logger.debug("Page request: %s", page_request)
+
+        requestee = header.clientId.hex()
+        mailbox = self.__mailbox(requestee)
+
+        # Acknowledge previous page
+        if page_request.cursor > 0:
+            deleted = mailbox.delete_messages_up_to(requestee, page_request.cursor)
+            logger.debug("Acknowledged %d messages", deleted)
+
+        db_messages, more_pending = mailbox.get_messages_page(requestee, page_request.cursor,
+                                                              page_request.maxBytes, page_request.maxCount)
+
+        messages = []
+        streamed = None
+        for db_message in db_messages:
+            # Unpack tuple
+            _id, to_client, from_client, _type, content_size, content = db_message
+            messages.append(ResponsePayload_PullMessage(bytes.fromhex(from_client), _id, MessageTypes(_type), content_size, content))
+            if content is None and content_size > 0:
+                # Bigger than the page budget, the content was not loaded.
+                streamed = (_id, content_size)
+
+        payload = ResponsePayload_PullPage(more_pending, messages).pack()
+        if streamed is None:
+            response = BaseResponse(self.version, ResponseCodes.RESC_WAITING_MSGS_PAGE, len(payload), payload)
+            self.__send_response(response)
+        else:
+            self.__send_streamed_page(mailbox, payload, *streamed)
+
+        logger.info("Finished handling pull messages page request. (Messages: %d, More pending: %s)", len(messages), more_pending)
+
+    def __send_streamed_page(self, mailbox, payload: bytes, message_id: int, content_size: int):
+        """
+        Send a page whose single message content was not loaded - the packed page (message header included) first,
+        then the content, read from the DB part by part.
+        """
+        logger.debug("Streaming content of message: %d (%d bytes)", message_id, content_size)
+        response = BaseResponse(self.version, ResponseCodes.RESC_WAITING_MSGS_PAGE, len(payload) + content_size, None)
+        self.__sendall(response.pack() + payload)
+        for offset in range(0, content_size, PAGE_STREAM_CHUNK):
+            # The response header is already sent, so a failure can't be reported - only the connection is dropped.
+            try:
+                chunk = mailbox.read_message_content(message_id, offset, PAGE_STREAM_CHUNK)
+            except Exception as e:
+                logger.error("Couldn't read content of message: %d (%s)", message_id, e)
+                raise ConnectionAbortedError(f"Content of message: {message_id} is gone") from e
+            if len(chunk) != min(PAGE_STREAM_CHUNK, content_size - offset):
+                raise ConnectionAbortedError(f"Content of message: {message_id} changed while it was sent")
+            self.__sendall(chunk)
+
+    def __handle_mailbox_status_request(self, header: RequestHeader):
+        logger.info("Handling mailbox status request...")
+        # No request payload. Answered from the in memory counters, no DB query.
+
+        requestee = header.clientId.hex()
+        status = self.__mailbox(requestee).get_mailbox_status(requestee)
+        by_type = {MessageTypes(_type): (count, total_bytes) for _type, (count, total_bytes) in status.by_type.items()}
+
+        payload = ResponsePayload_MailboxStatus(status.count, status.total_bytes, by_type)
+        response = BaseResponse(self.version, ResponseCodes.RESC_MAILBOX_STATUS, payload.size(), payload)
+        self.__send_response(response)
+
+    def __handle_online_users_request(self, header: RequestHeader):
+        logger.info("Handling online users request...")
+
+        buff = self.__recv_exact(S_ONLINE_WINDOW + S_ONLINE_LIMIT)
+        online_request = unpack_online_users_request(buff)
+
+        # Served from the in memory index, no DB query. Requestee doesn't get his own data.
+        online_users = self.presence.recent(online_request.window, online_request.limit, exclude=header.clientId)
+
+        payload = b''.join(ResponsePayload_OnlineUser(client_id, int(last_seen)).pack() for client_id, last_seen in online_users)
+        response = BaseResponse(self.version, ResponseCodes.RESC_ONLINE_USERS, len(payload), payload)
+        self.__send_response(response)
+
+    def __handle_encrypted_chunks(self, content_size: int, message_id: int, dst_client_id: bytes) -> bool:
         """
         This function is used for handling encrypted file and large text messages.
         :param content_size:
@@ -215,28 +348,31 @@ class ClientWorker(threading.Thread):
         """
         # Get chunk by chunk.
         bytes_left_to_recv = content_size
-        logger.info(f"Reading encrypted chunks (Totaling: {content_size} bytes)...")
+        logger.info("Reading encrypted chunks (Totaling: %d bytes)...", content_size)
 
         # NOTE: Yuval says in the forum : https://opal.openu.ac.il/mod/ouilforum/discuss.php?d=2977367&p=7101326#p7101326
         # That it's fine to load the file to RAM and just push to DB. I spent 2 days trying to append chunks to SQLite.
         # I also think, if we weren't allowed to collect the entire file to RAM, that appending chunks is still wrong.
         # SQLite is long term storage, not 'ram' like storage device. It affect performance for each query run.
-        stitched_chunks = b''
+        stitched_chunks = bytearray()
+        transfer_start = time.monotonic()
+        # Each read must make progress within the payload timeout, the minimum transfer rate bounds the whole content.
+        self.client_socket.settimeout(self.deadlines.payload_timeout)
 
         while bytes_left_to_recv > 0:
             # Get cipher
-            if bytes_left_to_recv > S_RECV_CIPHER_BUFF:
-                cipher = self.client_socket.recv(S_RECV_CIPHER_BUFF)
-                bytes_left_to_recv -= S_RECV_CIPHER_BUFF
-            else:
-                cipher = self.client_socket.recv(bytes_left_to_recv)
-                bytes_left_to_recv -= bytes_left_to_recv
+            cipher = self.__recv(min(bytes_left_to_recv, self.recv_cipher_buff))
+            bytes_left_to_recv -= len(cipher)
             # Stitch
             stitched_chunks += cipher
-        logger.debug(f"Finished stitching chunks! (Stitch length: {len(stitched_chunks)} bytes)")
+
+            # Slow client protection - after the grace period, the client must keep the minimum transfer rate.
+            self.__check_transfer_rate(len(stitched_chunks), transfer_start)
+        stitched_chunks = bytes(stitched_chunks)
+        logger.debug("Finished stitching chunks! (Stitch length: %d bytes)", len(stitched_chunks))
 
         logger.info("Inserting stitched chunks into DB...")
-        success = database.set_message_content(message_id, stitched_chunks)
+        success = self.__mailbox(dst_client_id.hex()).set_message_content(message_id, stitched_chunks)
         if not success:
             logger.error("Insertion failed!")
             self.__send_error()
@@ -249,9 +385,9 @@ class ClientWorker(threading.Thread):
         logger.info("Handling send message request...")
 
         # Get message header
-        dst_client_id = self.client_socket.recv(S_CLIENT_ID)
-        message_type = self.client_socket.recv(S_MESSAGE_TYPE)
-        content_size = self.client_socket.recv(S_CONTENT_SIZE)
+        dst_client_id = self.__recv_exact(S_CLIENT_ID)
+        message_type = self.__recv_exact(S_MESSAGE_TYPE)
+        content_size = self.__recv_exact(S_CONTENT_SIZE)
 
         # Process
         message_type_int = int.from_bytes(message_type, "little", signed=False)
@@ -287,11 +423,26 @@ class ClientWorker(threading.Thread):
             if content_size_int == 0:
                 raise ProtocolError(f"Expected to receive at least 1 character from text message.")
 
-        logger.info(f"Request message from: '{from_client.hex()}' to: '{to_client.hex()}', content size: {content_size_int}")
+        # Check content size before receiving any of the content
+        max_content_size = self.deadlines.max_content_size.get(message_type_enum)
+        if max_content_size is not None and content_size_int > max_content_size:
+            deadline_counters.increment("oversized_contents")
+            raise ContentTooLarge(message_type_enum, content_size_int, max_content_size)
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Request message from: '%s' to: '%s', content size: %d", from_client.hex(), to_client.hex(), content_size_int)
+
+        # Upload byte rate budget
+        if self.rate_limiter is not None:
+            retry_after = self.rate_limiter.acquire_upload(from_client, content_size_int)
+            if retry_after > 0:
+                self.__send_throttled(retry_after)
+                return
 
         # In any case, insert message with empty payload (if we need to insert payload, we update the row later)
         logger.debug("Inserting message to DB...")
-        success, message_id = database.insert_message(to_client.hex(), from_client.hex(), message_type_int, None)
+        mailbox = self.__mailbox(to_client.hex())
+        success, message_id = mailbox.insert_message(to_client.hex(), from_client.hex(), message_type_int, None)
         # Check insertion success
         if not success:
             logger.error("Failed to insert!")
@@ -301,17 +452,17 @@ class ClientWorker(threading.Thread):
         # Check if we need to insert any payload.
         # Check if message has encrypted payload. In both cases, we deal with encrypted chunks.
         if message_type_enum in (MessageTypes.SEND_FILE, MessageTypes.SEND_TEXT_MESSAGE):
-            success = self.__handle_encrypted_chunks(content_size_int, message_id)
+            success = self.__handle_encrypted_chunks(content_size_int, message_id, dst_client_id)
             if not success:
                 self.__send_error()
                 return
 
         # Check if we need to receive symmetric key.
         elif message_type_enum == MessageTypes.SEND_SYMMETRIC_KEY:
-            symm_key_enc = self.client_socket.recv(content_size_int)
+            symm_key_enc = self.__recv_exact(content_size_int)
 
             logger.info("Inserting symmetric key into DB...")
-            success = database.set_message_content(message_id, symm_key_enc)
+            success = mailbox.set_message_content(message_id, symm_key_enc)
             if not success:
                 logger.error("Insertion failed!")
                 self.__send_error()
@@ -323,25 +474,138 @@ class ClientWorker(threading.Thread):
         response = BaseResponse(self.version, ResponseCodes.RESC_SEND_MESSAGE, payload_size, payload)
         self.__send_response(response)
 
+    def __mailbox(self, client_id: str):
+        """
+        :param client_id: Mailbox owner (recipient) client id (hex str)
+        :return: The local database, or in cluster mode the remote mailbox of the node that owns the client
+        """
+        if self.cluster is None:
+            return self.database
+        return self.cluster.mailbox(client_id)
+
     def __receive_request_header(self) -> RequestHeader:
         logger.debug("Receiving request header...")
-        buff = self.client_socket.recv(S_REQUEST_HEADER)
-        if len(buff) == 0:
+        try:
+            buff = self.__recv_exact(S_REQUEST_HEADER, "header")
+        except ConnectionAbortedError:
             raise ConnectionAbortedError("Couldn't receive request header!")
         return unpack_request_header(buff)
 
+    def __recv(self, size: int, phase: str = "payload") -> bytes:
+        """
+        Single socket read of at most 'size' bytes, within the socket timeout.
+        :param size:
+        :param phase: 'header' or 'payload'
+        :return: At least 1 byte
+        """
+        try:
+            buff = self.client_socket.recv(size)
+        except socket.timeout:
+            deadline_counters.increment(f"{phase}_timeouts")
+            raise DeadlineExceeded(f"No data received for {self.client_socket.gettimeout():.1f} seconds while reading {phase}")
+        if len(buff) == 0:
+            raise ConnectionAbortedError("Client closed the connection")
+        return buff
+
+    def __recv_exact(self, size: int, phase: str = "payload") -> bytes:
+        """
+        Read exactly 'size' bytes, all of them within the timeout of the phase - a client can't hold the connection
+        by sending a byte at a time.
+        """
+        timeout = self.deadlines.header_timeout if phase == "header" else self.deadlines.payload_timeout
+        deadline = time.monotonic() + timeout
+        buff = b''
+        while len(buff) < size:
+            self.client_socket.settimeout(max(deadline - time.monotonic(), 0.001))
+            buff += self.__recv(size - len(buff), phase)
+        return buff
+
+    def __is_throttled(self, code: RequestCodes, key: bytes) -> bool:
+        """
+        Check the request budget of the key. If throttled, sends throttled response.
+        :param code: Request code
+        :param key: Client id, or peer ip
+        :return: True if the request must not be handled.
+        """
+        if self.rate_limiter is None:
+            return False
+
+        retry_after = self.rate_limiter.acquire_request(code, key)
+        if retry_after > 0:
+            self.__send_throttled(retry_after)
+            return True
+        return False
+
+    def __send_throttled(self, retry_after: float):
+        logger.info("Sending throttled response (Retry after: %.3f seconds)...", retry_after)
+        retry_after_ms = min(int(retry_after * 1000) + 1, 0xFFFFFFFF)
+        payload = retry_after_ms.to_bytes(S_RETRY_AFTER, "little", signed=False)
+        response = BaseResponse(self.version, ResponseCodes.RESC_THROTTLED, S_RETRY_AFTER, payload)
+        self.__send_response(response)
+        self.__drain_request()
+
+    def __drain_request(self):
+        """
+        The request payload was not read. Closing a socket with unread data sends RST, and the client may lose the
+        response before reading it. So end our side first, then read and discard what the client still sends,
+        bounded in bytes and time.
+        """
+        try:
+            self.client_socket.shutdown(socket.SHUT_WR)
+            deadline = time.monotonic() + self.deadlines.drain_timeout
+            drained = 0
+            while drained < self.deadlines.max_drain:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.client_socket.settimeout(remaining)
+                buff = self.client_socket.recv(min(S_RECV_BUFF, self.deadlines.max_drain - drained))
+                if len(buff) == 0:
+                    break
+                drained += len(buff)
+        except OSError:
+            return
+        logger.debug("Drained %d bytes of the unread request", drained)
+
     def __send_error(self):
         logger.info("Sending error response...")
         response = BaseResponse(self.version, ResponseCodes.RESC_ERROR, 0, None)
         packet = response.pack()
-        self.client_socket.sendall(packet)
+        self.__sendall(packet)
 
     def __send_response(self, response: BaseResponse):
         packet = response.pack()
 
         # Don't spam the entire payload into logs.
-        if response.payloadSize < S_RECV_BUFF:
-            logger.debug(f"Sending response (parsed): {response}")
+        if response.payloadSize < S_RECV_BUFF and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Sending response (parsed): %s", response)
 
-        self.client_socket.sendall(packet)
+        self.__sendall(packet)
         logger.debug("Sent!")
+
+    def __sendall(self, data: bytes):
+        """
+        Send all of the data. The read timeouts don't apply - each send must make progress within the send timeout,
+        and after the grace period the response must keep the minimum transfer rate. A big response to a client
+        that keeps reading it is never cut.
+        """
+        if self.send_started is None:
+            self.send_started = time.monotonic()
+        self.client_socket.settimeout(self.deadlines.send_timeout)
+
+        view = memoryview(data)
+        sent = 0
+        while sent < len(view):
+            try:
+                sent += self.client_socket.send(view[sent:])
+            except socket.timeout:
+                deadline_counters.increment("send_timeouts")
+                raise DeadlineExceeded(f"No data sent for {self.deadlines.send_timeout} seconds")
+            self.__check_transfer_rate(self.bytes_sent + sent, self.send_started)
+        self.bytes_sent += sent
+
+    def __check_transfer_rate(self, transferred: int, transfer_start: float):
+        elapsed = time.monotonic() - transfer_start
+        if elapsed > self.deadlines.min_rate_grace and transferred / elapsed < self.deadlines.min_transfer_rate:
+            deadline_counters.increment("slow_transfers")
+            raise DeadlineExceeded(f"Transfer rate is too slow: {transferred / elapsed:.0f} bytes/sec")
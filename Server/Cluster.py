@@ -0,0 +1,532 @@
+"""
+Cluster mode. Each node owns a hash range of client ids, and keeps the mailboxes (messages) of the clients it owns.
+The user directory (Users table) is replicated to all nodes, so any node can authenticate any client.
+
+A client can connect to any node. Requests on a mailbox the node doesn't own (send message to a recipient, or the
+pull / status requests of the requestee) go to the owner over the internal protocol, through a pool of persistent
+connections per node. The client protocol doesn't change.
+
+Internal protocol frames (little endian):
+    Request:  code (2 bytes, ClusterCodes), payload size (4 bytes), payload
+    Response: CLUSC_OK or CLUSC_ERROR (2 bytes), payload size (4 bytes), payload. Error payload is the message (utf-8).
+
+Each connection starts with a handshake, both sides prove they know the shared secret of the cluster:
+    Listening node:  CLUSC_HELLO  - nonce
+    Connecting node: CLUSC_AUTH   - HMAC-SHA256(secret, "client" + nonce), own nonce
+    Listening node:  CLUSC_OK     - HMAC-SHA256(secret, "server" + own nonce of the connecting node)
+The frames themselves are not encrypted nor signed. The internal protocol must be bound to a private interface
+(or a network only the nodes can reach), never to the interface the clients connect to.
+
+Running several nodes on localhost, each with its own config file and database:
+    node0.json: {"port": 8080, "db_location": "node0.db",
+                 "cluster": {"node_id": 0, "nodes": ["127.0.0.1:9080", "127.0.0.1:9081"], "secret": "..."}}
+    node1.json: {"port": 8081, "db_location": "node1.db",
+                 "cluster": {"node_id": 1, "nodes": ["127.0.0.1:9080", "127.0.0.1:9081"], "secret": "..."}}
+    python main.py --config node0.json
+    python main.py --config node1.json
+
+Users registered on a node are sent to the other nodes in the background, retried until the node answers.
+A node that starts catches up with the directory of the first node that answers, page by page.
+
+Not replicated: last seen times and the online users index are per node. Registering the same username on two nodes
+at the same time creates two users.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+import zlib
+from typing import Optional
+
+from Database.Database import Database
+from Database.MailboxCounters import MailboxStatus
+from Server.OpCodes import ClusterCodes
+from Server.ProtocolDefenitions import S_CLIENT_ID, S_USERNAME, S_PUBLIC_KEY, S_CLUSTER_HEADER, S_CLUSTER_NONCE
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_HEADER_FMT = "<HI"
+# Id, to client, from client, type, content size, content included (not for a content streamed by parts). Content follows.
+MESSAGE_ROW_FMT = f"<I{S_CLIENT_ID}s{S_CLIENT_ID}sBIB"
+S_MESSAGE_ROW = struct.calcsize(MESSAGE_ROW_FMT)
+USER_ROW_FMT = f"<{S_CLIENT_ID}s{S_USERNAME}s{S_PUBLIC_KEY}sQ"
+S_CLUSTER_MAC = hashlib.sha256().digest_size
+SYNC_USERS_PAGE = 1000  # Users per CLUSC_GET_USERS response
+REPLICATION_MAX_BACKOFF = 30.0  # Seconds between retries of a node that doesn't answer
+
+
+class ClusterError(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    """
+    :return: None if the peer closed the connection before the first byte
+    """
+    buff = bytearray()
+    while len(buff) < size:
+        chunk = sock.recv(size - len(buff))
+        if len(chunk) == 0:
+            if len(buff) == 0:
+                return None
+            raise ConnectionAbortedError("Cluster peer closed the connection in the middle of a frame")
+        buff += chunk
+    return bytes(buff)
+
+
+def _send_frame(sock: socket.socket, code: ClusterCodes, payload: bytes):
+    sock.sendall(struct.pack(CLUSTER_HEADER_FMT, code.value, len(payload)) + payload)
+
+
+def _recv_frame(sock: socket.socket, max_size: Optional[int] = None) -> Optional[tuple[ClusterCodes, bytes]]:
+    """
+    :param max_size: Max payload size, for frames of a peer that is not authenticated yet
+    """
+    header = _recv_exact(sock, S_CLUSTER_HEADER)
+    if header is None:
+        return None
+    code, payload_size = struct.unpack(CLUSTER_HEADER_FMT, header)
+    if max_size is not None and payload_size > max_size:
+        raise ConnectionAbortedError(f"Cluster frame of {payload_size} bytes is too big")
+    payload = _recv_exact(sock, payload_size) if payload_size > 0 else b''
+    if payload is None:
+        raise ConnectionAbortedError("Cluster peer closed the connection in the middle of a frame")
+    return ClusterCodes(code), payload
+
+
+def _mac(secret: bytes, role: bytes, nonce: bytes) -> bytes:
+    return hmac.new(secret, role + nonce, hashlib.sha256).digest()
+
+
+def _expect_frame(sock: socket.socket, code: ClusterCodes, size: int) -> bytes:
+    """
+    Receive a handshake frame.
+    :raise ConnectionAbortedError: Not the expected frame
+    """
+    frame = _recv_frame(sock, size)
+    if frame is None or frame[0] != code or len(frame[1]) != size:
+        raise ConnectionAbortedError(f"Cluster handshake failed, expected {code.name}")
+    return frame[1]
+
+
+def handshake_connect(sock: socket.socket, secret: bytes):
+    """
+    Authenticate a new connection to a node, and the node itself.
+    :raise ConnectionAbortedError: The node doesn't know the secret (or isn't a cluster node)
+    """
+    nonce = _expect_frame(sock, ClusterCodes.CLUSC_HELLO, S_CLUSTER_NONCE)
+    own_nonce = os.urandom(S_CLUSTER_NONCE)
+    _send_frame(sock, ClusterCodes.CLUSC_AUTH, _mac(secret, b"client", nonce) + own_nonce)
+    mac = _expect_frame(sock, ClusterCodes.CLUSC_OK, S_CLUSTER_MAC)
+    if not hmac.compare_digest(mac, _mac(secret, b"server", own_nonce)):
+        raise ConnectionAbortedError("Cluster handshake failed, the node doesn't know the secret")
+
+
+def handshake_accept(sock: socket.socket, secret: bytes):
+    """
+    Authenticate a connection from another node.
+    :raise ConnectionAbortedError: The peer doesn't know the secret
+    """
+    nonce = os.urandom(S_CLUSTER_NONCE)
+    _send_frame(sock, ClusterCodes.CLUSC_HELLO, nonce)
+    auth = _expect_frame(sock, ClusterCodes.CLUSC_AUTH, S_CLUSTER_MAC + S_CLUSTER_NONCE)
+    if not hmac.compare_digest(auth[:S_CLUSTER_MAC], _mac(secret, b"client", nonce)):
+        raise ConnectionAbortedError("Cluster handshake failed, the peer doesn't know the secret")
+    _send_frame(sock, ClusterCodes.CLUSC_OK, _mac(secret, b"server", auth[S_CLUSTER_MAC:]))
+
+
+def pack_message_rows(rows: list) -> bytes:
+    """
+    :param rows: Database message rows (id, to_client, from_client, type, content_size, content)
+    """
+    parts = []
+    for _id, to_client, from_client, _type, content_size, content in rows:
+        included = content_size > 0 and content is not None
+        parts.append(struct.pack(MESSAGE_ROW_FMT, _id, bytes.fromhex(to_client), bytes.fromhex(from_client), _type,
+                                 content_size, included))
+        if included:
+            parts.append(content)
+    return b''.join(parts)
+
+
+def unpack_message_rows(data: bytes) -> list:
+    rows = []
+    offset = 0
+    while offset < len(data):
+        _id, to_client, from_client, _type, content_size, included = struct.unpack_from(MESSAGE_ROW_FMT, data, offset)
+        offset += S_MESSAGE_ROW
+        content = data[offset:offset + content_size] if included else None
+        offset += content_size if included else 0
+        rows.append((_id, to_client.hex(), from_client.hex(), _type, content_size, content))
+    return rows
+
+
+def pack_user_row(client_id: str, username: str, pub_key: str, last_seen: int) -> bytes:
+    return struct.pack(USER_ROW_FMT, bytes.fromhex(client_id), username.encode(), bytes.fromhex(pub_key), last_seen)
+
+
+def pack_users_page(users: list[tuple[int, str, str, str, int]]) -> bytes:
+    """
+    :param users: Database.get_users_page rows
+    :return: Id of the last user (the next cursor, 0 if none), followed by the user rows
+    """
+    last_id = users[-1][0] if len(users) > 0 else 0
+    return struct.pack("<Q", last_id) + b''.join(pack_user_row(*user[1:]) for user in users)
+
+
+def unpack_users_page(data: bytes) -> tuple[int, list[tuple[str, str, str, int]]]:
+    return struct.unpack_from("<Q", data)[0], unpack_user_rows(data[8:])
+
+
+def unpack_user_rows(data: bytes) -> list[tuple[str, str, str, int]]:
+    rows = []
+    for client_id, username, pub_key, last_seen in struct.iter_unpack(USER_ROW_FMT, data):
+        rows.append((client_id.hex(), username.decode().rstrip('\x00'), pub_key.hex(), last_seen))
+    return rows
+
+
+def pack_mailbox_status(status: MailboxStatus) -> bytes:
+    payload = struct.pack("<IQB", status.count, status.total_bytes, len(status.by_type))
+    for _type, (count, total_bytes) in status.by_type.items():
+        payload += struct.pack("<BIQ", _type, count, total_bytes)
+    return payload
+
+
+def unpack_mailbox_status(data: bytes) -> MailboxStatus:
+    count, total_bytes, _types = struct.unpack_from("<IQB", data)
+    by_type = {_type: [type_count, type_bytes]
+               for _type, type_count, type_bytes in struct.iter_unpack("<BIQ", data[struct.calcsize("<IQB"):])}
+    return MailboxStatus(count, total_bytes, by_type)
+
+
+class ConnectionPool:
+    """
+    Persistent connections to a single node. A connection serves one request at a time; idle connections are
+    kept for the next request, up to the pool size.
+    """
+    def __init__(self, address: tuple[str, int], secret: bytes, size: int = 8, timeout: float = 30.0):
+        self.address = address
+        self.secret = secret
+        self.size = size
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._idle: list[socket.socket] = []
+
+    def request(self, code: ClusterCodes, payload: bytes) -> bytes:
+        """
+        :return: Response payload
+        :raise ClusterError: The node returned an error, or couldn't be reached
+        """
+        with self._lock:
+            sock = self._idle.pop() if len(self._idle) > 0 else None
+
+        # An idle connection may have been closed by the node (restart), retry once on a new connection.
+        # Not after a timeout - the node may have handled the request, and requests are not idempotent.
+        attempts = 2 if sock is not None else 1
+        for attempt in range(attempts):
+            if sock is None:
+                sock = self.__connect()
+            try:
+                _send_frame(sock, code, payload)
+                response = _recv_frame(sock)
+                if response is None:
+                    raise ConnectionAbortedError("Cluster node closed the connection")
+                break
+            except OSError as e:
+                sock.close()
+                sock = None
+                if attempt == attempts - 1 or isinstance(e, socket.timeout):
+                    raise ClusterError(f"Cluster node: {self.address} request {code.name} failed: {e}")
+
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(sock)
+                sock = None
+        if sock is not None:
+            sock.close()
+
+        response_code, response_payload = response
+        if response_code == ClusterCodes.CLUSC_ERROR:
+            raise ClusterError(f"Cluster node: {self.address} request {code.name} failed: {response_payload.decode()}")
+        return response_payload
+
+    def close(self):
+        with self._lock:
+            for sock in self._idle:
+                sock.close()
+            self._idle = []
+
+    def __connect(self) -> socket.socket:
+        try:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+        except OSError as e:
+            raise ClusterError(f"Couldn't connect to cluster node: {self.address}: {e}")
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            handshake_connect(sock, self.secret)
+        except OSError as e:
+            sock.close()
+            raise ClusterError(f"Couldn't connect to cluster node: {self.address}: {e}")
+        return sock
+
+
+class RemoteMailbox:
+    """
+    Mailbox methods of Database (same signatures and results), on the node that owns the recipient.
+    """
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+
+    def insert_message(self, to_client: str, from_client: str, message_type: int, content: Optional[bytes]) -> (bool, Optional[int]):
+        payload = bytes.fromhex(to_client) + bytes.fromhex(from_client) + struct.pack("<B", message_type) + (content or b'')
+        success, message_id = struct.unpack("<BI", self.pool.request(ClusterCodes.CLUSC_INSERT_MESSAGE, payload))
+        return bool(success), message_id
+
+    def set_message_content(self, message_id: int, content: Optional[bytes]) -> bool:
+        payload = struct.pack("<I", message_id) + (content or b'')
+        return bool(self.pool.request(ClusterCodes.CLUSC_SET_MESSAGE_CONTENT, payload)[0])
+
+    def get_messages(self, to_client: str):
+        return unpack_message_rows(self.pool.request(ClusterCodes.CLUSC_GET_MESSAGES, bytes.fromhex(to_client)))
+
+    def get_messages_page(self, to_client: str, after_id: int, max_bytes: int, max_count: int) -> tuple[list, bool]:
+        payload = bytes.fromhex(to_client) + struct.pack("<III", after_id, max_bytes, max_count)
+        response = self.pool.request(ClusterCodes.CLUSC_GET_MESSAGES_PAGE, payload)
+        return unpack_message_rows(response[1:]), bool(response[0])
+
+    def read_message_content(self, message_id: int, offset: int, size: int) -> bytes:
+        payload = struct.pack("<III", message_id, offset, size)
+        return self.pool.request(ClusterCodes.CLUSC_READ_MESSAGE_CONTENT, payload)
+
+    def delete_messages_up_to(self, to_client: str, last_id: int) -> int:
+        payload = bytes.fromhex(to_client) + struct.pack("<I", last_id)
+        return struct.unpack("<I", self.pool.request(ClusterCodes.CLUSC_DELETE_MESSAGES_UP_TO, payload))[0]
+
+    def delete_message(self, message_id: int):
+        self.pool.request(ClusterCodes.CLUSC_DELETE_MESSAGE, struct.pack("<I", message_id))
+
+    def get_mailbox_status(self, to_client: str) -> MailboxStatus:
+        return unpack_mailbox_status(self.pool.request(ClusterCodes.CLUSC_MAILBOX_STATUS, bytes.fromhex(to_client)))
+
+
+class Cluster:
+    def __init__(self, node_id: int, nodes: list[str], secret: str, pool_size: int = 8, timeout: float = 30.0):
+        """
+        :param node_id: Index of this node in 'nodes'
+        :param nodes: Internal protocol address ("ip:port") of every node, on a private interface. Node i owns the
+            i-th hash range.
+        :param secret: Shared by all of the nodes, authenticates the internal connections
+        :param pool_size: Max idle connections kept to each node
+        :param timeout: Seconds, of connect and of each internal request
+        """
+        if not 0 <= node_id < len(nodes):
+            raise ValueError(f"Node id: {node_id} is not in the {len(nodes)} cluster nodes")
+        if len(secret) == 0:
+            raise ValueError("Cluster secret can't be empty")
+
+        self.node_id = node_id
+        self.addresses = [self.__parse_address(node) for node in nodes]
+        self.secret = secret.encode()
+        self.timeout = timeout
+        self.database: Optional[Database] = None
+
+        self._mailboxes = [RemoteMailbox(ConnectionPool(address, self.secret, pool_size, timeout)) if i != node_id else None
+                           for i, address in enumerate(self.addresses)]
+        # Users to send to each node, see replicate_user
+        self._replication = [queue.Queue() if i != node_id else None for i in range(len(self.addresses))]
+        self._listen_sock: Optional[socket.socket] = None
+
+    @staticmethod
+    def __parse_address(node: str) -> tuple[str, int]:
+        ip, port = node.rsplit(":", 1)
+        return ip, int(port)
+
+    def owner_of(self, client_id: str) -> int:
+        """
+        :param client_id: Client id (hex str)
+        :return: Id of the node that owns the client mailbox. The crc32 space is split to equal ranges.
+        """
+        return (zlib.crc32(bytes.fromhex(client_id)) * len(self.addresses)) >> 32
+
+    def mailbox(self, client_id: str):
+        """
+        :return: The local Database if this node owns the client mailbox, else the RemoteMailbox of the owner
+        """
+        owner = self.owner_of(client_id)
+        return self.database if owner == self.node_id else self._mailboxes[owner]
+
+    def start(self, database: Database):
+        """
+        Start serving the internal protocol, and catch up the directory from the first node that answers.
+        """
+        self.database = database
+
+        self._listen_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listen_sock.bind(self.addresses[self.node_id])
+        self._listen_sock.listen()
+        threading.Thread(target=self.__accept_nodes, daemon=True).start()
+        logger.info("Cluster node: %d is listening on: %s:%d", self.node_id, *self.addresses[self.node_id])
+
+        self.__sync_users()
+
+        for i, pending in enumerate(self._replication):
+            if pending is not None:
+                threading.Thread(target=self.__replicate, args=(i, pending), daemon=True).start()
+
+    def shutdown(self):
+        if self._listen_sock is not None:
+            self._listen_sock.close()
+        for mailbox in self._mailboxes:
+            if mailbox is not None:
+                mailbox.pool.close()
+
+    def replicate_user(self, client_id: str):
+        """
+        Send a user registered on this node to all other nodes, in the background - the register request doesn't
+        wait for the other nodes.
+        """
+        _, _, username, pub_key, last_seen = self.database.get_user_by_client_id(client_id)
+        payload = pack_user_row(client_id, username, pub_key, last_seen)
+        for pending in self._replication:
+            if pending is not None:
+                pending.put(payload)
+
+    def __replicate(self, node_id: int, pending: queue.Queue):
+        """
+        Runs in the background, one thread per node. Sends the users in order, each one is retried until the node
+        answers (a node that restarts also catches up by itself, see __sync_users).
+        """
+        pool = self._mailboxes[node_id].pool
+        while True:
+            payload = pending.get()
+            backoff = 1.0
+            while True:
+                try:
+                    pool.request(ClusterCodes.CLUSC_ADD_USER, payload)
+                    break
+                except ClusterError as e:
+                    logger.warning("Couldn't replicate user to node: %d, retrying in %.0f seconds (%s)", node_id, backoff, e)
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, REPLICATION_MAX_BACKOFF)
+
+    def __sync_users(self):
+        for i, mailbox in enumerate(self._mailboxes):
+            if mailbox is None:
+                continue
+            after_id = 0
+            synced = added = 0
+            try:
+                while True:
+                    payload = struct.pack("<QI", after_id, SYNC_USERS_PAGE)
+                    after_id, rows = unpack_users_page(mailbox.pool.request(ClusterCodes.CLUSC_GET_USERS, payload))
+                    synced += len(rows)
+                    added += self.database.add_users(rows)
+                    if len(rows) < SYNC_USERS_PAGE:
+                        break
+            except ClusterError as e:
+                logger.warning("Couldn't sync users from node: %d (%s)", i, e)
+                continue
+            logger.info("Synced users from node: %d (Users: %d, Added: %d)", i, synced, added)
+            return
+
+    def __accept_nodes(self):
+        while True:
+            try:
+                sock, address = self._listen_sock.accept()
+            except OSError:
+                logger.info("Cluster listener closed")
+                return
+            logger.debug("New cluster node connection from: %s", address)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self.__serve_node, args=(sock, address), daemon=True).start()
+
+    def __serve_node(self, sock: socket.socket, address: tuple[str, int]):
+        """
+        Serve requests of a persistent connection from another node, until it closes.
+        """
+        with sock:
+            try:
+                sock.settimeout(self.timeout)
+                handshake_accept(sock, self.secret)
+                sock.settimeout(None)
+            except (OSError, ValueError) as e:
+                logger.warning("Rejected cluster connection from: %s (%s)", address, e)
+                return
+
+            while True:
+                try:
+                    request = _recv_frame(sock)
+                except OSError as e:
+                    logger.info("Cluster node connection failed: %s", e)
+                    return
+                if request is None:
+                    return
+
+                code, payload = request
+                try:
+                    response_code, response_payload = ClusterCodes.CLUSC_OK, self.__handle(code, payload)
+                except Exception as e:
+                    logger.error("Cluster request %s failed: %s", code.name, e)
+                    response_code, response_payload = ClusterCodes.CLUSC_ERROR, str(e).encode()
+
+                try:
+                    _send_frame(sock, response_code, response_payload)
+                except OSError as e:
+                    logger.info("Cluster node connection failed: %s", e)
+                    return
+
+    def __handle(self, code: ClusterCodes, payload: bytes) -> bytes:
+        database = self.database
+        logger.debug("Handling cluster request: %s (Payload: %d bytes)", code.name, len(payload))
+
+        if code == ClusterCodes.CLUSC_INSERT_MESSAGE:
+            to_client, from_client, message_type = struct.unpack_from(f"<{S_CLIENT_ID}s{S_CLIENT_ID}sB", payload)
+            content = payload[2 * S_CLIENT_ID + 1:] or None
+            result = database.insert_message(to_client.hex(), from_client.hex(), message_type, content)
+            success, message_id = result if result else (False, None)
+            return struct.pack("<BI", success, message_id or 0)
+
+        elif code == ClusterCodes.CLUSC_SET_MESSAGE_CONTENT:
+            message_id, = struct.unpack_from("<I", payload)
+            return struct.pack("<B", database.set_message_content(message_id, payload[4:]))
+
+        elif code == ClusterCodes.CLUSC_GET_MESSAGES:
+            return pack_message_rows(database.get_messages(payload.hex()))
+
+        elif code == ClusterCodes.CLUSC_GET_MESSAGES_PAGE:
+            to_client = payload[:S_CLIENT_ID].hex()
+            after_id, max_bytes, max_count = struct.unpack_from("<III", payload, S_CLIENT_ID)
+            rows, more_pending = database.get_messages_page(to_client, after_id, max_bytes, max_count)
+            return struct.pack("<B", more_pending) + pack_message_rows(rows)
+
+        elif code == ClusterCodes.CLUSC_READ_MESSAGE_CONTENT:
+            return database.read_message_content(*struct.unpack("<III", payload))
+
+        elif code == ClusterCodes.CLUSC_DELETE_MESSAGES_UP_TO:
+            last_id, = struct.unpack_from("<I", payload, S_CLIENT_ID)
+            return struct.pack("<I", database.delete_messages_up_to(payload[:S_CLIENT_ID].hex(), last_id))
+
+        elif code == ClusterCodes.CLUSC_DELETE_MESSAGE:
+            database.delete_message(struct.unpack("<I", payload)[0])
+            return b''
+
+        elif code == ClusterCodes.CLUSC_MAILBOX_STATUS:
+            return pack_mailbox_status(database.get_mailbox_status(payload.hex()))
+
+        elif code == ClusterCodes.CLUSC_ADD_USER:
+            database.add_user(*unpack_user_rows(payload)[0])
+            return b''
+
+        elif code == ClusterCodes.CLUSC_GET_USERS:
+            after_id, limit = struct.unpack("<QI", payload)
+            return pack_users_page(database.get_users_page(after_id, min(limit, SYNC_USERS_PAGE)))
+
+        raise ValueError(f"Cluster request code: {code} is not recognized.")
@@ -0,0 +1,139 @@
+import json
+import logging
+import socket
+from dataclasses import dataclass, field, fields
+from typing import Optional
+
+from Server.Deadlines import ConnectionDeadlines
+from Server.OpCodes import MessageTypes, RequestCodes
+from Server.ProtocolDefenitions import S_RECV_BUFF
+from Server.RateLimiter import RateLimiterConfig, TokenBucketBudget
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SocketOptions:
+    backlog: int = 128  # Listen backlog
+    recv_chunk_size: int = S_RECV_BUFF  # Plain bytes per read of encrypted chunks
+    so_rcvbuf: Optional[int] = None  # None keeps the OS default (and autotuning)
+    so_sndbuf: Optional[int] = None
+    tcp_nodelay: bool = True  # Small responses are sent at once, without waiting for Nagle
+    tcp_quickack: bool = False  # Linux only. Not sticky, the kernel may turn it off again after a while.
+    keepalive: bool = True
+    keepalive_idle: Optional[int] = 60  # Seconds
+    keepalive_interval: Optional[int] = 10  # Seconds
+    keepalive_count: Optional[int] = 5
+    reuse_addr: bool = True
+
+    def apply_listener(self, sock: socket.socket):
+        """
+        Must be called before bind. Buffer sizes set on the listener are inherited by accepted sockets.
+        """
+        if self.reuse_addr:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__apply_buffers(sock)
+
+    def apply_client(self, sock: socket.socket):
+        self.__apply_buffers(sock)
+
+        if self.tcp_nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.tcp_quickack:
+            self.__setsockopt_if_supported(sock, socket.IPPROTO_TCP, "TCP_QUICKACK", 1)
+
+        if self.keepalive:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if self.keepalive_idle is not None:
+                # macOS names it TCP_KEEPALIVE
+                name = "TCP_KEEPIDLE" if hasattr(socket, "TCP_KEEPIDLE") else "TCP_KEEPALIVE"
+                self.__setsockopt_if_supported(sock, socket.IPPROTO_TCP, name, self.keepalive_idle)
+            if self.keepalive_interval is not None:
+                self.__setsockopt_if_supported(sock, socket.IPPROTO_TCP, "TCP_KEEPINTVL", self.keepalive_interval)
+            if self.keepalive_count is not None:
+                self.__setsockopt_if_supported(sock, socket.IPPROTO_TCP, "TCP_KEEPCNT", self.keepalive_count)
+
+    def __apply_buffers(self, sock: socket.socket):
+        if self.so_rcvbuf is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.so_rcvbuf)
+        if self.so_sndbuf is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.so_sndbuf)
+
+    @staticmethod
+    def __setsockopt_if_supported(sock: socket.socket, level: int, name: str, value: int):
+        option = getattr(socket, name, None)
+        if option is None:
+            return
+        try:
+            sock.setsockopt(level, option, value)
+        except OSError as e:
+            logger.warning("Couldn't set socket option: %s (%s)", name, e)
+
+
+@dataclass
+class ServerConfig:
+    ip: str = "127.0.0.1"
+    port: int = 8080
+    socket: SocketOptions = field(default_factory=SocketOptions)
+    deadlines: ConnectionDeadlines = field(default_factory=ConnectionDeadlines)
+    rate_limit: Optional[RateLimiterConfig] = field(default_factory=RateLimiterConfig)  # None disables rate limiting.
+    capture: Optional[dict] = None  # TraceWriter arguments. None disables capture.
+    diagnostics: dict = field(default_factory=dict)  # Diagnostics arguments
+    db_location: Optional[str] = None  # Database file. None is the default location (see Database.DB_LOCATION).
+    cluster: Optional[dict] = None  # Cluster arguments. None runs a single node.
+
+
+def _dataclass_from_dict(cls, values: dict):
+    names = {f.name for f in fields(cls)}
+    unknown = set(values) - names
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown {cls.__name__} settings: {', '.join(sorted(unknown))}")
+    return cls(**values)
+
+
+def _rate_limiter_config(values: dict) -> RateLimiterConfig:
+    """
+    Budgets are keyed by request code name, and override the default budgets. A null budget removes the limit.
+    """
+    config = RateLimiterConfig()
+    for code_name, budget in values.pop("request_budgets", {}).items():
+        if budget is None:
+            config.request_budgets.pop(RequestCodes[code_name], None)
+        else:
+            config.request_budgets[RequestCodes[code_name]] = _dataclass_from_dict(TokenBucketBudget, budget)
+    if "upload_budget" in values:
+        budget = values.pop("upload_budget")
+        config.upload_budget = _dataclass_from_dict(TokenBucketBudget, budget) if budget is not None else None
+    if "max_keys" in values:
+        config.max_keys = values.pop("max_keys")
+
+    if len(values) > 0:
+        raise ValueError(f"Unknown RateLimiterConfig settings: {', '.join(sorted(values))}")
+    return config
+
+
+def load_server_config(path: str) -> ServerConfig:
+    """
+    Load server config JSON file. Every setting is optional, see ServerConfig for the defaults.
+    :param path: Config file
+    :return: ServerConfig
+    """
+    with open(path) as file:
+        values = json.load(file)
+
+    socket_values = values.pop("socket", {})
+    deadlines_values = values.pop("deadlines", {})
+    rate_limit_values = values.pop("rate_limit", {})
+
+    # Max content size is keyed by message type name
+    max_content_size = deadlines_values.pop("max_content_size", None)
+    deadlines = _dataclass_from_dict(ConnectionDeadlines, deadlines_values)
+    if max_content_size is not None:
+        for type_name, size in max_content_size.items():
+            deadlines.max_content_size[MessageTypes[type_name]] = size
+
+    config = _dataclass_from_dict(ServerConfig, values)
+    config.socket = _dataclass_from_dict(SocketOptions, socket_values)
+    config.deadlines = deadlines
+    config.rate_limit = _rate_limiter_config(rate_limit_values) if rate_limit_values is not None else None
+    return config
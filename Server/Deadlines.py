@@ -0,0 +1,67 @@
+import logging
+import threading
+from dataclasses import dataclass, field
+
+from Server.OpCodes import MessageTypes
+
+logger = logging.getLogger(__name__)
+
+# Max content size per message type. Checked before receiving any of the content.
+DEFAULT_MAX_CONTENT_SIZE = {
+    MessageTypes.REQ_SYMMETRIC_KEY: 0,
+    MessageTypes.SEND_SYMMETRIC_KEY: 1024,
+    MessageTypes.SEND_TEXT_MESSAGE: 1024 * 1024,
+    MessageTypes.SEND_FILE: 512 * 1024 * 1024,
+}
+
+
+@dataclass
+class ConnectionDeadlines:
+    header_timeout: float = 10.0  # Seconds to receive the whole request header.
+    payload_timeout: float = 30.0  # Seconds to receive each fixed size payload part, and for each read of a content.
+    send_timeout: float = 30.0  # Seconds to wait for each response send to make progress.
+    min_transfer_rate: int = 16 * 1024  # Bytes per second, enforced on large payloads and responses after the grace period.
+    min_rate_grace: float = 5.0  # Seconds before the minimum transfer rate is enforced.
+    drain_timeout: float = 1.0  # Seconds to read (and discard) the unread request payload of a throttled or rejected request.
+    max_drain: int = 1024 * 1024  # Bytes of unread request payload discarded, at most, before closing.
+    max_content_size: dict[MessageTypes, int] = field(default_factory=lambda: dict(DEFAULT_MAX_CONTENT_SIZE))
+
+
+class DeadlineCounters:
+    """
+    Counters of each kind of enforcement. Shared between worker threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.header_timeouts = 0
+        self.payload_timeouts = 0
+        self.send_timeouts = 0
+        self.slow_transfers = 0
+        self.oversized_contents = 0
+
+    def increment(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "header_timeouts": self.header_timeouts,
+                "payload_timeouts": self.payload_timeouts,
+                "send_timeouts": self.send_timeouts,
+                "slow_transfers": self.slow_transfers,
+                "oversized_contents": self.oversized_contents,
+            }
+
+
+counters = DeadlineCounters()
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+class ContentTooLarge(Exception):
+    def __init__(self, message_type: MessageTypes, content_size: int, max_content_size: int):
+        super().__init__(f"Content size: {content_size} of message type: {message_type} is bigger than the max: {max_content_size}")
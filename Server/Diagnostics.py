@@ -0,0 +1,213 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import signal
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIAGNOSTICS_DIR = "diagnostics"
+
+
+class Diagnostics:
+    """
+    Runtime diagnostics of the live server. Shared between worker threads.
+    - Sampled cProfile of requests, aggregated by handler (request code).
+    - tracemalloc snapshots diffed over an interval.
+    - Stack dump of all threads, with the current opcode and elapsed time of each worker.
+    Output is written to the diagnostics directory. Triggered by signals (see install_signal_handlers) or by calling
+    the methods directly.
+    """
+    def __init__(self, directory: str = DEFAULT_DIAGNOSTICS_DIR, profile_sample_rate: float = 0.0,
+                 allocation_interval: float = 60.0, allocation_top: int = 50):
+        """
+        :param directory: Where to write the output files
+        :param profile_sample_rate: Fraction of requests to profile (0 to 1). 0 disables profiling.
+        :param allocation_interval: Seconds between the two tracemalloc snapshots that are diffed
+        :param allocation_top: Amount of allocation sites in the diff output
+        """
+        self.directory = directory
+        self.profile_sample_rate = profile_sample_rate
+        self.allocation_interval = allocation_interval
+        self.allocation_top = allocation_top
+
+        # Set by the server, returns the live workers.
+        self.get_workers: Callable[[], list] = lambda: []
+
+        self._lock = threading.Lock()
+        self._profiles: dict[str, pstats.Stats] = {}
+        self._profiled_requests: dict[str, int] = {}
+        self._allocation_timer: Optional[threading.Timer] = None
+
+    def set_profile_sample_rate(self, rate: float):
+        logger.info("Setting profile sample rate to: %s", rate)
+        self.profile_sample_rate = rate
+
+    def apply_config(self, config: dict):
+        """
+        Runtime config, from the watched log config file (see LogPipeline.add_config_listener).
+        :param config: {"profile_sample_rate": 0.01, ...}. Other keys are ignored.
+        """
+        if "profile_sample_rate" in config:
+            rate = float(config["profile_sample_rate"])
+            if rate != self.profile_sample_rate:
+                self.set_profile_sample_rate(rate)
+
+    @contextmanager
+    def profile(self, handler: str):
+        """
+        Profiles the block with probability of the sample rate, and adds the result to the handler aggregate.
+        :param handler: Name to aggregate by
+        """
+        if self.profile_sample_rate <= 0 or random.random() >= self.profile_sample_rate:
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active on this thread (or interpreter, on newer python versions). Skip this sample.
+            yield
+            return
+
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                if handler in self._profiles:
+                    self._profiles[handler].add(profiler)
+                else:
+                    self._profiles[handler] = pstats.Stats(profiler)
+                self._profiled_requests[handler] = self._profiled_requests.get(handler, 0) + 1
+
+    def dump_profiles(self, reset: bool = True) -> list[str]:
+        """
+        Write aggregated profiles of each handler, as pstats binary file and as text summary sorted by cumulative time.
+        :param reset: Start new aggregation after the dump
+        :return: Written file paths
+        """
+        with self._lock:
+            profiles = self._profiles
+            profiled_requests = self._profiled_requests
+            if reset:
+                self._profiles = {}
+                self._profiled_requests = {}
+
+        paths = []
+        stamp = self.__stamp()
+        for handler, stats in profiles.items():
+            path = self.__path(f"profile-{handler}-{stamp}")
+            stats.dump_stats(path + ".prof")
+
+            text = io.StringIO()
+            text.write(f"Handler: {handler}, Profiled requests: {profiled_requests[handler]}\n\n")
+            pstats.Stats(path + ".prof", stream=text).sort_stats("cumulative").print_stats(50)
+            with open(path + ".txt", "w") as file:
+                file.write(text.getvalue())
+            paths.append(path + ".txt")
+
+        logger.info("Dumped profiles of %d handlers", len(profiles))
+        return paths
+
+    def dump_stacks(self) -> str:
+        """
+        Write the stack of every live thread. Worker threads are annotated with the current opcode and elapsed time.
+        :return: Written file path
+        """
+        now = time.monotonic()
+        workers = {worker.ident: worker for worker in self.get_workers()}
+        threads = {thread.ident: thread for thread in threading.enumerate()}
+
+        text = io.StringIO()
+        for ident, frame in sys._current_frames().items():
+            thread = threads.get(ident)
+            name = thread.name if thread is not None else "unknown"
+            worker = workers.get(ident)
+            if worker is not None and worker.request_started is not None:
+                opcode = worker.current_opcode.name if worker.current_opcode is not None else "header"
+                text.write(f"Worker {name} ({ident}) - Opcode: {opcode}, Elapsed: {now - worker.request_started:.3f} seconds\n")
+            else:
+                text.write(f"Thread {name} ({ident})\n")
+            text.write("".join(traceback.format_stack(frame)))
+            text.write("\n")
+
+        path = self.__path(f"stacks-{self.__stamp()}.txt")
+        with open(path, "w") as file:
+            file.write(text.getvalue())
+        logger.info("Dumped stacks of %d workers to: %s", len(workers), path)
+        return path
+
+    def start_allocation_diff(self):
+        """
+        Take tracemalloc snapshot now, and another one after the interval. The diff is written to file.
+        Tracing is stopped after the second snapshot, so it doesn't slow down the server when not needed.
+        """
+        with self._lock:
+            if self._allocation_timer is not None:
+                logger.warning("Allocation diff is already running")
+                return
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+            first = tracemalloc.take_snapshot()
+            logger.info("Tracing allocations for %s seconds...", self.allocation_interval)
+
+            self._allocation_timer = threading.Timer(self.allocation_interval, self.__finish_allocation_diff, [first])
+            self._allocation_timer.daemon = True
+            self._allocation_timer.start()
+
+    def __finish_allocation_diff(self, first: tracemalloc.Snapshot):
+        second = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        diff = second.filter_traces(filters).compare_to(first.filter_traces(filters), "lineno")
+
+        path = self.__path(f"allocations-{self.__stamp()}.txt")
+        with open(path, "w") as file:
+            file.write(f"Allocation diff over {self.allocation_interval} seconds (Top {self.allocation_top})\n\n")
+            for stat in diff[:self.allocation_top]:
+                file.write(f"{stat}\n")
+        logger.info("Dumped allocation diff to: %s", path)
+
+        with self._lock:
+            self._allocation_timer = None
+
+    def install_signal_handlers(self):
+        """
+        SIGUSR1 - dump stacks and profiles. SIGUSR2 - allocation diff.
+        Must be called from the main thread. Not available on Windows.
+        """
+        if not hasattr(signal, "SIGUSR1"):
+            logger.warning("Diagnostics signals are not supported on this platform")
+            return
+
+        # Signal handlers run on the main thread between bytecodes, so the actual work is done on a new thread.
+        def on_dump(_signum, _frame):
+            threading.Thread(target=lambda: (self.dump_stacks(), self.dump_profiles()), daemon=True).start()
+
+        def on_allocations(_signum, _frame):
+            threading.Thread(target=self.start_allocation_diff, daemon=True).start()
+
+        signal.signal(signal.SIGUSR1, on_dump)
+        signal.signal(signal.SIGUSR2, on_allocations)
+        logger.info("Diagnostics signals installed (pid %d), output directory: %s", os.getpid(), self.directory)
+
+    def __path(self, name: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, name)
+
+    @staticmethod
+    def __stamp() -> str:
+        return time.strftime("%Y%m%d-%H%M%S")
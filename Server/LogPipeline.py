@@ -0,0 +1,162 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+LOGGER_FORMAT = '[ %(levelname)s ] %(asctime)s.%(msecs)03d - %(filename)s:%(lineno)s - %(funcName)s - %(message)s'
+LOGGER_FORMAT_THREAD = '[ %(levelname)s ] %(asctime)s.%(msecs)03d - [Thread %(thread)d] - %(filename)s:%(lineno)s - %(funcName)s - %(message)s'
+LOGGER_DATE_FORMAT = '%H:%M:%S'
+LOGGER_DEFAULT_LEVEL = logging.DEBUG
+
+# Records of these loggers are formatted with the thread id.
+THREAD_FORMAT_LOGGERS = {"Server.ClientWorker"}
+
+# Loggers with per request INFO lines, that are subject to sampling.
+SAMPLED_LOGGERS = ("Server.ClientWorker", "Database")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_sampler: Optional["RequestSampler"] = None
+_setup_lock = threading.Lock()
+# Called with each applied log config, for the keys of other modules (see add_config_listener).
+_config_listeners: list[Callable[[dict], None]] = []
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueue the record as is. The default QueueHandler formats the message on the calling thread, we want the
+    background thread to do it.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _PipelineFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__(LOGGER_FORMAT, datefmt=LOGGER_DATE_FORMAT)
+        self._thread_formatter = logging.Formatter(LOGGER_FORMAT_THREAD, datefmt=LOGGER_DATE_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        if record.name in THREAD_FORMAT_LOGGERS:
+            return self._thread_formatter.format(record)
+        return super().format(record)
+
+
+class RequestSampler(logging.Filter):
+    """
+    Keeps the INFO (and lower) lines of only a fraction of the requests. WARNING and above always pass.
+    The decision is made once per request (per worker thread), so a sampled request keeps all of its lines.
+    """
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+        self._local = threading.local()
+
+    def begin_request(self):
+        self._local.sampled = self.rate >= 1 or random.random() < self.rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or getattr(self._local, "sampled", True)
+
+
+def setup_logging(level: int = LOGGER_DEFAULT_LEVEL):
+    """
+    Configure the root logger to enqueue records. A single background thread formats and writes them to stderr,
+    so worker threads don't format nor wait on the stream lock. Safe to call more than once.
+    """
+    global _listener, _sampler
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        log_queue = queue.SimpleQueue()
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(_PipelineFormatter())
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+        root = logging.getLogger()
+        root.addHandler(_DeferredQueueHandler(log_queue))
+        root.setLevel(level)
+
+        _sampler = RequestSampler()
+        for name in SAMPLED_LOGGERS:
+            logging.getLogger(name).addFilter(_sampler)
+
+
+def stop_logging():
+    """
+    Flush the queue and stop the background thread.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def begin_request():
+    """
+    Called by the worker at the start of each request, decides if the INFO lines of the request are logged.
+    """
+    if _sampler is not None:
+        _sampler.begin_request()
+
+
+def apply_log_config(config: dict):
+    """
+    Apply log config at runtime.
+    :param config: {"levels": {"root": "INFO", "Server.ClientWorker": "WARNING", ...}, "info_sample_rate": 0.1}
+    """
+    for name, level in config.get("levels", {}).items():
+        logger = logging.getLogger() if name == "root" else logging.getLogger(name)
+        logger.setLevel(level.upper() if isinstance(level, str) else level)
+
+    if _sampler is not None and "info_sample_rate" in config:
+        _sampler.rate = float(config["info_sample_rate"])
+
+    for listener in _config_listeners:
+        listener(config)
+
+
+def add_config_listener(listener: Callable[[dict], None]):
+    """
+    Call the listener with each log config applied from now on, so other runtime knobs can live in the same
+    watched file (e.g. Diagnostics.apply_config).
+    """
+    _config_listeners.append(listener)
+
+
+def load_log_config(path: str):
+    with open(path) as file:
+        apply_log_config(json.load(file))
+
+
+def watch_log_config(path: str, interval: float = 5.0) -> threading.Thread:
+    """
+    Apply log config file now (if it exists), and re-apply it whenever it is modified.
+    """
+    def watch():
+        last_mtime = None
+        while True:
+            try:
+                mtime = os.path.getmtime(path)
+                if mtime != last_mtime:
+                    last_mtime = mtime
+                    load_log_config(path)
+                    logging.getLogger(__name__).info("Applied log config: %s", path)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logging.getLogger(__name__).error("Couldn't apply log config: %s (%s)", path, e)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=watch, daemon=True)
+    thread.start()
+    return thread
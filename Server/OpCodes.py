@@ -7,6 +7,9 @@ class RequestCodes(Enum):
 	REQC_PUB_KEY = 1002
 	REQC_SEND_MESSAGE = 1003
 	REQC_WAITING_MSGS = 1004
+	REQC_WAITING_MSGS_PAGE = 1005
+	REQC_MAILBOX_STATUS = 1006
+	REQC_ONLINE_USERS = 1007
 
 class ResponseCodes(Enum):
 	RESC_REGISTER_SUCCESS = 2000
@@ -14,7 +17,28 @@ class ResponseCodes(Enum):
 	RESC_PUBLIC_KEY = 2002
 	RESC_SEND_MESSAGE = 2003
 	RESC_WAITING_MSGS = 2004
+	RESC_WAITING_MSGS_PAGE = 2005
+	RESC_MAILBOX_STATUS = 2006
+	RESC_ONLINE_USERS = 2007
 	RESC_ERROR = 9000
+	RESC_THROTTLED = 9001
+
+# Internal protocol between cluster nodes (see Server.Cluster)
+class ClusterCodes(Enum):
+	CLUSC_INSERT_MESSAGE = 3000
+	CLUSC_SET_MESSAGE_CONTENT = 3001
+	CLUSC_GET_MESSAGES = 3002
+	CLUSC_GET_MESSAGES_PAGE = 3003
+	CLUSC_DELETE_MESSAGES_UP_TO = 3004
+	CLUSC_DELETE_MESSAGE = 3005
+	CLUSC_MAILBOX_STATUS = 3006
+	CLUSC_ADD_USER = 3007
+	CLUSC_GET_USERS = 3008
+	CLUSC_READ_MESSAGE_CONTENT = 3009
+	CLUSC_HELLO = 3010
+	CLUSC_AUTH = 3011
+	CLUSC_OK = 3100
+	CLUSC_ERROR = 3101
 
 class MessageTypes(Enum):
 	REQ_SYMMETRIC_KEY = 1
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class PresenceIndex:
+    """
+    In memory index of client ids ordered by last activity (least recent first). Shared between worker threads.
+    Touch and the 'who is online' query never touch the DB. Clients that were not active for longer than the
+    retention are dropped, so the index holds only the recently active clients.
+    """
+    def __init__(self, retention: float = 3600):
+        """
+        :param retention: Seconds of inactivity after which the client is dropped from the index
+        """
+        self.retention = retention
+
+        self._lock = threading.Lock()
+        self._last_seen: OrderedDict[bytes, float] = OrderedDict()
+
+    def __len__(self):
+        return len(self._last_seen)
+
+    def load(self, rows: list[tuple[bytes, float]]):
+        """
+        :param rows: (client id, last seen unix epoch) rows, least recent first
+        """
+        with self._lock:
+            for client_id, last_seen in rows:
+                self._last_seen[client_id] = last_seen
+                self._last_seen.move_to_end(client_id)
+
+    def touch(self, client_id: bytes, now: Optional[float] = None) -> Optional[float]:
+        """
+        :return: Previous last seen of the client, None if it was not in the index
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            previous = self._last_seen.get(client_id)
+            self._last_seen[client_id] = now
+            self._last_seen.move_to_end(client_id)
+            self.__expire(now)
+        return previous
+
+    def last_seen(self, client_id: bytes) -> Optional[float]:
+        """
+        :return: Last seen unix epoch of the client, None if it was not active within the retention
+        """
+        with self._lock:
+            return self._last_seen.get(client_id)
+
+    def recent(self, window: float, limit: int, exclude: Optional[bytes] = None,
+               now: Optional[float] = None) -> list[tuple[bytes, float]]:
+        """
+        :param window: Seconds
+        :param limit: Max amount of clients
+        :param exclude: Client id to leave out (the requestee)
+        :return: (client id, last seen unix epoch) of clients active within the window, most recent first
+        """
+        now = now if now is not None else time.time()
+        since = now - window
+        result = []
+        with self._lock:
+            for client_id in reversed(self._last_seen):
+                if len(result) >= limit:
+                    break
+                last_seen = self._last_seen[client_id]
+                if last_seen < since:
+                    break
+                if client_id != exclude:
+                    result.append((client_id, last_seen))
+        return result
+
+    def __expire(self, now: float):
+        """
+        Caller must hold the lock.
+        """
+        since = now - self.retention
+        while len(self._last_seen) > 0:
+            client_id, last_seen = next(iter(self._last_seen.items()))
+            if last_seen >= since:
+                break
+            del self._last_seen[client_id]
@@ -1,7 +1,17 @@
 FILE_PORT = "port.info"
+FILE_SERVER_CONFIG = "server.json"  # Supersedes FILE_PORT when exists.
+FILE_LOG_CONFIG = "log_config.json"  # Optional. Per module log levels, INFO sampling and profile sampling, re-applied when modified.
 S_RECV_BUFF = 1024  # Amount of bytes to read at once from socket.
 S_RECV_CIPHER_BUFF = int(((S_RECV_BUFF / 16) + 1) * 16) # Amount of bytes to recv from AES CBS encryption algorithm, given the plain message is of S_RECV_BUFF size. Used for chunking.
 
+
+def cipher_buff_size(recv_buff: int) -> int:
+    """
+    Same as S_RECV_CIPHER_BUFF, for configured receive chunk size.
+    """
+    return int(((recv_buff / 16) + 1) * 16)
+
+
 S_CLIENT_ID = 16
 S_USERNAME = 255
 S_PUBLIC_KEY = 160
@@ -13,4 +23,37 @@ S_MESSAGE_TYPE = 1
 S_CONTENT_SIZE = 4
 S_MESSAGE_ID = 4
 
+# Paginated pull related
+S_PAGE_CURSOR = 4
+S_PAGE_MAX_BYTES = 4
+S_PAGE_MAX_COUNT = 4
+S_PAGE_MORE_PENDING = 1
+S_PULL_MESSAGE_HEADER = S_CLIENT_ID + S_MESSAGE_ID + S_MESSAGE_TYPE + S_CONTENT_SIZE
+PAGE_DEFAULT_MAX_BYTES = 1024 * 1024  # Used when the client sends 0 as max bytes.
+PAGE_DEFAULT_MAX_COUNT = 100  # Used when the client sends 0 as max count.
+PAGE_LIMIT_MAX_BYTES = 16 * 1024 * 1024  # Server side cap, the client can't ask for more than this in a single page.
+PAGE_LIMIT_MAX_COUNT = 1000
+PAGE_STREAM_CHUNK = 64 * 1024  # Bytes. Content of a message bigger than the page budget is sent in parts of this size.
+
+# Mailbox status related
+S_MAILBOX_COUNT = 4
+S_MAILBOX_BYTES = 8
+S_MAILBOX_TYPES = 1
+
+# Online users related
+S_ONLINE_WINDOW = 4  # Seconds
+S_ONLINE_LIMIT = 4
+S_LAST_SEEN = 8  # Unix epoch
+ONLINE_DEFAULT_LIMIT = 100  # Used when the client sends 0 as limit.
+ONLINE_LIMIT_MAX = 1000
+ONLINE_RETENTION = 3600  # Seconds. Also the max window.
+LAST_SEEN_WRITE_INTERVAL = 60  # Seconds. The DB last seen of a client is written once per interval, the presence index on each request.
+
+# Rate limiting related
+S_RETRY_AFTER = 4  # Milliseconds
+
+# Cluster internal protocol related
+S_CLUSTER_HEADER = 6  # Code (2 bytes) and payload size (4 bytes), of both requests and responses
+S_CLUSTER_NONCE = 16
+
 SERVER_VERSION = 2
@@ -0,0 +1,201 @@
+import logging
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from Server.OpCodes import RequestCodes
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class TokenBucketBudget:
+    rate: float  # Tokens added per second.
+    burst: float  # Max tokens (bucket capacity).
+
+
+DEFAULT_REQUEST_BUDGETS = {
+    RequestCodes.REQC_REGISTER_USER: TokenBucketBudget(0.2, 5),  # Keyed by peer IP.
+    RequestCodes.REQC_CLIENT_LIST: TokenBucketBudget(1, 5),
+    RequestCodes.REQC_PUB_KEY: TokenBucketBudget(10, 50),
+    RequestCodes.REQC_SEND_MESSAGE: TokenBucketBudget(20, 100),
+    RequestCodes.REQC_WAITING_MSGS: TokenBucketBudget(2, 10),
+    RequestCodes.REQC_WAITING_MSGS_PAGE: TokenBucketBudget(20, 100),
+    RequestCodes.REQC_MAILBOX_STATUS: TokenBucketBudget(50, 200),
+    RequestCodes.REQC_ONLINE_USERS: TokenBucketBudget(1, 10),
+}
+DEFAULT_UPLOAD_BUDGET = TokenBucketBudget(4 * 1024 * 1024, 64 * 1024 * 1024)  # Bytes per second.
+DEFAULT_MAX_KEYS = 1_000_000  # When reached, the least recently used keys are dropped.
+
+
+class TokenBuckets:
+    """
+    Token buckets of several budgets (columns), one row of buckets per key.
+    A single dict maps the key to its row, and the state is kept in flat arrays of doubles (tokens, last refill time
+    of each column), so each key costs one dict entry and 16 bytes per column. The dict is ordered by last use,
+    so idle keys are found at its head.
+    """
+    def __init__(self, budgets: list[TokenBucketBudget], max_keys: int = DEFAULT_MAX_KEYS):
+        self.budgets = budgets
+        self.max_keys = max_keys
+
+        self._lock = threading.Lock()
+        self._index: OrderedDict[bytes, int] = OrderedDict()  # Key to row
+        self._tokens = array('d')  # Row major, len(budgets) per row
+        self._stamps = array('d')
+        self._free: list[int] = []  # Rows of dropped keys
+
+        self.evicted = 0  # Keys dropped at capacity while some bucket was not yet full
+
+    def __len__(self):
+        return len(self._index)
+
+    def acquire(self, key: bytes, column: int = 0, cost: float = 1) -> float:
+        """
+        Take tokens from a bucket of the key. The bucket may go into debt (negative tokens) when the cost is bigger
+        than the burst, so a single big upload is allowed when the bucket is full, but next ones have to wait for the
+        debt to be refilled.
+        :param key: Client id or peer ip
+        :param column: Index of the budget
+        :param cost: Amount of tokens
+        :return: 0 if allowed. Otherwise, seconds to wait until the request will be allowed.
+        """
+        budget = self.budgets[column]
+        now = time.monotonic()
+        with self._lock:
+            row = self._index.get(key)
+            if row is None:
+                row = self.__new_row(key, now)
+            else:
+                self._index.move_to_end(key)
+
+            i = row * len(self.budgets) + column
+            tokens = min(budget.burst, self._tokens[i] + (now - self._stamps[i]) * budget.rate)
+            self._stamps[i] = now
+
+            needed = min(cost, budget.burst)
+            if tokens < needed:
+                self._tokens[i] = tokens
+                return (needed - tokens) / budget.rate
+
+            self._tokens[i] = tokens - cost
+            return 0.0
+
+    def __new_row(self, key: bytes, now: float) -> int:
+        """
+        Caller must hold the lock.
+        :return: Row of full buckets of the key
+        """
+        if len(self._index) >= self.max_keys:
+            self.__drop_idle(now)
+        if len(self._index) >= self.max_keys:
+            # Still no room - drop the least recently used key, even though its buckets are not full yet.
+            _, row = self._index.popitem(last=False)
+            self._free.append(row)
+            self.evicted += 1
+
+        if len(self._free) > 0:
+            row = self._free.pop()
+            start = row * len(self.budgets)
+            for column, budget in enumerate(self.budgets):
+                self._tokens[start + column] = budget.burst
+                self._stamps[start + column] = now
+        else:
+            row = len(self._tokens) // len(self.budgets)
+            self._tokens.extend(budget.burst for budget in self.budgets)
+            self._stamps.extend(now for _ in self.budgets)
+        self._index[key] = row
+        return row
+
+    def __is_full(self, row: int, now: float) -> bool:
+        start = row * len(self.budgets)
+        for column, budget in enumerate(self.budgets):
+            if self._tokens[start + column] + (now - self._stamps[start + column]) * budget.rate < budget.burst:
+                return False
+        return True
+
+    def __drop_idle(self, now: float):
+        """
+        Drop the least recently used keys whose buckets are all full again. Full buckets are the same as no buckets,
+        so nothing is lost. Each key is dropped once, so the sweep is O(1) amortized per new key.
+        Caller must hold the lock.
+        """
+        dropped = 0
+        for row in self._index.values():
+            if not self.__is_full(row, now):
+                break
+            dropped += 1
+        for _ in range(dropped):
+            _, row = self._index.popitem(last=False)
+            self._free.append(row)
+        if dropped > 0:
+            logger.debug("Dropped %d idle token bucket keys", dropped)
+
+
+@dataclass
+class RateLimiterConfig:
+    request_budgets: dict[RequestCodes, TokenBucketBudget] = field(default_factory=lambda: dict(DEFAULT_REQUEST_BUDGETS))
+    upload_budget: Optional[TokenBucketBudget] = DEFAULT_UPLOAD_BUDGET
+    max_keys: int = DEFAULT_MAX_KEYS  # Client ids and peer ips, of all the budgets together
+
+    @classmethod
+    def unlimited(cls) -> "RateLimiterConfig":
+        """
+        :return: Config without any budget
+        """
+        return cls(request_budgets={}, upload_budget=None)
+
+
+class RateLimiter:
+    """
+    In memory rate limiter, shared between worker threads. Request codes without budget are not limited.
+    """
+    def __init__(self, config: Optional[RateLimiterConfig] = None):
+        self.config = config if config is not None else RateLimiterConfig()
+
+        # A column of buckets per request code, and one for uploads.
+        budgets = list(self.config.request_budgets.values())
+        self._request_columns = {code: column for column, code in enumerate(self.config.request_budgets)}
+        self._upload_column = None
+        if self.config.upload_budget is not None:
+            self._upload_column = len(budgets)
+            budgets.append(self.config.upload_budget)
+        self._buckets = TokenBuckets(budgets, self.config.max_keys) if len(budgets) > 0 else None
+
+        self._lock = threading.Lock()
+        self.throttled_requests = 0
+        self.throttled_uploads = 0
+
+    def acquire_request(self, code: RequestCodes, key: bytes) -> float:
+        """
+        :param code: Request code
+        :param key: Client id, or peer ip for register requests
+        :return: 0 if allowed. Otherwise, seconds to wait.
+        """
+        column = self._request_columns.get(code)
+        if column is None:
+            return 0.0
+
+        retry_after = self._buckets.acquire(key, column)
+        if retry_after > 0:
+            with self._lock:
+                self.throttled_requests += 1
+        return retry_after
+
+    def acquire_upload(self, key: bytes, content_size: int) -> float:
+        """
+        :param key: Client id of the sender
+        :param content_size: Bytes the client is about to upload
+        :return: 0 if allowed. Otherwise, seconds to wait.
+        """
+        if self._upload_column is None or content_size == 0:
+            return 0.0
+
+        retry_after = self._buckets.acquire(key, self._upload_column, content_size)
+        if retry_after > 0:
+            with self._lock:
+                self.throttled_uploads += 1
+        return retry_after
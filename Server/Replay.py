@@ -0,0 +1,243 @@
+"""
+Replays wire traces written by the server capture mode (Server.Capture) against a server, and reports latency per opcode.
+
+Usage:
+    python -m Server.Replay <trace file or directory> [--host 127.0.0.1] [--port 8080] [--speed 1 | --fast] [--workers 64]
+    python -m Server.Replay <trace> --start-server --db <copy of server.db> [--config server.json]
+
+Client ids in the trace must exist in the database of the replayed server, so replay against a copy of the
+database the trace was recorded with. Truncated payloads are replayed as zero bytes of the original length.
+The in-process server has no rate limits, unless a server config is given - then its limits are used.
+
+Latency stats are of successful responses only. Responses of each opcode are counted by response code.
+"""
+import argparse
+import logging
+import os
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+from Server.Capture import read_trace, list_trace_files, RECORD_OPEN, RECORD_DATA, RECORD_CLOSE
+from Server.OpCodes import ResponseCodes
+from Server.ProtocolDefenitions import S_CLIENT_ID, S_REQUEST_HEADER
+
+logger = logging.getLogger(__name__)
+
+S_RESPONSE_HEADER = 7
+RESPONSE_HEADER_FMT = "<BHI"  # Version, code, payload size
+REQUEST_CODE_OFFSET = S_CLIENT_ID + 1
+FAILURE_RESPONSE_CODES = {ResponseCodes.RESC_ERROR.value, ResponseCodes.RESC_THROTTLED.value}
+DEFAULT_WORKERS = 64
+
+
+@dataclass
+class ReplayConnection:
+    connection_id: int
+    start: float  # Seconds since trace start
+    chunks: list[tuple[float, bytes]] = field(default_factory=list)  # (Seconds since trace start, data)
+
+    @property
+    def opcode(self) -> Optional[int]:
+        head = b''.join(data for _, data in self.chunks)[:S_REQUEST_HEADER]
+        if len(head) < REQUEST_CODE_OFFSET + 2:
+            return None
+        return struct.unpack("<H", head[REQUEST_CODE_OFFSET:REQUEST_CODE_OFFSET + 2])[0]
+
+
+@dataclass
+class ReplayResult:
+    opcode: Optional[int]
+    latency: Optional[float]  # Seconds from the last sent byte until the response was received. None on failure.
+    response_code: Optional[int]  # None if no response was received
+
+    @property
+    def succeeded(self) -> bool:
+        return self.latency is not None and self.response_code is not None \
+            and self.response_code not in FAILURE_RESPONSE_CODES
+
+
+def load_connections(paths: list[str]) -> list[ReplayConnection]:
+    connections: dict[int, ReplayConnection] = {}
+    for path in paths:
+        for record in read_trace(path):
+            if record.type == RECORD_OPEN:
+                connections[record.connection_id] = ReplayConnection(record.connection_id, record.timestamp)
+            elif record.type == RECORD_DATA:
+                connection = connections.get(record.connection_id)
+                if connection is None:
+                    # Connection was opened in a trace file that was already rotated out.
+                    continue
+                data = record.data.ljust(record.length, b'\0')
+                if len(data) > 0:
+                    connection.chunks.append((record.timestamp, data))
+            elif record.type == RECORD_CLOSE:
+                pass
+    return sorted(connections.values(), key=lambda c: c.start)
+
+
+def replay_connection(connection: ReplayConnection, host: str, port: int, speed: Optional[float],
+                      replay_start: float) -> ReplayResult:
+    """
+    :param speed: Time scale. None means as fast as possible.
+    :param replay_start: time.monotonic() of the replay start, relative to trace start of the first connection.
+    """
+    def wait_until(trace_time: float):
+        if speed is not None:
+            delay = replay_start + trace_time / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    opcode = connection.opcode
+    try:
+        with socket.create_connection((host, port)) as sock:
+            for timestamp, data in connection.chunks:
+                wait_until(timestamp)
+                sock.sendall(data)
+            sent = time.monotonic()
+
+            response = b''
+            while True:
+                buff = sock.recv(64 * 1024)
+                if len(buff) == 0:
+                    break
+                response += buff
+                if len(response) >= S_RESPONSE_HEADER:
+                    _, _, payload_size = struct.unpack(RESPONSE_HEADER_FMT, response[:S_RESPONSE_HEADER])
+                    if len(response) >= S_RESPONSE_HEADER + payload_size:
+                        break
+            latency = time.monotonic() - sent
+    except OSError as e:
+        logger.warning("Connection %d failed: %s", connection.connection_id, e)
+        return ReplayResult(opcode, None, None)
+
+    response_code = None
+    if len(response) >= S_RESPONSE_HEADER:
+        response_code = struct.unpack(RESPONSE_HEADER_FMT, response[:S_RESPONSE_HEADER])[1]
+    return ReplayResult(opcode, latency, response_code)
+
+
+def replay(connections: list[ReplayConnection], host: str, port: int, speed: Optional[float],
+           workers: int = DEFAULT_WORKERS) -> list[ReplayResult]:
+    """
+    Replays the connections at the original start times (scaled by speed), on a pool of threads. When all the workers
+    are busy, connections wait for a free one.
+    :param workers: Max concurrent connections
+    """
+    if len(connections) == 0:
+        return []
+
+    results = []
+    results_lock = threading.Lock()
+    trace_start = connections[0].start
+    shifted = [ReplayConnection(c.connection_id, c.start - trace_start, [(t - trace_start, d) for t, d in c.chunks])
+               for c in connections]
+
+    def run(_connection: ReplayConnection, _replay_start: float):
+        result = replay_connection(_connection, host, port, speed, _replay_start)
+        with results_lock:
+            results.append(result)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="replay") as executor:
+        replay_start = time.monotonic()
+        for connection in shifted:
+            if speed is not None:
+                delay = replay_start + connection.start / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(run, connection, replay_start)
+    return results
+
+
+def report(results: list[ReplayResult], wall_time: float) -> str:
+    """
+    Latency stats of the successful responses of each opcode, and the count of each response code.
+    Error and throttled responses, and connections without a response, are counted as failed.
+    """
+    def percentile(values: list[float], p: float) -> float:
+        return values[min(len(values) - 1, int(len(values) * p))]
+
+    lines = [f"Replayed {len(results)} connections in {wall_time:.3f} seconds",
+             f"{'opcode':>8} {'count':>8} {'failed':>8} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} "
+             f"{'max ms':>10}  responses"]
+    opcodes = sorted({r.opcode for r in results}, key=lambda o: -1 if o is None else o)
+    for opcode in opcodes:
+        of_opcode = [r for r in results if r.opcode == opcode]
+        latencies = sorted(r.latency * 1000 for r in of_opcode if r.succeeded)
+        failed = len(of_opcode) - len(latencies)
+
+        response_counts: dict[Optional[int], int] = {}
+        for result in of_opcode:
+            response_counts[result.response_code] = response_counts.get(result.response_code, 0) + 1
+        responses = " ".join(f"{'none' if code is None else code}:{count}" for code, count
+                             in sorted(response_counts.items(), key=lambda item: -1 if item[0] is None else item[0]))
+
+        if len(latencies) == 0:
+            lines.append(f"{str(opcode):>8} {len(of_opcode):>8} {failed:>8} {'':>10} {'':>10} {'':>10} {'':>10} "
+                         f"{'':>10}  {responses}")
+            continue
+        lines.append(f"{str(opcode):>8} {len(of_opcode):>8} {failed:>8} {sum(latencies) / len(latencies):>10.3f} "
+                     f"{percentile(latencies, 0.5):>10.3f} {percentile(latencies, 0.95):>10.3f} "
+                     f"{percentile(latencies, 0.99):>10.3f} {latencies[-1]:>10.3f}  {responses}")
+    return "\n".join(lines)
+
+
+def start_server(db_path: str, port: int, config_path: Optional[str] = None):
+    """
+    Starts a fresh in-process server on a copy of the given database.
+    :param config_path: Server config to take the rate limits from. None runs without rate limits.
+    """
+    from Database.Database import Database
+    from Server.Config import load_server_config
+    from Server.RateLimiter import RateLimiter, RateLimiterConfig
+    from Server.Server import Server
+
+    rate_limit = RateLimiterConfig.unlimited()
+    if config_path is not None:
+        rate_limit = load_server_config(config_path).rate_limit or rate_limit
+
+    db_copy = os.path.join(tempfile.mkdtemp(), "server.db")
+    if db_path is not None:
+        shutil.copyfile(db_path, db_copy)
+    server = Server(port, database=Database(db_copy), rate_limiter=RateLimiter(rate_limit))
+    threading.Thread(target=server.start, daemon=True).start()
+    time.sleep(0.5)
+    return server
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Replay wire traces against a server.")
+    parser.add_argument("trace", help="Trace file, or directory of rotated trace files")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    speed_group = parser.add_mutually_exclusive_group()
+    speed_group.add_argument("--speed", type=float, default=1.0, help="Time scale, 2 means twice as fast")
+    speed_group.add_argument("--fast", action="store_true", help="Replay as fast as possible")
+    parser.add_argument("--start-server", action="store_true", help="Start a fresh server in this process")
+    parser.add_argument("--db", help="Database to copy for the fresh server")
+    parser.add_argument("--config", help="Server config of the fresh server rate limits. Default is no rate limits.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Max concurrent connections")
+    args = parser.parse_args(argv)
+
+    paths = list_trace_files(args.trace) if os.path.isdir(args.trace) else [args.trace]
+    connections = load_connections(paths)
+    logger.info("Loaded %d connections from %d trace files", len(connections), len(paths))
+
+    if args.start_server:
+        start_server(args.db, args.port, args.config)
+
+    start = time.monotonic()
+    results = replay(connections, args.host, args.port, None if args.fast else args.speed, args.workers)
+    print(report(results, time.monotonic() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
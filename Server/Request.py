@@ -3,7 +3,8 @@ from dataclasses import dataclass
 import struct
 
 from Server.OpCodes import RequestCodes
-from Server.ProtocolDefenitions import S_CLIENT_ID
+from Server.ProtocolDefenitions import S_CLIENT_ID, PAGE_DEFAULT_MAX_BYTES, PAGE_DEFAULT_MAX_COUNT, \
+    PAGE_LIMIT_MAX_BYTES, PAGE_LIMIT_MAX_COUNT, ONLINE_DEFAULT_LIMIT, ONLINE_LIMIT_MAX, ONLINE_RETENTION
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +16,19 @@ class RequestHeader:
     payloadSize: int  # 4 bytes
 
 
+@dataclass
+class PullPageRequest:
+    cursor: int  # 4 bytes. Last message id the client received. Messages up to (including) it are acknowledged.
+    maxBytes: int  # 4 bytes
+    maxCount: int  # 4 bytes
+
+
+@dataclass
+class OnlineUsersRequest:
+    window: int  # 4 bytes. Seconds.
+    limit: int  # 4 bytes
+
+
 def unpack_request_header(data: bytes) -> RequestHeader:
     # Unpack
     header_fmt = f"<{S_CLIENT_ID}scHI"
@@ -26,3 +40,39 @@ def unpack_request_header(data: bytes) -> RequestHeader:
     _code = RequestCodes(code)
 
     return RequestHeader(client_id, _version, _code, payload_size)
+
+
+def unpack_pull_page_request(data: bytes) -> PullPageRequest:
+    """
+    Unpack paginated pull request payload. Budget of 0 means 'server default'. Budgets are capped by the server limits.
+    :param data: Request payload
+    :return: PullPageRequest
+    """
+    # Unpack
+    fmt = "<III"
+    s_payload = struct.calcsize(fmt)
+    cursor, max_bytes, max_count = struct.unpack(fmt, data[:s_payload])
+
+    # Process
+    _max_bytes = min(max_bytes or PAGE_DEFAULT_MAX_BYTES, PAGE_LIMIT_MAX_BYTES)
+    _max_count = min(max_count or PAGE_DEFAULT_MAX_COUNT, PAGE_LIMIT_MAX_COUNT)
+
+    return PullPageRequest(cursor, _max_bytes, _max_count)
+
+
+def unpack_online_users_request(data: bytes) -> OnlineUsersRequest:
+    """
+    Unpack online users request payload. Limit of 0 means 'server default'. Window and limit are capped by the server.
+    :param data: Request payload
+    :return: OnlineUsersRequest
+    """
+    # Unpack
+    fmt = "<II"
+    s_payload = struct.calcsize(fmt)
+    window, limit = struct.unpack(fmt, data[:s_payload])
+
+    # Process
+    _window = min(window, ONLINE_RETENTION)
+    _limit = min(limit or ONLINE_DEFAULT_LIMIT, ONLINE_LIMIT_MAX)
+
+    return OnlineUsersRequest(_window, _limit)
@@ -3,7 +3,8 @@ import struct
 from typing import Union, Optional
 
 from Server.OpCodes import ResponseCodes, MessageTypes
-from Server.ProtocolDefenitions import S_CLIENT_ID, S_MESSAGE_ID
+from Server.ProtocolDefenitions import S_CLIENT_ID, S_MESSAGE_ID, S_MAILBOX_COUNT, S_MAILBOX_BYTES, S_MAILBOX_TYPES, \
+    S_MESSAGE_TYPE
 
 
 @dataclass
@@ -21,6 +22,18 @@ class ResponsePayload_PullMessage:
             return struct.pack(f"<{S_CLIENT_ID}sIBI{self.messageSize}s", self.from_client_id, self.messageId, self.messageType.value, self.messageSize, self.content)
 
 
+@dataclass
+class ResponsePayload_PullPage:
+    morePending: bool
+    messages: list[ResponsePayload_PullMessage]
+
+    def pack(self) -> bytes:
+        packets = [struct.pack("<B", int(self.morePending))]
+        for message in self.messages:
+            packets.append(message.pack())
+        return b''.join(packets)
+
+
 @dataclass
 class MessageResponse:
     destClientId: bytes
@@ -31,12 +44,38 @@ class MessageResponse:
         return struct.pack(fmt, self.destClientId, self.messageId)
 
 
+@dataclass
+class ResponsePayload_MailboxStatus:
+    count: int
+    totalBytes: int
+    byType: dict[MessageTypes, tuple[int, int]]  # Message type to (count, bytes)
+
+    def size(self) -> int:
+        return S_MAILBOX_COUNT + S_MAILBOX_BYTES + S_MAILBOX_TYPES + \
+            len(self.byType) * (S_MESSAGE_TYPE + S_MAILBOX_COUNT + S_MAILBOX_BYTES)
+
+    def pack(self) -> bytes:
+        packets = [struct.pack("<IQB", self.count, self.totalBytes, len(self.byType))]
+        for message_type, (count, total_bytes) in sorted(self.byType.items(), key=lambda item: item[0].value):
+            packets.append(struct.pack("<BIQ", message_type.value, count, total_bytes))
+        return b''.join(packets)
+
+
+@dataclass
+class ResponsePayload_OnlineUser:
+    clientId: bytes
+    lastSeen: int  # Unix epoch
+
+    def pack(self) -> bytes:
+        return struct.pack(f"<{S_CLIENT_ID}sQ", self.clientId, self.lastSeen)
+
+
 @dataclass
 class BaseResponse:
     version: int
     code: ResponseCodes
     payloadSize: int
-    payload: Union[bytes, MessageResponse, list[ResponsePayload_PullMessage], None]
+    payload: Union[bytes, MessageResponse, ResponsePayload_MailboxStatus, list[ResponsePayload_PullMessage], None]
 
     def __pack_no_payload(self):
         fmt = f"<cHI"
@@ -57,7 +96,7 @@ class BaseResponse:
                         return self.__pack_no_payload()
                     else:
                         raise ValueError("Length of payload is 0 but payload is not None!")
-            elif isinstance(self.payload, MessageResponse):
+            elif isinstance(self.payload, (MessageResponse, ResponsePayload_MailboxStatus)):
                 # We don't change self.payload. For esthetics.
                 return self.__pack_with_payload(self.payload.pack())
             else:
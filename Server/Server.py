@@ -1,22 +1,57 @@
 import socket
 import logging
+import time
+from typing import Optional
 
+from Database.Database import Database
+from Server.Capture import TraceWriter
 from Server.ClientWorker import ClientWorker
+from Server.Cluster import Cluster
+from Server.Config import SocketOptions
+from Server.Diagnostics import Diagnostics
+from Server.Deadlines import ConnectionDeadlines
+from Server.Presence import PresenceIndex
+from Server.ProtocolDefenitions import ONLINE_RETENTION
+from Server.RateLimiter import RateLimiter
 
 logger = logging.getLogger(__name__)
 
 
 class Server:
-    def __init__(self, port: int, ip: str = "127.0.0.1"):
+    def __init__(self, port: int, ip: str = "127.0.0.1", deadlines: Optional[ConnectionDeadlines] = None,
+                 rate_limiter: Optional[RateLimiter] = None, capture: Optional[TraceWriter] = None,
+                 diagnostics: Optional[Diagnostics] = None, socket_options: Optional[SocketOptions] = None,
+                 cluster: Optional[Cluster] = None, database: Optional[Database] = None):
         """
         Creates the server that listens to multiple clients. To start run the 'start' function.
         :param port: Port to bind to
         :param ip: Ip to bind to
+        :param deadlines: Read deadlines and content size limits of client connections
+        :param rate_limiter: Per client request and upload budgets
+        :param capture: If set, inbound bytes of each connection are written to wire trace (see Server.Replay)
+        :param diagnostics: Runtime profiling, allocation tracing and stack dumps
+        :param socket_options: Listener and client socket settings
+        :param cluster: If set, the server is a cluster node, and mailboxes of clients it doesn't own are on other nodes
+        :param database: Shared between the worker threads. Default opens the database at the default location.
         """
         self.port = port
         self.ip = ip
+        self.deadlines = deadlines if deadlines is not None else ConnectionDeadlines()
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.capture = capture
+        self.diagnostics = diagnostics if diagnostics is not None else Diagnostics()
+        self.diagnostics.get_workers = lambda: list(self.workers)
+        self.socket_options = socket_options if socket_options is not None else SocketOptions()
+        self.cluster = cluster
+        self.database = database if database is not None else Database()
+
+        # Last activity of each client, seeded from the DB once.
+        self.presence = PresenceIndex(ONLINE_RETENTION)
+        self.presence.load([(bytes.fromhex(client_id), last_seen) for client_id, last_seen
+                            in self.database.get_users_seen_since(int(time.time()) - ONLINE_RETENTION)])
 
         self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket_options.apply_listener(self.server_sock)
         self.server_sock.bind((self.ip, self.port))
 
         self.workers = []
@@ -30,27 +65,39 @@ class Server:
         :return:
         """
         self._is_running = True
-        self.server_sock.listen()
+        self.server_sock.listen(self.socket_options.backlog)
+
+        if self.cluster is not None:
+            self.cluster.start(self.database)
 
-        logger.info(f"Server is listening on: {self.ip}:{self.port}")
+        logger.info("Server is listening on: %s:%d", self.ip, self.port)
         while self._is_running:
             client_socket, address = self.server_sock.accept()
 
-            logger.info(f"New client connection from: {address}")
+            logger.info("New client connection from: %s", address)
+            self.socket_options.apply_client(client_socket)
+
+            if self.capture is not None:
+                client_socket = self.capture.wrap(client_socket)
 
             # On worker finish, he calls this
             def on_worker_close(_worker: ClientWorker):
                 self.workers.remove(_worker)
 
-            worker = ClientWorker(client_socket, on_worker_close)
+            worker = ClientWorker(client_socket, on_worker_close, self.database, self.presence, self.deadlines,
+                                  self.rate_limiter, self.diagnostics, self.socket_options.recv_chunk_size, self.cluster)
             self.workers.append(worker)
-            logger.debug(f"Number of currently working threads: {len(self.workers)}")
+            logger.debug("Number of currently working threads: %d", len(self.workers))
             worker.start()
 
         logger.info("Server finished running")
         for w in self.workers:
             w.join()
         self.server_sock.close()
+        if self.cluster is not None:
+            self.cluster.shutdown()
+        if self.capture is not None:
+            self.capture.close()
 
     def shutdown(self):
         self._is_running = False
@@ -1,7 +1,4 @@
-import logging
+from Server.LogPipeline import LOGGER_FORMAT, LOGGER_FORMAT_THREAD, LOGGER_DATE_FORMAT, LOGGER_DEFAULT_LEVEL, \
+    setup_logging
 
-LOGGER_FORMAT = '[ %(levelname)s ] %(asctime)s.%(msecs)03d - %(filename)s:%(lineno)s - %(funcName)s - %(message)s'
-LOGGER_FORMAT_THREAD = '[ %(levelname)s ] %(asctime)s.%(msecs)03d - [Thread %(thread)d] - %(filename)s:%(lineno)s - %(funcName)s - %(message)s'
-LOGGER_DATE_FORMAT = '%H:%M:%S'
-LOGGER_DEFAULT_LEVEL = logging.DEBUG
-logging.basicConfig(format=LOGGER_FORMAT, level=LOGGER_DEFAULT_LEVEL, datefmt=LOGGER_DATE_FORMAT)
+setup_logging(LOGGER_DEFAULT_LEVEL)
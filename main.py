@@ -1,20 +1,56 @@
+import argparse
 import logging
+import os
 
-from Server.ProtocolDefenitions import FILE_PORT
+from Database.Database import Database
+from Server.Capture import TraceWriter
+from Server.Cluster import Cluster
+from Server.Config import ServerConfig, load_server_config
+from Server.Diagnostics import Diagnostics
+from Server.LogPipeline import watch_log_config, add_config_listener
+from Server.RateLimiter import RateLimiter, RateLimiterConfig
+from Server.ProtocolDefenitions import FILE_PORT, FILE_LOG_CONFIG, FILE_SERVER_CONFIG
 from Server.Server import Server
 
 logger = logging.getLogger(__name__)
 
 
 def read_port():
-    logger.debug(f"Reading from '{FILE_PORT}'...")
+    logger.debug("Reading from '%s'...", FILE_PORT)
     with open(FILE_PORT) as file:
         res = int(file.readline())
         logger.debug("OK")
         return res
 
 
+def read_config(path: str = FILE_SERVER_CONFIG) -> ServerConfig:
+    if os.path.exists(path):
+        logger.debug("Reading from '%s'...", path)
+        config = load_server_config(path)
+        logger.debug("OK")
+        return config
+
+    # Backward compatibility - only the port is configured.
+    return ServerConfig(port=read_port())
+
+
 if __name__ == '__main__':
-    port = read_port()
-    server = Server(port)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default=FILE_SERVER_CONFIG, help="Server config file")
+    args = parser.parse_args()
+
+    config = read_config(args.config)
+
+    # The log config file also sets the profile sample rate at runtime.
+    diagnostics = Diagnostics(**config.diagnostics)
+    add_config_listener(diagnostics.apply_config)
+    watch_log_config(FILE_LOG_CONFIG)
+
+    capture = TraceWriter(**config.capture) if config.capture is not None else None
+    cluster = Cluster(**config.cluster) if config.cluster is not None else None
+    rate_limiter = RateLimiter(config.rate_limit if config.rate_limit is not None else RateLimiterConfig.unlimited())
+    server = Server(config.port, config.ip, deadlines=config.deadlines, rate_limiter=rate_limiter, capture=capture,
+                    diagnostics=diagnostics, socket_options=config.socket, cluster=cluster,
+                    database=Database(config.db_location))
+    server.diagnostics.install_signal_handlers()
     server.start()
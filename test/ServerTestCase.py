@@ -0,0 +1,117 @@
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+from Database.Database import Database
+from Server.OpCodes import RequestCodes, ResponseCodes
+from Server.ProtocolDefenitions import S_CLIENT_ID, S_USERNAME, S_PUBLIC_KEY, SERVER_VERSION
+from Server.RateLimiter import RateLimiter, RateLimiterConfig
+from Server.Server import Server
+
+IP = "127.0.0.1"
+REQUEST_HEADER_FMT = f"<{S_CLIENT_ID}sBHI"  # Client id, version, code, payload size
+RESPONSE_HEADER_FMT = "<BHI"  # Version, code, payload size
+S_RESPONSE_HEADER = struct.calcsize(RESPONSE_HEADER_FMT)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((IP, 0))
+        return sock.getsockname()[1]
+
+
+def pack_request(client_id: bytes, code: RequestCodes, payload: bytes = b'', payload_size: int = None) -> bytes:
+    payload_size = payload_size if payload_size is not None else len(payload)
+    return struct.pack(REQUEST_HEADER_FMT, client_id, SERVER_VERSION, code.value, payload_size) + payload
+
+
+def read_response(sock: socket.socket) -> tuple[int, bytes]:
+    """
+    Read until the server closes the connection.
+    :return: Response code and payload
+    """
+    data = b''
+    while True:
+        chunk = sock.recv(65536)
+        if len(chunk) == 0:
+            break
+        data += chunk
+    _, response_code, payload_size = struct.unpack_from(RESPONSE_HEADER_FMT, data)
+    return response_code, data[S_RESPONSE_HEADER:S_RESPONSE_HEADER + payload_size]
+
+
+def read_until_closed(sock: socket.socket) -> bytes:
+    """
+    :return: Everything received until the server closed (or reset) the connection
+    """
+    data = b''
+    try:
+        while True:
+            chunk = sock.recv(65536)
+            if len(chunk) == 0:
+                break
+            data += chunk
+    except ConnectionResetError:
+        pass
+    return data
+
+
+class ServerTestCase(unittest.TestCase):
+    """
+    In process server on a new database, started for each test. No rate limits, unless the test sets them.
+    """
+    def server_options(self) -> dict:
+        """
+        :return: Server arguments of the test
+        """
+        return {}
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = Database(os.path.join(self.directory.name, "server.db"))
+        self.port = free_port()
+
+        options = {"rate_limiter": RateLimiter(RateLimiterConfig.unlimited())}
+        options.update(self.server_options())
+        self.server = Server(self.port, IP, database=self.database, **options)
+        self.server_thread = threading.Thread(target=self.server.start, daemon=True)
+        self.server_thread.start()
+        while not self.server._is_running:
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.server.shutdown()
+        # Wake up the accept loop, so it sees the shutdown
+        try:
+            socket.create_connection((IP, self.port), timeout=1).close()
+        except OSError:
+            pass
+        self.server_thread.join(10)
+        self.database.close()
+        self.directory.cleanup()
+
+    def connect(self) -> socket.socket:
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                return socket.create_connection((IP, self.port), timeout=10)
+            except ConnectionRefusedError:
+                # Listening starts right after the server is marked as running
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    def request(self, client_id: bytes, code: RequestCodes, payload: bytes = b'') -> tuple[int, bytes]:
+        with self.connect() as sock:
+            sock.sendall(pack_request(client_id, code, payload))
+            return read_response(sock)
+
+    def register(self, username: str) -> bytes:
+        payload = username.encode().ljust(S_USERNAME, b'\0') + os.urandom(S_PUBLIC_KEY)
+        code, client_id = self.request(b'\0' * S_CLIENT_ID, RequestCodes.REQC_REGISTER_USER, payload)
+        self.assertEqual(code, ResponseCodes.RESC_REGISTER_SUCCESS.value)
+        return client_id
@@ -0,0 +1,141 @@
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from Server.Cluster import handshake_connect
+from Server.OpCodes import RequestCodes, ResponseCodes, MessageTypes
+from Server.ProtocolDefenitions import S_CLIENT_ID, S_USERNAME, S_PUBLIC_KEY, SERVER_VERSION
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IP = "127.0.0.1"
+NODES = 3
+SECRET = "test-cluster-secret"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((IP, 0))
+        return sock.getsockname()[1]
+
+
+def request(port: int, client_id: bytes, code: RequestCodes, payload: bytes = b'') -> tuple[int, bytes]:
+    with socket.create_connection((IP, port), timeout=10) as sock:
+        sock.sendall(struct.pack("<16sBHI", client_id, SERVER_VERSION, code.value, len(payload)) + payload)
+        data = b''
+        while True:
+            chunk = sock.recv(65536)
+            if len(chunk) == 0:
+                break
+            data += chunk
+    _, response_code, payload_size = struct.unpack_from("<BHI", data)
+    return response_code, data[7:7 + payload_size]
+
+
+class ClusterTestingClass(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.ports = [free_port() for _ in range(NODES)]
+        cluster_nodes = [f"{IP}:{free_port()}" for _ in range(NODES)]
+        cls.cluster_ports = [int(node.rsplit(":", 1)[1]) for node in cluster_nodes]
+
+        cls.processes = []
+        for node_id in range(NODES):
+            config_path = os.path.join(cls.directory.name, f"node{node_id}.json")
+            with open(config_path, "w") as file:
+                json.dump({
+                    "port": cls.ports[node_id],
+                    "db_location": os.path.join(cls.directory.name, f"node{node_id}.db"),
+                    "diagnostics": {"directory": os.path.join(cls.directory.name, "diagnostics")},
+                    "cluster": {"node_id": node_id, "nodes": cluster_nodes, "secret": SECRET, "timeout": 2.0},
+                }, file)
+            log = open(os.path.join(cls.directory.name, f"node{node_id}.log"), "w")
+            cls.processes.append(subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py"), "--config", config_path],
+                                                  cwd=cls.directory.name, stdout=log, stderr=subprocess.STDOUT))
+            log.close()
+
+        for port in cls.ports + cls.cluster_ports:
+            cls.wait_for(lambda: socket.create_connection((IP, port), timeout=1).close() is None)
+
+    @classmethod
+    def tearDownClass(cls):
+        for process in cls.processes:
+            process.terminate()
+            process.wait()
+        cls.directory.cleanup()
+
+    @staticmethod
+    def wait_for(condition, timeout: float = 10.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if condition():
+                    return
+            except OSError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError("Condition was not met in time")
+            time.sleep(0.1)
+
+    def register(self, port: int, username: str) -> bytes:
+        payload = username.encode().ljust(S_USERNAME, b'\0') + os.urandom(S_PUBLIC_KEY)
+        code, client_id = request(port, b'\0' * S_CLIENT_ID, RequestCodes.REQC_REGISTER_USER, payload)
+        self.assertEqual(code, ResponseCodes.RESC_REGISTER_SUCCESS.value)
+        return client_id
+
+    def test_sendAndPullThroughDifferentNodes(self):
+        alice = self.register(self.ports[0], "alice")
+        bob = self.register(self.ports[0], "bob")
+        content = b"hello through the cluster"
+
+        # Users are replicated in the background - wait until node 1 knows both.
+        send_payload = bob + struct.pack("<BI", MessageTypes.SEND_TEXT_MESSAGE.value, len(content)) + content
+        sent = []
+
+        def send():
+            code, payload = request(self.ports[1], alice, RequestCodes.REQC_SEND_MESSAGE, send_payload)
+            if code == ResponseCodes.RESC_SEND_MESSAGE.value:
+                sent.append(payload)
+            return len(sent) > 0
+        self.wait_for(send)
+        self.assertEqual(sent[0][:S_CLIENT_ID], bob)
+
+        # Node 2 knows bob once the mailbox status (of the owner node) is answered.
+        def mailbox_count():
+            code, payload = request(self.ports[2], bob, RequestCodes.REQC_MAILBOX_STATUS)
+            return struct.unpack_from("<I", payload)[0] if code == ResponseCodes.RESC_MAILBOX_STATUS.value else None
+        self.wait_for(lambda: mailbox_count() is not None)
+        self.assertEqual(mailbox_count(), 1)
+
+        code, payload = request(self.ports[2], bob, RequestCodes.REQC_WAITING_MSGS)
+        self.assertEqual(code, ResponseCodes.RESC_WAITING_MSGS.value)
+
+        from_client, message_id, _type, content_size = struct.unpack_from(f"<{S_CLIENT_ID}sIBI", payload)
+        self.assertEqual(from_client, alice)
+        self.assertEqual(message_id, struct.unpack_from("<I", sent[0], S_CLIENT_ID)[0])
+        self.assertEqual(_type, MessageTypes.SEND_TEXT_MESSAGE.value)
+        self.assertEqual(payload[S_CLIENT_ID + 9:S_CLIENT_ID + 9 + content_size], content)
+
+        # Delivered once
+        code, payload = request(self.ports[0], bob, RequestCodes.REQC_WAITING_MSGS)
+        self.assertEqual(code, ResponseCodes.RESC_WAITING_MSGS.value)
+        self.assertEqual(payload, b'')
+
+    def test_wrongSecretIsRejected(self):
+        with socket.create_connection((IP, self.cluster_ports[0]), timeout=5) as sock:
+            with self.assertRaises(ConnectionAbortedError):
+                handshake_connect(sock, b"wrong-secret")
+
+    def test_rightSecretIsAccepted(self):
+        with socket.create_connection((IP, self.cluster_ports[1]), timeout=5) as sock:
+            handshake_connect(sock, SECRET.encode())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import json
+import os
+import socket
+import tempfile
+import unittest
+
+import main
+from Server.Config import ServerConfig, SocketOptions, load_server_config
+from Server.Deadlines import DEFAULT_MAX_CONTENT_SIZE
+from Server.OpCodes import MessageTypes
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ServerConfigTestingClass(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def load(self, values: dict) -> ServerConfig:
+        path = os.path.join(self.directory.name, "server.json")
+        with open(path, "w") as file:
+            json.dump(values, file)
+        return load_server_config(path)
+
+    def test_repoConfig(self):
+        config = load_server_config(os.path.join(ROOT, "server.json"))
+        self.assertEqual(config.port, 8080)
+        self.assertEqual(config.socket.recv_chunk_size, 65536)
+        self.assertEqual(config.deadlines.max_content_size[MessageTypes.SEND_FILE], 512 * 1024 * 1024)
+
+    def test_everySettingIsOptional(self):
+        config = self.load({})
+        self.assertEqual(config, ServerConfig())
+
+    def test_partialSections(self):
+        config = self.load({
+            "port": 9000,
+            "socket": {"so_rcvbuf": 262144, "tcp_nodelay": False},
+            "deadlines": {"header_timeout": 2.5, "max_content_size": {"SEND_TEXT_MESSAGE": 4096}},
+            "db_location": "other.db",
+        })
+        self.assertEqual(config.port, 9000)
+        self.assertEqual(config.socket, SocketOptions(so_rcvbuf=262144, tcp_nodelay=False))
+        self.assertEqual(config.deadlines.header_timeout, 2.5)
+        # Only the given message type is overridden
+        self.assertEqual(config.deadlines.max_content_size[MessageTypes.SEND_TEXT_MESSAGE], 4096)
+        self.assertEqual(config.deadlines.max_content_size[MessageTypes.SEND_FILE],
+                         DEFAULT_MAX_CONTENT_SIZE[MessageTypes.SEND_FILE])
+        self.assertEqual(config.db_location, "other.db")
+
+    def test_unknownSettings(self):
+        for values in ({"prot": 9000}, {"socket": {"nodelay": True}}, {"deadlines": {"header": 1}}):
+            with self.assertRaises(ValueError):
+                self.load(values)
+        with self.assertRaises(KeyError):
+            self.load({"deadlines": {"max_content_size": {"SEND_PICTURE": 1}}})
+
+    def test_portFileWithoutConfig(self):
+        cwd = os.getcwd()
+        os.chdir(self.directory.name)
+        try:
+            with open("port.info", "w") as file:
+                file.write("1357\n")
+            config = main.read_config("server.json")
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(config, ServerConfig(port=1357))
+
+
+class SocketOptionsTestingClass(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    def tearDown(self):
+        self.listener.close()
+
+    def accept(self, options: SocketOptions) -> tuple[socket.socket, socket.socket]:
+        options.apply_listener(self.listener)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(options.backlog)
+        client = socket.create_connection(self.listener.getsockname())
+        accepted, _ = self.listener.accept()
+        options.apply_client(accepted)
+        self.addCleanup(client.close)
+        self.addCleanup(accepted.close)
+        return accepted, client
+
+    def test_defaults(self):
+        accepted, _ = self.accept(SocketOptions())
+        self.assertEqual(self.listener.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR), 1)
+        self.assertEqual(accepted.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY), 1)
+        self.assertEqual(accepted.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE), 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            self.assertEqual(accepted.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE), 60)
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            self.assertEqual(accepted.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL), 10)
+        if hasattr(socket, "TCP_KEEPCNT"):
+            self.assertEqual(accepted.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT), 5)
+
+    def test_disabled(self):
+        accepted, _ = self.accept(SocketOptions(tcp_nodelay=False, keepalive=False, reuse_addr=False))
+        self.assertEqual(self.listener.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR), 0)
+        self.assertEqual(accepted.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY), 0)
+        self.assertEqual(accepted.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE), 0)
+
+    def test_bufferSizes(self):
+        default_rcvbuf = self.listener.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        rcvbuf = max(default_rcvbuf, 64 * 1024) * 2
+        accepted, _ = self.accept(SocketOptions(so_rcvbuf=rcvbuf, so_sndbuf=rcvbuf))
+        # The OS may round the size up (Linux doubles it), never down below the asked size.
+        self.assertGreaterEqual(accepted.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF), rcvbuf)
+        self.assertGreaterEqual(accepted.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF), rcvbuf)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+
+from Database.Database import Database
+from Server.OpCodes import MessageTypes
+from Server.ProtocolDefenitions import S_PUBLIC_KEY
+
+REQ_SYMMETRIC_KEY = MessageTypes.REQ_SYMMETRIC_KEY.value
+SEND_SYMMETRIC_KEY = MessageTypes.SEND_SYMMETRIC_KEY.value
+SEND_TEXT_MESSAGE = MessageTypes.SEND_TEXT_MESSAGE.value
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.directory.name, "server.db")
+        self.database = Database(self.db_path)
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def reopen(self):
+        self.database.close()
+        self.database = Database(self.db_path)
+
+    def register(self, username: str) -> str:
+        _, client_id = self.database.register_user(username, os.urandom(S_PUBLIC_KEY))
+        return client_id.hex()
+
+    def db_rows(self, to_client: str) -> list:
+        """
+        Rows of the recipient straight from the DB, same columns as Database.get_messages.
+        """
+        rows = []
+        for shard in self.database._shards:
+            rows += shard.conn.execute(f"""
+                SELECT {shard.select_id()}, to_client, from_client, type, content_size, content FROM Messages
+                WHERE to_client=? ORDER BY id;
+            """, [to_client]).fetchall()
+        return rows
+
+
+class ControlMessagesTestingClass(DatabaseTestCase):
+    def test_pendingKeyRequestIsCoalesced(self):
+        alice, bob = self.register("alice"), self.register("bob")
+        _, first_id = self.database.insert_message(bob, alice, REQ_SYMMETRIC_KEY, None)
+        _, second_id = self.database.insert_message(bob, alice, REQ_SYMMETRIC_KEY, None)
+        self.assertEqual(first_id, second_id)
+        self.assertEqual(len(self.database.get_messages(bob)), 1)
+
+    def test_keyRequestAfterDeliveryGetsNewId(self):
+        alice, bob = self.register("alice"), self.register("bob")
+        _, first_id = self.database.insert_message(bob, alice, REQ_SYMMETRIC_KEY, None)
+        # Delivered, not acknowledged yet
+        rows, _ = self.database.get_messages_page(bob, 0, 1024 * 1024, 10)
+        self.assertEqual([row[0] for row in rows], [first_id])
+
+        _, second_id = self.database.insert_message(bob, alice, REQ_SYMMETRIC_KEY, None)
+        self.assertGreater(second_id, first_id)
+
+    def test_supersededKeyIsDeleted(self):
+        alice, bob = self.register("alice"), self.register("bob")
+        _, old_id = self.database.insert_message(bob, alice, SEND_SYMMETRIC_KEY, b"old key")
+        # Content set after insert, like the worker does for chunked content
+        _, new_id = self.database.insert_message(bob, alice, SEND_SYMMETRIC_KEY, None)
+        self.database.set_message_content(new_id, b"new key")
+
+        rows = self.database.get_messages(bob)
+        self.assertEqual([(row[0], row[5]) for row in rows], [(new_id, b"new key")])
+        self.assertEqual(self.database.get_mailbox_status(bob).count, 1)
+
+    def test_keysOfOtherSendersAreKept(self):
+        alice, bob, carol = self.register("alice"), self.register("bob"), self.register("carol")
+        self.database.insert_message(bob, alice, SEND_SYMMETRIC_KEY, b"alice key")
+        self.database.insert_message(bob, carol, SEND_SYMMETRIC_KEY, b"carol key")
+        self.assertEqual(len(self.database.get_messages(bob)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
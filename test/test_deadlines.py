@@ -0,0 +1,81 @@
+import os
+import struct
+import time
+import unittest
+
+from ServerTestCase import ServerTestCase, pack_request, read_response, read_until_closed
+from Server.Deadlines import ConnectionDeadlines, counters
+from Server.OpCodes import RequestCodes, ResponseCodes, MessageTypes
+from Server.ProtocolDefenitions import S_USERNAME
+
+
+class DeadlinesTestingClass(ServerTestCase):
+    def server_options(self) -> dict:
+        deadlines = ConnectionDeadlines(header_timeout=0.5, payload_timeout=0.5, min_transfer_rate=64 * 1024,
+                                        min_rate_grace=0.5)
+        deadlines.max_content_size[MessageTypes.SEND_TEXT_MESSAGE] = 1024
+        return {"deadlines": deadlines}
+
+    def assertDropped(self, sock, counter: str, before: dict):
+        """
+        The server closes the connection without a response, and counts it.
+        """
+        self.assertEqual(read_until_closed(sock), b'')
+        self.assertEqual(counters.snapshot()[counter], before[counter] + 1)
+
+    def test_headerSentByteByByteIsDropped(self):
+        before = counters.snapshot()
+        packet = pack_request(b'\0' * 16, RequestCodes.REQC_CLIENT_LIST)
+        start = time.monotonic()
+        with self.connect() as sock:
+            try:
+                # Each byte is in time, the whole header is not.
+                for byte in packet:
+                    sock.sendall(bytes([byte]))
+                    time.sleep(0.1)
+            except OSError:
+                pass
+            self.assertDropped(sock, "header_timeouts", before)
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_stalledPayloadIsDropped(self):
+        before = counters.snapshot()
+        with self.connect() as sock:
+            payload = b"stalled".ljust(S_USERNAME, b'\0')
+            sock.sendall(pack_request(b'\0' * 16, RequestCodes.REQC_REGISTER_USER, payload, payload_size=1000))
+            self.assertDropped(sock, "payload_timeouts", before)
+        self.assertIsNone(self.database.get_user("stalled"))
+
+    def test_slowUploadIsDropped(self):
+        sender, recipient = self.register("sender"), self.register("recipient")
+        before = counters.snapshot()
+        content_size = 1024 * 1024
+        with self.connect() as sock:
+            message_header = recipient + struct.pack("<BI", MessageTypes.SEND_FILE.value, content_size)
+            sock.sendall(pack_request(sender, RequestCodes.REQC_SEND_MESSAGE, message_header, len(message_header) + content_size))
+            try:
+                # Each read is in time, but slower than the minimum transfer rate.
+                for _ in range(content_size // 1024):
+                    sock.sendall(os.urandom(1024))
+                    time.sleep(0.05)
+            except OSError:
+                pass
+            self.assertDropped(sock, "slow_transfers", before)
+
+    def test_contentTooLargeIsRejected(self):
+        sender, recipient = self.register("sender"), self.register("recipient")
+        before = counters.snapshot()
+        content = os.urandom(256 * 1024)
+        payload = recipient + struct.pack("<BI", MessageTypes.SEND_TEXT_MESSAGE.value, len(content)) + content
+        with self.connect() as sock:
+            # All of the content is sent before the response is read. The server doesn't read it, but it drains it
+            # before closing, so the response is not lost to a reset.
+            sock.sendall(pack_request(sender, RequestCodes.REQC_SEND_MESSAGE, payload))
+            code, _ = read_response(sock)
+        self.assertEqual(code, ResponseCodes.RESC_ERROR.value)
+        self.assertEqual(counters.snapshot()["oversized_contents"], before["oversized_contents"] + 1)
+        self.assertEqual(self.database.get_mailbox_status(recipient.hex()).count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
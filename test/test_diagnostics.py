@@ -0,0 +1,95 @@
+import glob
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+from types import SimpleNamespace
+
+from Server.Diagnostics import Diagnostics
+from Server.OpCodes import RequestCodes
+
+
+def busy():
+    return sum(i * i for i in range(10000))
+
+
+class DiagnosticsTestingClass(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.diagnostics = Diagnostics(self.directory.name, allocation_interval=0.1)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def profile_requests(self, handler: str, count: int):
+        for _ in range(count):
+            with self.diagnostics.profile(handler):
+                busy()
+
+    def test_notSampledByDefault(self):
+        self.profile_requests("REQC_CLIENT_LIST", 10)
+        self.assertEqual(self.diagnostics.dump_profiles(), [])
+
+    def test_profilesAreAggregatedByHandler(self):
+        self.diagnostics.set_profile_sample_rate(1.0)
+        self.profile_requests("REQC_CLIENT_LIST", 3)
+        self.profile_requests("REQC_PUB_KEY", 2)
+
+        paths = self.diagnostics.dump_profiles()
+        self.assertEqual(len(paths), 2)
+        by_handler = {os.path.basename(path).split("-")[1]: path for path in paths}
+        with open(by_handler["REQC_CLIENT_LIST"]) as file:
+            text = file.read()
+        self.assertIn("Profiled requests: 3", text)
+        self.assertIn("busy", text)
+        self.assertTrue(os.path.exists(by_handler["REQC_PUB_KEY"][:-len(".txt")] + ".prof"))
+
+        # The aggregation starts over after a dump
+        self.assertEqual(self.diagnostics.dump_profiles(), [])
+
+    def test_sampleRate(self):
+        self.diagnostics.set_profile_sample_rate(0.5)
+        self.profile_requests("REQC_SEND_MESSAGE", 400)
+        self.diagnostics.dump_profiles(reset=False)
+        profiled = self.diagnostics._profiled_requests["REQC_SEND_MESSAGE"]
+        self.assertGreater(profiled, 100)
+        self.assertLess(profiled, 300)
+
+    def test_applyConfig(self):
+        self.diagnostics.apply_config({"levels": {"root": "INFO"}})
+        self.assertEqual(self.diagnostics.profile_sample_rate, 0.0)
+        self.diagnostics.apply_config({"profile_sample_rate": 0.25})
+        self.assertEqual(self.diagnostics.profile_sample_rate, 0.25)
+
+    def test_stackDumpAnnotatesWorkers(self):
+        worker = SimpleNamespace(ident=threading.get_ident(), current_opcode=RequestCodes.REQC_WAITING_MSGS,
+                                 request_started=time.monotonic())
+        self.diagnostics.get_workers = lambda: [worker]
+
+        with open(self.diagnostics.dump_stacks()) as file:
+            text = file.read()
+        self.assertIn("Opcode: REQC_WAITING_MSGS", text)
+        self.assertIn("test_stackDumpAnnotatesWorkers", text)
+
+    def test_allocationDiff(self):
+        self.diagnostics.start_allocation_diff()
+        kept = [bytes(1024) for _ in range(1000)]
+
+        deadline = time.monotonic() + 5
+        while len(glob.glob(os.path.join(self.directory.name, "allocations-*.txt"))) == 0:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        while self.diagnostics._allocation_timer is not None:
+            time.sleep(0.01)
+
+        # Tracing is stopped after the diff, so it doesn't slow down the server
+        self.assertFalse(tracemalloc.is_tracing())
+        with open(glob.glob(os.path.join(self.directory.name, "allocations-*.txt"))[0]) as file:
+            self.assertIn("test_diagnostics.py", file.read())
+        del kept
+
+
+if __name__ == '__main__':
+    unittest.main()
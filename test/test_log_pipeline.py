@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+import unittest
+
+from Server import LogPipeline
+from Server.LogPipeline import RequestSampler, apply_log_config, add_config_listener, watch_log_config
+
+
+def record(level: int) -> logging.LogRecord:
+    return logging.LogRecord("Server.ClientWorker", level, __file__, 1, "Line of %s", ("request",), None)
+
+
+class RequestSamplerTestingClass(unittest.TestCase):
+    def test_decisionIsPerRequest(self):
+        sampler = RequestSampler(0.0)
+        sampler.begin_request()
+        self.assertFalse(sampler.filter(record(logging.INFO)))
+        self.assertFalse(sampler.filter(record(logging.DEBUG)))
+        self.assertTrue(sampler.filter(record(logging.WARNING)))
+
+        sampler.rate = 1.0
+        sampler.begin_request()
+        self.assertTrue(sampler.filter(record(logging.INFO)))
+
+    def test_decisionIsPerThread(self):
+        sampler = RequestSampler(0.0)
+        sampler.begin_request()
+        passed = []
+        # A thread that didn't begin a request logs everything
+        thread = threading.Thread(target=lambda: passed.append(sampler.filter(record(logging.INFO))))
+        thread.start()
+        thread.join()
+        self.assertEqual(passed, [True])
+
+    def test_sampleRate(self):
+        sampler = RequestSampler(0.25)
+        sampled = 0
+        for _ in range(2000):
+            sampler.begin_request()
+            sampled += sampler.filter(record(logging.INFO))
+        self.assertGreater(sampled, 350)
+        self.assertLess(sampled, 650)
+
+    def test_recordIsNotFormattedOnTheCallingThread(self):
+        handler = LogPipeline._DeferredQueueHandler(queue.SimpleQueue())
+        line = record(logging.INFO)
+        prepared = handler.prepare(line)
+        self.assertIs(prepared, line)
+        self.assertEqual(prepared.args, ("request",))
+
+
+class LogConfigTestingClass(unittest.TestCase):
+    LOGGERS = ("Server.ClientWorker", "Database")
+
+    def setUp(self):
+        self.levels = {name: logging.getLogger(name).level for name in self.LOGGERS}
+        self.root_level = logging.getLogger().level
+        self.sample_rate = LogPipeline._sampler.rate
+        self.listeners = list(LogPipeline._config_listeners)
+
+    def tearDown(self):
+        for name, level in self.levels.items():
+            logging.getLogger(name).setLevel(level)
+        logging.getLogger().setLevel(self.root_level)
+        LogPipeline._sampler.rate = self.sample_rate
+        LogPipeline._config_listeners[:] = self.listeners
+
+    def test_applyLevelsAndSampleRate(self):
+        applied = []
+        add_config_listener(applied.append)
+        config = {"levels": {"root": "warning", "Server.ClientWorker": "ERROR", "Database": logging.INFO},
+                  "info_sample_rate": 0.1, "profile_sample_rate": 0.5}
+        apply_log_config(config)
+
+        self.assertEqual(logging.getLogger().level, logging.WARNING)
+        self.assertEqual(logging.getLogger("Server.ClientWorker").level, logging.ERROR)
+        self.assertEqual(logging.getLogger("Database").level, logging.INFO)
+        self.assertEqual(LogPipeline._sampler.rate, 0.1)
+        # Keys of other modules are passed to the listeners
+        self.assertEqual(applied, [config])
+
+    def test_watchedFileIsReapplied(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "log_config.json")
+            with open(path, "w") as file:
+                json.dump({"levels": {"Database": "ERROR"}}, file)
+            watch_log_config(path, interval=0.05)
+            self.wait_for_level("Database", logging.ERROR)
+
+            with open(path, "w") as file:
+                json.dump({"levels": {"Database": "DEBUG"}}, file)
+            # Make sure the modification time changes, whatever the file system resolution
+            os.utime(path, (time.time() + 10, time.time() + 10))
+            self.wait_for_level("Database", logging.DEBUG)
+
+    def wait_for_level(self, name: str, level: int):
+        deadline = time.monotonic() + 5
+        while logging.getLogger(name).level != level:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import threading
+import unittest
+
+from test_database import DatabaseTestCase, SEND_TEXT_MESSAGE
+
+
+class MailboxCacheTestingClass(DatabaseTestCase):
+    def test_concurrentInsertAndPull(self):
+        senders = [self.register(f"sender{i}") for i in range(4)]
+        recipient = self.register("recipient")
+        per_sender = 200
+        delivered = []
+        done = threading.Event()
+
+        def send(sender: str):
+            for i in range(per_sender):
+                self.database.insert_message(recipient, sender, SEND_TEXT_MESSAGE, f"{sender}:{i}".encode())
+
+        def pull():
+            while True:
+                finished = done.is_set()
+                rows = self.database.get_messages(recipient)
+                if len(rows) > 0:
+                    delivered.extend(rows)
+                    self.database.delete_messages_up_to(recipient, rows[-1][0])
+                elif finished:
+                    return
+
+        senders_threads = [threading.Thread(target=send, args=(sender,)) for sender in senders]
+        puller = threading.Thread(target=pull)
+        for thread in senders_threads + [puller]:
+            thread.start()
+        for thread in senders_threads:
+            thread.join()
+        done.set()
+        puller.join()
+
+        # Pulls were served from the cache, and a row missing in the cache would have been acknowledged without being
+        # delivered. Every message is delivered exactly once, in id order.
+        self.assertGreater(self.database.mailbox_cache.hits, 0)
+        ids = [row[0] for row in delivered]
+        self.assertEqual(len(ids), len(senders) * per_sender)
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual(self.db_rows(recipient), [])
+        self.assertEqual(self.database.get_mailbox_status(recipient).count, 0)
+
+    def test_residentMailboxMatchesDb(self):
+        alice, bob = self.register("alice"), self.register("bob")
+        errors = []
+
+        def insert():
+            for i in range(300):
+                _, message_id = self.database.insert_message(bob, alice, SEND_TEXT_MESSAGE, None)
+                self.database.set_message_content(message_id, b"x" * (i % 50 + 1))
+
+        def pull_and_ack():
+            for _ in range(300):
+                rows = self.database.get_messages(bob)
+                if len(rows) > 1:
+                    self.database.delete_messages_up_to(bob, rows[len(rows) // 2][0])
+
+        def reload():
+            for _ in range(300):
+                self.database.mailbox_cache.drop(bob)
+                try:
+                    self.database.get_messages(bob)
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=target) for target in (insert, pull_and_ack, reload)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        cached = self.database.mailbox_cache.get(bob)
+        if cached is None:
+            self.database.get_messages(bob)
+            cached = self.database.mailbox_cache.get(bob)
+        self.assertEqual(cached, self.db_rows(bob))
+
+
+if __name__ == '__main__':
+    unittest.main()
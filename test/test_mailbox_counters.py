@@ -0,0 +1,44 @@
+import os
+import unittest
+
+from test_database import DatabaseTestCase, SEND_TEXT_MESSAGE
+
+
+class MailboxCountersTestingClass(DatabaseTestCase):
+    def assertCounters(self, to_client: str):
+        rows = self.db_rows(to_client)
+        status = self.database.get_mailbox_status(to_client)
+        self.assertEqual(status.count, len(rows))
+        self.assertEqual(status.total_bytes, sum(row[4] for row in rows))
+        by_type = {}
+        for row in rows:
+            count, total_bytes = by_type.get(row[3], (0, 0))
+            by_type[row[3]] = (count + 1, total_bytes + row[4])
+        self.assertEqual({_type: tuple(value) for _type, value in status.by_type.items() if value[0] > 0}, by_type)
+
+    def test_countersFollowChanges(self):
+        alice, bob = self.register("alice"), self.register("bob")
+        _, text_id = self.database.insert_message(bob, alice, SEND_TEXT_MESSAGE, b"hello")
+        self.assertCounters(bob)
+
+        _, chunked_id = self.database.insert_message(bob, alice, SEND_TEXT_MESSAGE, None)
+        self.assertCounters(bob)
+        self.database.set_message_content(chunked_id, os.urandom(1000))
+        self.assertCounters(bob)
+
+        self.database.delete_message(text_id)
+        self.assertCounters(bob)
+        self.database.delete_messages_up_to(bob, chunked_id)
+        self.assertCounters(bob)
+        self.assertEqual(self.database.get_mailbox_status(bob).count, 0)
+
+    def test_countersAreLoadedOnStart(self):
+        alice, bob = self.register("alice"), self.register("bob")
+        for size in (10, 20, 30):
+            self.database.insert_message(bob, alice, SEND_TEXT_MESSAGE, os.urandom(size))
+        self.reopen()
+        self.assertCounters(bob)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import unittest
+
+from test_database import DatabaseTestCase, SEND_TEXT_MESSAGE
+from Server.OpCodes import MessageTypes
+from Server.ProtocolDefenitions import S_PULL_MESSAGE_HEADER
+
+
+class PageCursorTestingClass(DatabaseTestCase):
+    def test_cursorAcknowledgesOnlyDeliveredMessages(self):
+        alice, bob = self.register("alice"), self.register("bob")
+        ids = [self.database.insert_message(bob, alice, SEND_TEXT_MESSAGE, b"%d" % i)[1] for i in range(5)]
+
+        rows, more_pending = self.database.get_messages_page(bob, 0, 1024 * 1024, 2)
+        self.assertEqual([row[0] for row in rows], ids[:2])
+        self.assertTrue(more_pending)
+
+        # A message arrives after the page was delivered
+        _, late_id = self.database.insert_message(bob, alice, SEND_TEXT_MESSAGE, b"late")
+
+        self.assertEqual(self.database.delete_messages_up_to(bob, rows[-1][0]), 2)
+        rows, more_pending = self.database.get_messages_page(bob, rows[-1][0], 1024 * 1024, 10)
+        self.assertEqual([row[0] for row in rows], ids[2:] + [late_id])
+        self.assertFalse(more_pending)
+
+    def test_byteBudget(self):
+        alice, bob = self.register("alice"), self.register("bob")
+        for _ in range(3):
+            self.database.insert_message(bob, alice, SEND_TEXT_MESSAGE, os.urandom(100))
+        rows, more_pending = self.database.get_messages_page(bob, 0, 2 * (S_PULL_MESSAGE_HEADER + 100), 10)
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(more_pending)
+
+    def test_oversizedFirstMessageIsReadByParts(self):
+        alice, bob = self.register("alice"), self.register("bob")
+        content = os.urandom(100000)
+        _, message_id = self.database.insert_message(bob, alice, MessageTypes.SEND_FILE.value, content)
+
+        rows, more_pending = self.database.get_messages_page(bob, 0, 1000, 10)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][4], len(content))
+        self.assertIsNone(rows[0][5])
+        parts = [self.database.read_message_content(message_id, offset, 4096) for offset in range(0, len(content), 4096)]
+        self.assertEqual(b''.join(parts), content)
+
+    def pageWithUploadBetweenPasses(self, to_client: str, message_id: int, content: bytes, max_bytes: int):
+        """
+        Get a page from the DB, with the content of the message set after the page was fitted, before it is loaded.
+        """
+        self.database.mailbox_cache.drop(to_client)
+        fit_page = self.database._Database__fit_page
+
+        def fit_page_then_upload(*args):
+            result = fit_page(*args)
+            self.database.set_message_content(message_id, content)
+            return result
+        self.database._Database__fit_page = fit_page_then_upload
+        return self.database.get_messages_page(to_client, 0, max_bytes, 10)
+
+    def test_firstMessageGrownBetweenPassesIsReadByParts(self):
+        alice, bob = self.register("alice"), self.register("bob")
+        _, chunked_id = self.database.insert_message(bob, alice, MessageTypes.SEND_FILE.value, None)
+        self.database.insert_message(bob, alice, SEND_TEXT_MESSAGE, b"hello")
+        content = os.urandom(100000)
+
+        rows, more_pending = self.pageWithUploadBetweenPasses(bob, chunked_id, content, 1000)
+        self.assertEqual([(row[0], row[4], row[5]) for row in rows], [(chunked_id, len(content), None)])
+        self.assertTrue(more_pending)
+
+    def test_messageGrownBetweenPassesEndsThePage(self):
+        alice, bob = self.register("alice"), self.register("bob")
+        _, text_id = self.database.insert_message(bob, alice, SEND_TEXT_MESSAGE, b"hello")
+        _, chunked_id = self.database.insert_message(bob, alice, MessageTypes.SEND_FILE.value, None)
+
+        rows, more_pending = self.pageWithUploadBetweenPasses(bob, chunked_id, os.urandom(100000), 1000)
+        self.assertEqual([(row[0], row[5]) for row in rows], [(text_id, b"hello")])
+        self.assertTrue(more_pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
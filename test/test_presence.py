@@ -0,0 +1,70 @@
+import struct
+import time
+import unittest
+
+from ServerTestCase import ServerTestCase
+from Server.OpCodes import RequestCodes, ResponseCodes
+from Server.Presence import PresenceIndex
+from Server.ProtocolDefenitions import S_CLIENT_ID
+
+
+class PresenceIndexTestingClass(unittest.TestCase):
+    def setUp(self):
+        self.presence = PresenceIndex(retention=100)
+        self.presence.load([(b"a", 1000), (b"b", 1010), (b"c", 1020)])
+
+    def test_recentIsMostRecentFirst(self):
+        self.assertEqual(self.presence.recent(100, 10, now=1020), [(b"c", 1020), (b"b", 1010), (b"a", 1000)])
+
+    def test_recentWindowAndLimit(self):
+        self.assertEqual(self.presence.recent(15, 10, now=1020), [(b"c", 1020), (b"b", 1010)])
+        self.assertEqual(self.presence.recent(100, 1, now=1020), [(b"c", 1020)])
+
+    def test_recentExcludesRequestee(self):
+        self.assertEqual(self.presence.recent(100, 2, exclude=b"c", now=1020), [(b"b", 1010), (b"a", 1000)])
+
+    def test_touchMovesToMostRecent(self):
+        self.assertEqual(self.presence.touch(b"a", 1030), 1000)
+        self.assertIsNone(self.presence.touch(b"d", 1031))
+        self.assertEqual([client_id for client_id, _ in self.presence.recent(100, 10, now=1031)], [b"d", b"a", b"c", b"b"])
+
+    def test_inactiveClientsExpire(self):
+        # 'a' and 'b' were not active within the retention
+        self.presence.touch(b"d", 1115)
+        self.assertEqual(len(self.presence), 2)
+        self.assertIsNone(self.presence.last_seen(b"a"))
+        self.assertIsNone(self.presence.last_seen(b"b"))
+        self.assertEqual(self.presence.last_seen(b"c"), 1020)
+
+
+class OnlineUsersTestingClass(ServerTestCase):
+    def online_users(self, client_id: bytes, window: int, limit: int) -> list[tuple[bytes, int]]:
+        code, payload = self.request(client_id, RequestCodes.REQC_ONLINE_USERS, struct.pack("<II", window, limit))
+        self.assertEqual(code, ResponseCodes.RESC_ONLINE_USERS.value)
+        return list(struct.iter_unpack(f"<{S_CLIENT_ID}sQ", payload))
+
+    def test_onlineUsers(self):
+        alice, bob, carol = self.register("alice"), self.register("bob"), self.register("carol")
+        # Registering is not activity, requests are.
+        self.assertEqual(self.online_users(alice, 60, 0), [])
+
+        for client_id in (bob, carol):
+            code, _ = self.request(client_id, RequestCodes.REQC_MAILBOX_STATUS)
+            self.assertEqual(code, ResponseCodes.RESC_MAILBOX_STATUS.value)
+
+        users = self.online_users(alice, 60, 0)
+        self.assertEqual([client_id for client_id, _ in users], [carol, bob])
+        for _, last_seen in users:
+            self.assertLessEqual(abs(last_seen - time.time()), 5)
+
+        # Alice is online now too, but doesn't get her own entry.
+        self.assertEqual([client_id for client_id, _ in self.online_users(alice, 60, 1)], [carol])
+        self.assertEqual([client_id for client_id, _ in self.online_users(carol, 60, 0)], [alice, bob])
+
+    def test_unregisteredClientIsRejected(self):
+        code, _ = self.request(b'\1' * S_CLIENT_ID, RequestCodes.REQC_ONLINE_USERS, struct.pack("<II", 60, 0))
+        self.assertEqual(code, ResponseCodes.RESC_ERROR.value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from Server.Config import load_server_config
+from Server.OpCodes import RequestCodes
+from Server.RateLimiter import TokenBucketBudget, TokenBuckets, RateLimiter, RateLimiterConfig, DEFAULT_REQUEST_BUDGETS, \
+    DEFAULT_UPLOAD_BUDGET
+
+
+class TokenBucketsTestingClass(unittest.TestCase):
+    def test_burstOfOne(self):
+        buckets = TokenBuckets([TokenBucketBudget(1, 1)])
+        self.assertEqual(buckets.acquire(b"a"), 0.0)
+        # The bucket is empty, the next request has to wait for a whole token.
+        self.assertGreater(buckets.acquire(b"a"), 0.9)
+
+    def test_costBiggerThanTokensLeft(self):
+        buckets = TokenBuckets([TokenBucketBudget(1, 10)])
+        self.assertEqual(buckets.acquire(b"a", cost=8), 0.0)
+        retry_after = buckets.acquire(b"a", cost=5)
+        self.assertGreater(retry_after, 2.9)
+        self.assertLess(retry_after, 3.1)
+
+    def test_costBiggerThanBurst(self):
+        buckets = TokenBuckets([TokenBucketBudget(10, 100)])
+        # A full bucket allows a single upload bigger than the burst, then the debt has to be refilled.
+        self.assertEqual(buckets.acquire(b"a", cost=300), 0.0)
+        self.assertGreater(buckets.acquire(b"a", cost=300), 29.9)
+
+    def test_maxKeys(self):
+        buckets = TokenBuckets([TokenBucketBudget(0.001, 1)], max_keys=3)
+        for key in (b"a", b"b", b"c"):
+            buckets.acquire(key)
+        buckets.acquire(b"a")  # 'b' is the least recently used now
+
+        buckets.acquire(b"d")
+        self.assertEqual(len(buckets), 3)
+        self.assertEqual(buckets.evicted, 1)
+        # 'b' was evicted, so it starts with a full bucket again. 'a' was kept and is still empty.
+        self.assertEqual(buckets.acquire(b"b"), 0.0)
+        self.assertGreater(buckets.acquire(b"a"), 0.0)
+
+    def test_idleBucketsDroppedFirst(self):
+        buckets = TokenBuckets([TokenBucketBudget(1000, 1)], max_keys=2)
+        buckets.acquire(b"a")
+        buckets.acquire(b"b")
+        time.sleep(0.01)
+        # Refilled by now, so making room is not an eviction.
+        buckets.acquire(b"c")
+        buckets.acquire(b"d")
+        self.assertEqual(len(buckets), 2)
+        self.assertEqual(buckets.evicted, 0)
+        self.assertEqual(len(buckets._tokens), 2)
+
+    def test_columnsOfAKey(self):
+        buckets = TokenBuckets([TokenBucketBudget(0.001, 1), TokenBucketBudget(0.001, 2)])
+        self.assertEqual(buckets.acquire(b"a", 0), 0.0)
+        self.assertGreater(buckets.acquire(b"a", 0), 0.0)
+        # Other budget of the same key is not affected
+        self.assertEqual(buckets.acquire(b"a", 1), 0.0)
+        self.assertEqual(buckets.acquire(b"a", 1), 0.0)
+        self.assertGreater(buckets.acquire(b"a", 1), 0.0)
+        self.assertEqual(len(buckets), 1)
+
+    def test_keyIsIdleOnlyWhenAllColumnsAreFull(self):
+        buckets = TokenBuckets([TokenBucketBudget(1000, 1), TokenBucketBudget(0.001, 1)], max_keys=1)
+        buckets.acquire(b"a", 0)
+        buckets.acquire(b"a", 1)
+        time.sleep(0.01)
+        # The first bucket is full again, the second is not - so 'a' is evicted, not dropped as idle.
+        buckets.acquire(b"b", 0)
+        self.assertEqual(buckets.evicted, 1)
+
+
+class RateLimiterTestingClass(unittest.TestCase):
+    def test_singleKeyIndex(self):
+        limiter = RateLimiter(RateLimiterConfig(max_keys=2))
+        for code in (RequestCodes.REQC_CLIENT_LIST, RequestCodes.REQC_SEND_MESSAGE, RequestCodes.REQC_WAITING_MSGS):
+            limiter.acquire_request(code, b"a")
+        limiter.acquire_upload(b"a", 1000)
+        limiter.acquire_request(RequestCodes.REQC_SEND_MESSAGE, b"b")
+        # Both keys fit in the global cap, whatever the amount of budgets each uses.
+        self.assertEqual(len(limiter._buckets), 2)
+        self.assertEqual(limiter._buckets.evicted, 0)
+
+    def test_unlimited(self):
+        limiter = RateLimiter(RateLimiterConfig.unlimited())
+        for _ in range(100):
+            self.assertEqual(limiter.acquire_request(RequestCodes.REQC_CLIENT_LIST, b"a"), 0.0)
+            self.assertEqual(limiter.acquire_upload(b"a", 1024 * 1024 * 1024), 0.0)
+        self.assertEqual(limiter.throttled_requests, 0)
+
+
+class RateLimitConfigTestingClass(unittest.TestCase):
+    def load(self, values: dict):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "server.json")
+            with open(path, "w") as file:
+                json.dump(values, file)
+            return load_server_config(path)
+
+    def test_defaults(self):
+        config = self.load({})
+        self.assertEqual(config.rate_limit.request_budgets, DEFAULT_REQUEST_BUDGETS)
+        self.assertEqual(config.rate_limit.upload_budget, DEFAULT_UPLOAD_BUDGET)
+
+    def test_overrides(self):
+        config = self.load({"rate_limit": {
+            "request_budgets": {"REQC_SEND_MESSAGE": {"rate": 1, "burst": 2}, "REQC_CLIENT_LIST": None},
+            "upload_budget": None,
+            "max_keys": 10,
+        }})
+        self.assertEqual(config.rate_limit.request_budgets[RequestCodes.REQC_SEND_MESSAGE], TokenBucketBudget(1, 2))
+        self.assertNotIn(RequestCodes.REQC_CLIENT_LIST, config.rate_limit.request_budgets)
+        self.assertEqual(config.rate_limit.request_budgets[RequestCodes.REQC_PUB_KEY],
+                         DEFAULT_REQUEST_BUDGETS[RequestCodes.REQC_PUB_KEY])
+        self.assertIsNone(config.rate_limit.upload_budget)
+        self.assertEqual(config.rate_limit.max_keys, 10)
+
+    def test_disabled(self):
+        self.assertIsNone(self.load({"rate_limit": None}).rate_limit)
+
+    def test_unknownSetting(self):
+        with self.assertRaises(ValueError):
+            self.load({"rate_limit": {"max_key": 10}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import socket
+import struct
+import unittest
+
+from ServerTestCase import ServerTestCase, IP, free_port
+from Server.Capture import TraceWriter, list_trace_files
+from Server.OpCodes import RequestCodes, ResponseCodes, MessageTypes
+from Server.ProtocolDefenitions import S_PUBLIC_KEY
+from Server.Replay import load_connections, replay, report, start_server, ReplayResult
+
+
+class ReplayTestingClass(ServerTestCase):
+    def server_options(self) -> dict:
+        self.trace_directory = os.path.join(self.directory.name, "traces")
+        self.capture = TraceWriter(self.trace_directory)
+        return {"capture": self.capture}
+
+    def test_captureReplayRoundTrip(self):
+        # Users are registered straight in the DB, so the trace has only their requests.
+        _, alice = self.database.register_user("alice", os.urandom(S_PUBLIC_KEY))
+        _, bob = self.database.register_user("bob", os.urandom(S_PUBLIC_KEY))
+        db_copy = os.path.join(self.directory.name, "before.db")
+        shutil.copyfile(os.path.join(self.directory.name, "server.db"), db_copy)
+
+        content = b"hello"
+        send_payload = bob + struct.pack("<BI", MessageTypes.SEND_TEXT_MESSAGE.value, len(content)) + content
+        recorded = [
+            self.request(alice, RequestCodes.REQC_SEND_MESSAGE, send_payload)[0],
+            self.request(bob, RequestCodes.REQC_MAILBOX_STATUS)[0],
+            self.request(bob, RequestCodes.REQC_WAITING_MSGS)[0],
+        ]
+        self.assertEqual(recorded, [ResponseCodes.RESC_SEND_MESSAGE.value, ResponseCodes.RESC_MAILBOX_STATUS.value,
+                                    ResponseCodes.RESC_WAITING_MSGS.value])
+        self.capture.close()
+
+        connections = load_connections(list_trace_files(self.trace_directory))
+        self.assertEqual([connection.opcode for connection in connections],
+                         [RequestCodes.REQC_SEND_MESSAGE.value, RequestCodes.REQC_MAILBOX_STATUS.value,
+                          RequestCodes.REQC_WAITING_MSGS.value])
+
+        # A single worker replays the connections one after the other, in the recorded order.
+        port = free_port()
+        server = start_server(db_copy, port)
+        try:
+            results = replay(connections, IP, port, None, workers=1)
+        finally:
+            server.shutdown()
+            socket.create_connection((IP, port), timeout=1).close()
+        self.assertEqual(sorted(result.response_code for result in results), sorted(recorded))
+        self.assertTrue(all(result.succeeded for result in results))
+
+
+class ReplayReportTestingClass(unittest.TestCase):
+    def test_failedResponsesAreNotLatencies(self):
+        send = RequestCodes.REQC_SEND_MESSAGE.value
+        results = [ReplayResult(send, 0.001, ResponseCodes.RESC_SEND_MESSAGE.value) for _ in range(3)] + [
+            ReplayResult(send, 0.5, ResponseCodes.RESC_THROTTLED.value),
+            ReplayResult(send, 0.5, ResponseCodes.RESC_ERROR.value),
+            ReplayResult(send, None, None),
+        ]
+        line = report(results, 1.0).splitlines()[2].split()
+        self.assertEqual(line[:3], [str(send), "6", "3"])
+        # Max latency is of the successful responses only
+        self.assertEqual(float(line[7]), 1.0)
+        self.assertEqual(line[8:], ["none:1", "2003:3", "9000:1", "9001:1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
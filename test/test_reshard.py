@@ -0,0 +1,102 @@
+import os
+import unittest
+from unittest import mock
+
+from test_database import DatabaseTestCase, SEND_TEXT_MESSAGE
+from Database.Database import Database
+from Database.MessageShards import MessageIdsExhausted, read_layout, set_last_message_id, shard_of, MAX_MESSAGE_ID
+from Database.Reshard import reshard
+
+
+class ReshardTestingClass(DatabaseTestCase):
+    def mailboxes(self, users: list[str]) -> dict[str, list]:
+        return {user: [(row[2], row[3], row[5]) for row in self.database.get_messages(user)] for user in users}
+
+    def send_messages(self, users: list[str]):
+        for i, to_client in enumerate(users):
+            for j in range(3):
+                self.database.insert_message(to_client, users[(i + j + 1) % len(users)], SEND_TEXT_MESSAGE, b"%d-%d" % (i, j))
+
+    def test_reshardRoundTrip(self):
+        users = [self.register(f"user{i}") for i in range(8)]
+        self.send_messages(users)
+        before = self.mailboxes(users)
+
+        self.database.close()
+        reshard(self.db_path, 3)
+        self.database = Database(self.db_path)
+        self.assertEqual(self.database.shard_count, 3)
+        self.assertEqual(self.mailboxes(users), before)
+
+        # The shard of a message id is the shard of its recipient
+        for user in users:
+            for row in self.db_rows(user):
+                self.assertEqual(row[0] % 3, shard_of(user, 3))
+
+        # Single message operations find the shard by the id
+        message_id = self.db_rows(users[0])[0][0]
+        self.database.delete_message(message_id)
+        self.assertNotIn(message_id, [row[0] for row in self.db_rows(users[0])])
+        _, message_id = self.database.insert_message(users[1], users[0], SEND_TEXT_MESSAGE, None)
+        self.assertTrue(self.database.set_message_content(message_id, b"chunked"))
+        self.assertEqual(self.db_rows(users[1])[-1][5], b"chunked")
+        before = self.mailboxes(users)
+
+        self.database.close()
+        reshard(self.db_path, 0)
+        self.database = Database(self.db_path)
+        self.assertEqual(self.database.shard_count, 1)
+        self.assertEqual(self.mailboxes(users), before)
+
+    def test_idsAreCompacted(self):
+        users = [self.register(f"user{i}") for i in range(8)]
+        self.send_messages(users)
+        # Ids of acknowledged messages are never given again, leave a big gap.
+        for user in users:
+            self.database.delete_messages_up_to(user, self.db_rows(user)[0][0])
+        set_last_message_id(self.database._shards[0].conn, 1000000)
+        self.database._shards[0].conn.commit()
+        self.send_messages(users)
+        before = self.mailboxes(users)
+
+        self.database.close()
+        reshard(self.db_path, 3)
+        self.database = Database(self.db_path)
+        self.assertEqual(self.mailboxes(users), before)
+
+        # Local ids of every shard are 1...n again, in the order the messages had.
+        for shard in self.database._shards:
+            local_ids = [row[0] for row in shard.conn.execute("SELECT id FROM Messages ORDER BY id;")]
+            self.assertEqual(local_ids, list(range(1, len(local_ids) + 1)))
+        message_count = sum(len(self.db_rows(user)) for user in users)
+        self.assertLess(max(row[0] for user in users for row in self.db_rows(user)), 3 * (message_count + 1))
+
+    def test_exhaustedIdsAreNotInserted(self):
+        alice, bob = self.register("alice"), self.register("bob")
+        shard = self.database._shards[0]
+        set_last_message_id(shard.conn, MAX_MESSAGE_ID)
+        shard.conn.commit()
+
+        with self.assertRaises(MessageIdsExhausted):
+            self.database.insert_message(bob, alice, SEND_TEXT_MESSAGE, b"lost")
+        self.assertEqual(self.db_rows(bob), [])
+        self.assertEqual(self.database.get_mailbox_status(bob).count, 0)
+
+    def test_reshardThatRunsOutOfIdsKeepsTheLayout(self):
+        users = [self.register(f"user{i}") for i in range(8)]
+        self.send_messages(users)
+        before = self.mailboxes(users)
+
+        self.database.close()
+        with mock.patch("Database.MessageShards.MAX_MESSAGE_ID", 10):
+            with self.assertRaises(MessageIdsExhausted):
+                reshard(self.db_path, 2)
+        self.database = Database(self.db_path)
+        self.assertEqual(self.database.shard_count, 1)
+        self.assertEqual(self.mailboxes(users), before)
+        self.assertEqual(read_layout(self.database._conn), [])
+        self.assertEqual([name for name in os.listdir(self.directory.name) if ".messages." in name], [])
+
+
+if __name__ == '__main__':
+    unittest.main()